@@ -1,8 +1,6 @@
 from datetime import datetime as dt, timedelta
 import backtrader as bt
-import pandas_datareader.data as web
-from pandas_datareader.yahoo.headers import DEFAULT_HEADERS
-import requests_cache
+from prefetch import DataService
 
 
 def backtest_pandas_datareader(model):
@@ -16,15 +14,12 @@ def backtest_pandas_datareader(model):
     end_date = dt.today()
     start_date = end_date - timedelta(days = 365 )
 
-    # configure session timeout
-    expire_after = timedelta(days=3)
-    session = requests_cache.CachedSession(cache_name='cache', backend='sqlite', expire_after=expire_after)
-    session.headers = DEFAULT_HEADERS
-
-    data = web.DataReader('^DJI', 'stooq', start = start_date, end = end_date, session = session).reset_index()
+    # served from the local store, only the missing days are downloaded (and
+    # not at all if the data daemon refreshed them less than a day ago)
+    data = DataService().load('^DJI', '1d', 'stooq', start = start_date, end = end_date)
 
     # create a data feed from the Pandas DataFrame
-    data_feed = bt.feeds.PandasData(dataname=data, datetime='Date')
+    data_feed = bt.feeds.PandasData(dataname=data)
 
     # Add data and strategy to the instance
     cerebro.adddata(data_feed)
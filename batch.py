@@ -0,0 +1,135 @@
+'''
+Batch backtests of a universe of symbols times the models.py strategies.
+
+Work is split by symbol: a worker process loads the data of a symbol once
+(memory-mapped from the local OHLCV store, so the pages are shared between
+processes) and runs every strategy on it. Each result row is appended to one
+consolidated CSV table as soon as it is ready, so a run over a few thousand
+symbol/strategy pairs can be followed, and interrupted, without losing the
+finished rows.
+
+    python batch.py symbols.txt batch_results.csv
+'''
+import csv
+import json
+import logging
+import multiprocessing as mp
+import sys
+
+import backtrader as bt
+
+import models as m
+from datastore import OHLCVStore
+from prefetch import DataService
+
+STRATEGIES = [m.MACross, m.MACD, m.EMAStrategy, m.RSI_SMA_Strategy]
+
+FIELDS = ['symbol', 'strategy', 'bars', 'final_value', 'pct_change',
+          'rtot', 'ravg', 'rnorm', 'rnorm100', 'time_return', 'error']
+
+# Per worker state, set by _init_worker
+_worker = {}
+
+
+def run_strategy(data, strategy, cash=10000, commission=0.001, **params):
+    '''
+    Backtest `strategy` on `data` (DataFrame with a datetime index) with the
+    setup of test_trading_strategies.py and return the results row
+    '''
+    cerebro = bt.Cerebro(stdstats=False, cheat_on_open=True)
+    cerebro.addstrategy(strategy, **params)
+    cerebro.broker.set_cash(cash)
+    cerebro.broker.setcommission(commission=commission)
+    cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
+    cerebro.addanalyzer(bt.analyzers.TimeReturn, _name='time_return',
+                        timeframe=bt.TimeFrame.Years)
+    cerebro.adddata(bt.feeds.PandasData(dataname=data))
+    strat = cerebro.run()[0]
+
+    final_amount = cerebro.broker.getvalue()
+    returns = strat.analyzers.returns.get_analysis()
+    time_return = strat.analyzers.time_return.get_analysis()
+    return dict(
+        strategy=strategy.__name__,
+        bars=len(data),
+        final_value=final_amount,
+        pct_change=(final_amount - cash) / cash * 100.0,
+        rtot=returns.get('rtot'),
+        ravg=returns.get('ravg'),
+        rnorm=returns.get('rnorm'),
+        rnorm100=returns.get('rnorm100'),
+        time_return=json.dumps({d.year: r for d, r in time_return.items()}),
+    )
+
+
+def _init_worker(root, timeframe, start, end, update, source, strategies, cash,
+                 commission):
+    # Switch off the per-order logging of the strategies
+    m.LOG_TRADES = False
+    logging.disable(logging.INFO)
+    # downloads go through the data service, under the lock of the series
+    # (shared with the data daemon and the other workers)
+    _worker.update(service=DataService(OHLCVStore(root)), timeframe=timeframe,
+                   start=start, end=end, update=update, source=source,
+                   strategies=strategies, cash=cash, commission=commission)
+
+
+def _run_symbol(symbol):
+    w = _worker
+    service, timeframe = w['service'], w['timeframe']
+    store = service.store
+    try:
+        if w['update']:
+            # skipped when the series is fresh and goes back to `start`
+            service.refresh(symbol, timeframe, w['source'], max_age=None, start=w['start'])
+        # one data load for all the strategies of the symbol
+        data = store.frame(symbol, timeframe, w['start'], w['end'])
+        if not len(data):
+            raise ValueError(f'no {timeframe} data for {symbol}')
+    except Exception as e:
+        return [dict(symbol=symbol, strategy=s.__name__, error=repr(e))
+                for s in w['strategies']]
+
+    rows = []
+    for strategy in w['strategies']:
+        try:
+            row = run_strategy(data, strategy, w['cash'], w['commission'])
+        except Exception as e:
+            row = dict(strategy=strategy.__name__, error=repr(e))
+        rows.append(dict(row, symbol=symbol))
+    return rows
+
+
+def run_batch(symbols, strategies=STRATEGIES, out='batch_results.csv',
+              timeframe='1d', start=None, end=None, store=None, update=False,
+              processes=None, cash=10000, commission=0.001, source='stooq'):
+    '''
+    Backtest every symbol with every strategy on a pool of `processes`
+    workers (all cores by default). Data is read from `store` (the default
+    OHLCVStore), refreshed first from `source` (see prefetch.DataService) if
+    `update`. The rows are written to `out` as they finish and returned at
+    the end.
+    '''
+    root = (store or OHLCVStore()).root
+    initargs = (root, timeframe, start, end, update, source, list(strategies), cash,
+                commission)
+    rows = []
+    # recycle the workers now and then to bound the memory of long runs
+    with mp.Pool(processes, initializer=_init_worker, initargs=initargs,
+                 maxtasksperchild=200) as pool, open(out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for symbol_rows in pool.imap_unordered(_run_symbol, list(symbols)):
+            writer.writerows(symbol_rows)
+            f.flush()
+            rows.extend(symbol_rows)
+    return rows
+
+
+if __name__ == '__main__':
+    # python batch.py symbols.txt [out.csv]: one Stooq symbol per line
+    with open(sys.argv[1]) as f:
+        symbols = [line.strip() for line in f if line.strip()]
+    out = sys.argv[2] if len(sys.argv) > 2 else 'batch_results.csv'
+    rows = run_batch(symbols, out=out, update=True)
+    print(f'{len(rows)} backtests written to {out}')
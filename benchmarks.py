@@ -0,0 +1,334 @@
+'''
+Benchmark suite for the strategies, indicators and data loading paths.
+
+Every case runs in a fresh process on deterministic synthetic data (see
+synthetic.py) of increasing length, and reports the wall time, bars per
+second and the peak resident memory of that process. The results are saved
+as JSON so two versions can be compared:
+
+    python benchmarks.py run --sizes 1000 10000 100000 --out bench_new.json
+    python benchmarks.py compare bench_old.json bench_new.json
+    python benchmarks.py startup --budget 0.5
+
+Cases:
+
+  cerebro:<Strategy>     Cerebro run of each models.py strategy (only up to
+                         --cerebro-max-bars bars, 100k by default: 10M bars
+                         take about an hour per strategy)
+  vectorized:<Strategy>  same strategy with the vectorized engine
+  talib_block            talib MACD/RSI/ADX over the whole series (the block
+                         the live loop used to recompute on every iteration)
+  streaming_indicators   the same indicators updated candle by candle
+  load:store             read the series back from the local OHLCV store
+  load:csv               parse the same series from a CSV file
+  load:stooq             download from Stooq (network, only with --network)
+
+`startup` measures the cold start of `cli.py signal` (fresh interpreter to
+the signal of the last stored candle) and fails when it is over the budget.
+It also lists the heavy libraries the command imported, which should be none.
+'''
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+# largest series the Cerebro cases run on unless asked for more
+CEREBRO_MAX_BARS = 100_000
+STRATEGIES = ['MACross', 'MACD', 'EMAStrategy', 'RSI_SMA_Strategy']
+
+# seconds from process start to the first signal of `cli.py signal`
+STARTUP_BUDGET = 0.5
+HEAVY_MODULES = ('pandas', 'backtrader', 'ccxt', 'talib', 'pandas_datareader',
+                 'requests_cache', 'matplotlib')
+
+
+# temporary directories of the case being measured, removed after it
+_temp_dirs = []
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KB on Linux, in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0
+
+
+# ---------------------------------------------------------------------------
+# Cases: prepare(n) -> state (not timed), run(state) (timed)
+# ---------------------------------------------------------------------------
+
+def _tempdir(prefix):
+    path = tempfile.mkdtemp(prefix=prefix)
+    _temp_dirs.append(path)
+    return path
+
+
+def _data(n):
+    from synthetic import synthetic_ohlcv
+    return synthetic_ohlcv(n)
+
+
+def _cerebro(strategy_name):
+    def prepare(n):
+        import models as m
+        m.LOG_TRADES = False
+        logging.disable(logging.INFO)
+        return getattr(m, strategy_name), _data(n)
+
+    def run(state):
+        import backtrader as bt
+        strategy, data = state
+        cerebro = bt.Cerebro(stdstats=False, cheat_on_open=True)
+        cerebro.addstrategy(strategy)
+        cerebro.broker.set_cash(10000)
+        cerebro.broker.setcommission(commission=0.001)
+        cerebro.adddata(bt.feeds.PandasData(dataname=data))
+        cerebro.run()
+    return prepare, run
+
+
+def _vectorized(strategy_name):
+    def prepare(n):
+        import models as m
+        return getattr(m, strategy_name), _data(n)
+
+    def run(state):
+        import vectorized
+        strategy, data = state
+        vectorized.backtest(strategy, data, cash=10000, commission=0.001)
+    return prepare, run
+
+
+def _talib_prepare(n):
+    data = _data(n)
+    return data['high'].to_numpy(), data['low'].to_numpy(), data['close'].to_numpy()
+
+
+def _talib_run(state):
+    import talib
+    high, low, close = state
+    talib.MACD(close, fastperiod=12, slowperiod=26, signalperiod=9)
+    talib.RSI(close, timeperiod=14)
+    talib.ADX(high, low, close, timeperiod=14)
+
+
+def _streaming_run(state):
+    from streaming import LiveIndicators
+    high, low, close = state
+    indicators = LiveIndicators()
+    update = indicators.update
+    for i, (h, l, c) in enumerate(zip(high.tolist(), low.tolist(), close.tolist())):
+        update(i, h, l, c)
+
+
+def _store_prepare(n):
+    from datastore import OHLCVStore
+    root = _tempdir('bench_store_')
+    store = OHLCVStore(root)
+    store.append('BENCH', '1m', _data(n))
+    return root
+
+
+def _store_run(root):
+    from datastore import OHLCVStore
+    data = OHLCVStore(root).frame('BENCH', '1m')
+    float(data['close'].iloc[-1])  # touch the data
+
+
+def _csv_prepare(n):
+    path = os.path.join(_tempdir('bench_csv_'), 'bench.csv')
+    _data(n).to_csv(path)
+    return path
+
+
+def _csv_run(path):
+    import pandas as pd
+    pd.read_csv(path, index_col='Date', parse_dates=True)
+
+
+def _stooq_prepare(n):
+    return None
+
+
+def _stooq_run(state):
+    from pandas_datareader.stooq import StooqDailyReader
+    StooqDailyReader('MSTR.US').read()
+
+
+CASES = {}
+for _name in STRATEGIES:
+    CASES['cerebro:' + _name] = _cerebro(_name)
+    CASES['vectorized:' + _name] = _vectorized(_name)
+CASES['talib_block'] = (_talib_prepare, _talib_run)
+CASES['streaming_indicators'] = (_talib_prepare, _streaming_run)
+CASES['load:store'] = (_store_prepare, _store_run)
+CASES['load:csv'] = (_csv_prepare, _csv_run)
+NETWORK_CASES = {'load:stooq': (_stooq_prepare, _stooq_run)}
+
+
+def _measure(name, n, repeat):
+    # runs in a fresh (spawned) process
+    prepare, run = CASES.get(name) or NETWORK_CASES[name]
+    try:
+        state = prepare(n)
+        baseline = _peak_rss_mb()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run(state)
+            times.append(time.perf_counter() - start)
+    finally:
+        while _temp_dirs:
+            shutil.rmtree(_temp_dirs.pop(), ignore_errors=True)
+    seconds = min(times)
+    bars = n if name not in NETWORK_CASES else None
+    return dict(
+        name=name,
+        bars=bars,
+        seconds=seconds,
+        bars_per_sec=bars / seconds if bars and seconds > 0 else None,
+        peak_rss_mb=_peak_rss_mb(),
+        baseline_rss_mb=baseline,
+        repeat=repeat,
+    )
+
+
+def _meta():
+    meta = dict(time=time.strftime('%Y-%m-%dT%H:%M:%S'), python=platform.python_version(),
+                platform=platform.platform(), cpu_count=os.cpu_count())
+    for module in ('numpy', 'pandas', 'backtrader', 'talib'):
+        try:
+            meta[module] = __import__(module).__version__
+        except Exception:
+            meta[module] = None
+    try:
+        meta['commit'] = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        meta['commit'] = None
+    return meta
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, cases=None, network=False,
+                   out='benchmarks.json', timeout=None,
+                   cerebro_max_bars=CEREBRO_MAX_BARS):
+    '''
+    Run the cases for every size and save the results to `out` (JSON). The
+    Cerebro cases skip the sizes over `cerebro_max_bars` (None: no limit).
+    '''
+    names = list(cases or CASES)
+    if network:
+        names += list(NETWORK_CASES)
+    results = []
+    ctx = mp.get_context('spawn')
+    for name in names:
+        for n in (sizes if name not in NETWORK_CASES else [0]):
+            if (name.startswith('cerebro:') and cerebro_max_bars is not None
+                    and n > cerebro_max_bars):
+                print(f"{name:<30} {n!s:>10}  skipped (over --cerebro-max-bars)")
+                continue
+            # best of 3 for the fast cases
+            repeat = 3 if n <= 100_000 else 1
+            with ctx.Pool(1) as pool:
+                try:
+                    result = pool.apply_async(_measure, (name, n, repeat)).get(timeout)
+                except mp.TimeoutError:
+                    result = dict(name=name, bars=n, error='timeout')
+                except Exception as e:
+                    result = dict(name=name, bars=n, error=repr(e))
+            results.append(result)
+            _print(result)
+            # save as we go, a long run can be interrupted
+            with open(out, 'w') as f:
+                json.dump(dict(meta=_meta(), results=results), f, indent=2)
+    return results
+
+
+def _print(r):
+    if 'error' in r:
+        print(f"{r['name']:<30} {r['bars']!s:>10}  {r['error']}")
+        return
+    bps = f"{r['bars_per_sec']:>14,.0f}" if r['bars_per_sec'] else ' ' * 14
+    print(f"{r['name']:<30} {r['bars']!s:>10} {r['seconds']:>10.4f}s {bps} bars/s "
+          f"{r['peak_rss_mb']:>9.1f} MB")
+
+
+def compare(old_path, new_path):
+    '''Print the speed and memory ratios of two result files'''
+    with open(old_path) as f:
+        old = {(r['name'], r['bars']): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = json.load(f)['results']
+    print(f"{'case':<30} {'bars':>10} {'speedup':>9} {'memory':>9}")
+    for r in new:
+        o = old.get((r['name'], r['bars']))
+        if o is None or 'error' in o or 'error' in r:
+            continue
+        speedup = o['seconds'] / r['seconds'] if r['seconds'] else float('inf')
+        memory = r['peak_rss_mb'] / o['peak_rss_mb'] if o['peak_rss_mb'] else float('nan')
+        flag = '  <-- slower' if speedup < 0.9 else ''
+        print(f"{r['name']:<30} {r['bars']!s:>10} {speedup:>8.2f}x {memory:>8.2f}x{flag}")
+
+
+def startup(budget=STARTUP_BUDGET, repeat=5, bars=1000):
+    '''Cold start of `cli.py signal` against a store of `bars` synthetic candles'''
+    from datastore import OHLCVStore
+    from synthetic import synthetic_ohlcv
+
+    with tempfile.TemporaryDirectory(prefix='bench_startup_') as root:
+        OHLCVStore(root).append('BENCH', '1h', synthetic_ohlcv(bars, freq='1h'))
+        cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+        args = [cli, '--store', root, 'signal', 'BENCH', '1h']
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + args, check=True, stdout=subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+        # lines of -X importtime: 'import time: self | cumulative | module'
+        trace = subprocess.run([sys.executable, '-X', 'importtime'] + args, check=True,
+                               capture_output=True, text=True).stderr
+    imported = {line.rsplit('|', 1)[-1].strip() for line in trace.splitlines() if '|' in line}
+    times.sort()
+    result = dict(name='startup:signal', seconds=times[0], median=times[len(times) // 2],
+                  budget=budget, heavy=[m for m in HEAVY_MODULES if m in imported])
+    result['ok'] = result['median'] <= budget
+    print(f"{result['name']:<30} {result['seconds']:.3f}s (median {result['median']:.3f}s, "
+          f"budget {budget:.3f}s) heavy imports: {', '.join(result['heavy']) or 'none'}"
+          f"{'' if result['ok'] else '  <-- over budget'}")
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_run = sub.add_parser('run')
+    p_run.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    p_run.add_argument('--cases', nargs='+', choices=sorted(CASES), default=None)
+    p_run.add_argument('--network', action='store_true', help='include the Stooq download')
+    p_run.add_argument('--timeout', type=float, default=None, help='seconds per case')
+    p_run.add_argument('--cerebro-max-bars', type=int, default=CEREBRO_MAX_BARS,
+                       help='largest size the Cerebro cases run on (0: no limit)')
+    p_run.add_argument('--out', default='benchmarks.json')
+    p_cmp = sub.add_parser('compare')
+    p_cmp.add_argument('old')
+    p_cmp.add_argument('new')
+    p_start = sub.add_parser('startup')
+    p_start.add_argument('--budget', type=float, default=STARTUP_BUDGET, help='seconds')
+    p_start.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    if args.command == 'run':
+        run_benchmarks(args.sizes, args.cases, args.network, args.out, args.timeout,
+                       args.cerebro_max_bars or None)
+    elif args.command == 'startup':
+        sys.exit(0 if startup(args.budget, args.repeat)['ok'] else 1)
+    else:
+        compare(args.old, args.new)
@@ -0,0 +1,244 @@
+'''
+Command line entry point of the bot and the backtests.
+
+    python cli.py fetch MSTR.US AAPL.US                 # Stooq daily candles
+    python cli.py fetch BTC/USDT --timeframe 1h --source binance
+    python cli.py daemon MSTR.US:1d:stooq BTC/USDT:1h:binance
+    python cli.py backtest MSTR.US --strategy MACD EMAStrategy --engine vectorized
+    python cli.py backtest AAPL.US MSFT.US SPY.US --portfolio
+    python cli.py optimize MSTR.US --strategy MACD --grid macd1=8,12 macd2=21,26
+    python cli.py signal BTC/USDT 1h                    # signal of the last stored candle
+    python cli.py live                                  # trade_execution.py
+    python cli.py live --paper BTC/USDT:1h --speed 36000
+
+Only argparse is imported up front; every command imports what it uses when
+it runs (backtrader for Cerebro runs, ccxt for the exchange, ...), so
+`signal` and `fetch` do not pay for the backtest stack and vice versa. The
+cold start of `signal` is kept under a budget by `benchmarks.py startup`.
+'''
+import argparse
+import sys
+
+
+def _value(text):
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+
+def _grid(items):
+    # ['macd1=8,12', 'atrdist=2.0,3.0'] -> dict(macd1=[8, 12], atrdist=[2.0, 3.0])
+    grid = {}
+    for item in items:
+        name, _, values = item.partition('=')
+        grid[name] = [_value(v) for v in values.split(',')]
+    return grid
+
+
+def _load(args, symbol):
+    from datastore import OHLCVStore
+    from prefetch import DataService
+
+    store = OHLCVStore(args.store)
+    if args.update:
+        data = DataService(store).load(symbol, args.timeframe, args.source, args.start, args.end)
+    else:
+        data = store.frame(symbol, args.timeframe, args.start, args.end)
+    if not len(data):
+        sys.exit(f'no {args.timeframe} data for {symbol} in {store.root} (run fetch first)')
+    return data
+
+
+def _print_stats(title, stats):
+    print(title)
+    for name, value in stats.items():
+        print(f'  {name:<18} {value:.6g}' if isinstance(value, float) else f'  {name:<18} {value}')
+
+
+def cmd_fetch(args):
+    from datastore import OHLCVStore
+    from prefetch import DataService
+
+    service = DataService(OHLCVStore(args.store))
+    for symbol in args.symbols:
+        added = service.refresh(symbol, args.timeframe, args.source, start=args.start)
+        print(f'{symbol} {args.timeframe}: {added} new candles, '
+              f'{service.store.size(symbol, args.timeframe)} stored')
+
+
+def cmd_daemon(args):
+    import asyncio
+    import logging
+
+    from datastore import OHLCVStore
+    from prefetch import DataService
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    jobs = [job.rsplit(':', 2) for job in args.jobs]
+    for job in jobs:
+        if len(job) != 3:
+            sys.exit(f'expected SYMBOL:TIMEFRAME:SOURCE, got {":".join(job)}')
+    service = DataService(OHLCVStore(args.store), jobs, delay=args.delay,
+                          concurrency=args.concurrency)
+    asyncio.run(service.run(once=args.once))
+
+
+def cmd_backtest(args):
+    import vectorized
+    from recorder import Recorder
+
+    if args.portfolio:
+        from portfolio import run_portfolio
+
+        data = {symbol: _load(args, symbol) for symbol in args.symbols}
+        result = run_portfolio(data, args.strategy, cash=args.cash, commission=args.commission)
+        _print_stats(f'portfolio of {len(result.sleeves)} sleeves', result.stats())
+        return
+
+    for symbol in args.symbols:
+        data = _load(args, symbol)
+        for name in args.strategy:
+            if args.engine == 'vectorized':
+                rec = Recorder.from_result(vectorized.backtest(name, data, cash=args.cash,
+                                                               commission=args.commission))
+            else:
+                import backtrader as bt
+                import models as m
+                from recorder import RecorderAnalyzer
+
+                m.LOG_TRADES = args.verbose
+                cerebro = bt.Cerebro(stdstats=False, cheat_on_open=True)
+                cerebro.addstrategy(getattr(m, name))
+                cerebro.broker.set_cash(args.cash)
+                cerebro.broker.setcommission(commission=args.commission)
+                cerebro.adddata(bt.feeds.PandasData(dataname=data))
+                cerebro.addanalyzer(RecorderAnalyzer, _name='recorder')
+                rec = cerebro.run()[0].analyzers.recorder.get_analysis()
+            _print_stats(f'{symbol} {name} ({args.engine})', rec.stats())
+            if args.out:
+                rec.save(f'{args.out}/{symbol}_{name}')
+
+
+def cmd_optimize(args):
+    import models as m
+    from optimization import optimize
+
+    m.LOG_TRADES = False
+    data = _load(args, args.symbol)
+    rows = optimize(getattr(m, args.strategy), _grid(args.grid), data, out=args.out,
+                    processes=args.processes, cash=args.cash,
+                    commission=args.commission, engine=args.engine)
+    for row in rows[:args.top]:
+        print(row)
+
+
+def cmd_signal(args):
+    from core import SignalCore
+    from datastore import OHLCVStore
+    from streaming import LiveIndicators
+
+    store = OHLCVStore(args.store)
+    candles = store.read(args.symbol, args.timeframe, last=args.bars)
+    if not len(candles['timestamp']):
+        sys.exit(f'no {args.timeframe} data for {args.symbol} in {store.root}')
+    core = SignalCore(LiveIndicators(confirmation_candles=args.confirmation_candles),
+                      adx_threshold=args.adx_threshold)
+    core.indicators.update_many(candles)
+    print(f'{args.symbol} {args.timeframe} {int(candles["timestamp"][-1])}: {core.signal() or "none"}')
+
+
+def cmd_live(args):
+    import asyncio
+
+    if not args.paper:
+        import trade_execution
+        asyncio.run(trade_execution.main())
+        return
+
+    from datastore import OHLCVStore
+    from paper import PaperExchange, replay
+
+    pairs = [tuple(p.rsplit(':', 1)) for p in args.paper]
+    exchange = PaperExchange.from_store(OHLCVStore(args.store), pairs, speed=args.speed)
+    print(asyncio.run(replay(exchange, pairs)))
+
+
+def parser():
+    p = argparse.ArgumentParser(description='Trading bot and backtests')
+    p.add_argument('--store', default=None, help='OHLCV store directory (default $OHLCV_STORE or ohlcv)')
+    sub = p.add_subparsers(dest='command', required=True)
+
+    def data_args(sp):
+        sp.add_argument('--timeframe', default='1d')
+        sp.add_argument('--start', default=None)
+        sp.add_argument('--end', default=None)
+        sp.add_argument('--update', action='store_true', help='download the missing candles first')
+        sp.add_argument('--source', default='stooq', help="'stooq', a ccxt exchange id or 'stub'")
+        sp.add_argument('--cash', type=float, default=10000)
+        sp.add_argument('--commission', type=float, default=0.001)
+
+    sp = sub.add_parser('fetch', help='download candles to the local store')
+    sp.add_argument('symbols', nargs='+')
+    sp.add_argument('--timeframe', default='1d')
+    sp.add_argument('--source', default='stooq', help="'stooq', a ccxt exchange id or 'stub'")
+    sp.add_argument('--start', default=None, help='also fetch the history back to this date')
+    sp.set_defaults(func=cmd_fetch)
+
+    sp = sub.add_parser('daemon', help='keep series of the store refreshed in the background')
+    sp.add_argument('jobs', nargs='+', metavar='SYMBOL:TIMEFRAME:SOURCE')
+    sp.add_argument('--delay', type=float, default=5.0, help='seconds after a candle closes')
+    sp.add_argument('--concurrency', type=int, default=4)
+    sp.add_argument('--once', action='store_true', help='refresh everything once and exit')
+    sp.set_defaults(func=cmd_daemon)
+
+    sp = sub.add_parser('backtest', help='backtest strategies on stored candles')
+    sp.add_argument('symbols', nargs='+')
+    sp.add_argument('--strategy', nargs='+', default=['MACross', 'MACD', 'EMAStrategy', 'RSI_SMA_Strategy'])
+    sp.add_argument('--engine', choices=('cerebro', 'vectorized'), default='cerebro')
+    sp.add_argument('--portfolio', action='store_true', help='all symbols on one shared cash ledger')
+    sp.add_argument('--out', default=None, help='directory to save the recorded results to')
+    sp.add_argument('--verbose', action='store_true', help='log every order/trade')
+    data_args(sp)
+    sp.set_defaults(func=cmd_backtest)
+
+    sp = sub.add_parser('optimize', help='parameter sweep of a strategy')
+    sp.add_argument('symbol')
+    sp.add_argument('--strategy', required=True)
+    sp.add_argument('--grid', nargs='+', required=True, help='name=v1,v2,...')
+    sp.add_argument('--engine', choices=('cerebro', 'vectorized'), default=None,
+                    help='default: vectorized when it supports the strategy')
+    sp.add_argument('--processes', type=int, default=None)
+    sp.add_argument('--out', default='optimization.csv')
+    sp.add_argument('--top', type=int, default=10)
+    data_args(sp)
+    sp.set_defaults(func=cmd_optimize)
+
+    sp = sub.add_parser('signal', help='signal of the live rules on the last stored candle')
+    sp.add_argument('symbol')
+    sp.add_argument('timeframe')
+    sp.add_argument('--bars', type=int, default=1000, help='candles to warm the indicators up with')
+    sp.add_argument('--confirmation-candles', type=int, default=48)
+    sp.add_argument('--adx-threshold', type=float, default=25)
+    sp.set_defaults(func=cmd_signal)
+
+    sp = sub.add_parser('live', help='run the live bot (trade_execution.py)')
+    sp.add_argument('--paper', nargs='+', default=None, metavar='SYMBOL:TIMEFRAME',
+                    help='replay stored candles on a paper exchange instead')
+    sp.add_argument('--speed', type=float, default=3600.0)
+    sp.set_defaults(func=cmd_live)
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if args.store is None:
+        from datastore import DEFAULT_ROOT
+        args.store = DEFAULT_ROOT
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+'''
+Event-driven core of the live MACD/RSI/ADX rules of trade_execution.py.
+
+SignalCore reacts to closed bars and emits OrderIntents; it owns the
+indicator state, the position and the cooldown, and knows nothing about how
+orders are executed. The same core drives:
+
+  - the live ccxt loop (live.LiveRunner)
+  - backtrader (models.LiveRules)
+  - replay backtests over NumPy arrays (vectorized.replay_core)
+
+so the three can not drift apart. Only the live rules run on a core so far:
+the other strategies of models.py do not (and can not trade live) yet. An
+adapter feeds every closed bar to on_bar() (or update() then decide()),
+executes the intents in order and reports each one back with filled() or
+cancelled(). No new signal is taken while intents are pending.
+
+Rules: a bullish (bearish) MACD crossover, confirmed once the MACD has
+stayed above (below) its signal line for `confirmation_candles` bars from the
+crossover on, with RSI above (below) 50 and ADX above `adx_threshold` on the
+confirming bar, closes a short (long) position and opens a long (short) one
+worth `trade_value`. After a signal no new one is taken for `cooldown`
+seconds of bar time.
+'''
+from collections import namedtuple
+
+from streaming import LiveIndicators
+
+# side: 'buy' or 'sell'
+# action: 'close' (`amount` of the open position) or 'open' (for `value` in
+#         quote currency, the adapter sizes it with its price)
+# timestamp: open time (ms) of the bar that gave the signal
+OrderIntent = namedtuple('OrderIntent', 'side action amount value timestamp')
+
+
+class SignalCore(object):
+
+    def __init__(self, indicators=None, trade_value=1000, adx_threshold=25,
+                 cooldown=172800):
+        self.indicators = indicators or LiveIndicators()
+        self.trade_value = trade_value
+        self.adx_threshold = adx_threshold
+        self.cooldown = cooldown  # seconds without new orders after a signal
+
+        self.position = None  # None, 'long' or 'short'
+        self.amount = None  # size of the open position
+        self.cooldown_until = None  # bar time (ms) the cooldown ends
+        self.pending = []  # intents not filled/cancelled yet
+
+    def signal(self):
+        ''''long', 'short' or None for the latest bar'''
+        ind = self.indicators
+        if not len(ind.rsi):
+            return None
+        rsi, adx = ind.rsi[-1], ind.adx[-1]
+        # Bullish MACD crossover confirmed on this bar, RSI above 50 and ADX above the threshold
+        if ind.bullish_confirmed():
+            if rsi > 50 and adx > self.adx_threshold:
+                return 'long'
+        # Bearish MACD crossover confirmed on this bar, RSI below 50 and ADX above the threshold
+        elif ind.bearish_confirmed():
+            if rsi < 50 and adx > self.adx_threshold:
+                return 'short'
+        return None
+
+    def cooling_down(self, timestamp):
+        return self.cooldown_until is not None and timestamp < self.cooldown_until
+
+    def update(self, timestamp, high, low, close):
+        self.indicators.update(timestamp, high, low, close)
+
+    def decide(self, timestamp):
+        '''Intents for the bar at `timestamp` (already fed to update())'''
+        side = self.signal()
+        if side is None or self.pending or self.cooling_down(timestamp):
+            return []
+        self.cooldown_until = timestamp + self.cooldown * 1000
+        if side == 'long':
+            # Close a short position, if any, then go long
+            close_side, open_side, opposite = 'buy', 'buy', 'short'
+        else:
+            # Close a long position, if any, then go short
+            close_side, open_side, opposite = 'sell', 'sell', 'long'
+        intents = []
+        if self.position == opposite:
+            intents.append(OrderIntent(close_side, 'close', self.amount, None, timestamp))
+        if self.position != side:
+            intents.append(OrderIntent(open_side, 'open', None, self.trade_value, timestamp))
+        self.pending = list(intents)
+        return intents
+
+    def on_bar(self, timestamp, high, low, close):
+        '''Feed a closed bar, return the OrderIntents to execute, in order'''
+        self.update(timestamp, high, low, close)
+        return self.decide(timestamp)
+
+    def filled(self, intent, amount):
+        '''`intent` was executed for `amount` (base currency, > 0)'''
+        if intent in self.pending:
+            self.pending.remove(intent)
+        if intent.action == 'close':
+            self.position = None
+            self.amount = None
+        else:
+            self.position = 'long' if intent.side == 'buy' else 'short'
+            self.amount = amount
+
+    def cancelled(self, intent):
+        '''`intent` could not be executed (the position is unchanged)'''
+        if intent in self.pending:
+            self.pending.remove(intent)
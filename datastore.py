@@ -0,0 +1,246 @@
+'''
+Local columnar OHLCV store.
+
+Every symbol/timeframe pair is a directory with one .npy file per column
+(timestamp in ms since epoch, open, high, low, close, volume). Reads map the
+files with np.load(mmap_mode='r') and return slices of the maps, so loading a
+range does not copy or parse anything. New candles are appended in place and
+only the range missing after the last stored candle is fetched.
+
+    store = OHLCVStore()
+    store.update('MSTR.US', '1d', stooq_fetcher('MSTR.US'))
+    data = store.frame('MSTR.US', '1d', start=dt(2022, 1, 1))
+'''
+import os
+import time
+
+import numpy as np
+
+from lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+DTYPES = dict(timestamp=np.dtype('<i8'))
+DEFAULT_DTYPE = np.dtype('<f8')
+
+# Fixed size .npy header, large enough for any shape, so the row count can be
+# rewritten in place when appending
+HEADER_SIZE = 128
+MAGIC = b'\x93NUMPY\x01\x00'
+
+DEFAULT_ROOT = os.environ.get('OHLCV_STORE', 'ohlcv')
+
+
+def to_ms(value):
+    '''datetime/Timestamp/str/int(ms) -> int ms since epoch'''
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return int(pd.Timestamp(value).value // 1_000_000)
+
+
+def _header(dtype, n):
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (dtype.str, n)
+    header = header.ljust(HEADER_SIZE - len(MAGIC) - 2 - 1) + '\n'
+    return MAGIC + len(header).to_bytes(2, 'little') + header.encode('latin1')
+
+
+class OHLCVStore(object):
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+        self._maps = {}  # (symbol, timeframe) -> (size, dict of memmaps)
+
+    def path(self, symbol, timeframe):
+        safe = symbol.replace('/', '_').replace('^', '_')
+        return os.path.join(self.root, safe, timeframe)
+
+    def _file(self, symbol, timeframe, column):
+        return os.path.join(self.path(symbol, timeframe), column + '.npy')
+
+    # -- reading ------------------------------------------------------------
+
+    def size(self, symbol, timeframe):
+        path = self._file(symbol, timeframe, 'timestamp')
+        if not os.path.exists(path):
+            return 0
+        return (os.path.getsize(path) - HEADER_SIZE) // DTYPES['timestamp'].itemsize
+
+    def columns(self, symbol, timeframe):
+        '''All stored candles as a dict of read-only memory maps'''
+        key = (symbol, timeframe)
+        n = self.size(symbol, timeframe)
+        cached = self._maps.get(key)
+        if cached is not None and cached[0] == n:
+            return cached[1]
+        if n == 0:
+            return {c: np.empty(0, DTYPES.get(c, DEFAULT_DTYPE)) for c in COLUMNS}
+        # the timestamp column is written last, so it bounds the valid rows
+        maps = {c: np.load(self._file(symbol, timeframe, c), mmap_mode='r')[:n]
+                for c in COLUMNS}
+        self._maps[key] = (n, maps)
+        return maps
+
+    def read(self, symbol, timeframe, start=None, end=None, last=None):
+        '''
+        Zero-copy slice of the stored candles between start and end
+        (inclusive) or the `last` n candles, as a dict of arrays
+        '''
+        cols = self.columns(symbol, timeframe)
+        ts = cols['timestamp']
+        lo = 0 if start is None else int(np.searchsorted(ts, to_ms(start), 'left'))
+        hi = len(ts) if end is None else int(np.searchsorted(ts, to_ms(end), 'right'))
+        if last is not None:
+            lo = max(lo, hi - last)
+        return {c: cols[c][lo:hi] for c in COLUMNS}
+
+    def frame(self, symbol, timeframe, start=None, end=None, last=None):
+        '''DataFrame indexed by datetime, ready for bt.feeds.PandasData'''
+        cols = self.read(symbol, timeframe, start, end, last)
+        index = pd.DatetimeIndex(pd.to_datetime(cols['timestamp'], unit='ms'), name='Date')
+        return pd.DataFrame({c: cols[c] for c in COLUMNS[1:]}, index=index, copy=False)
+
+    def first_timestamp(self, symbol, timeframe):
+        ts = self.columns(symbol, timeframe)['timestamp']
+        return int(ts[0]) if len(ts) else None
+
+    def last_timestamp(self, symbol, timeframe):
+        ts = self.columns(symbol, timeframe)['timestamp']
+        return int(ts[-1]) if len(ts) else None
+
+    # -- writing ------------------------------------------------------------
+
+    def _write(self, symbol, timeframe, data):
+        # (Re)write all columns from scratch
+        os.makedirs(self.path(symbol, timeframe), exist_ok=True)
+        for c in ('open', 'high', 'low', 'close', 'volume', 'timestamp'):
+            dtype = DTYPES.get(c, DEFAULT_DTYPE)
+            values = np.ascontiguousarray(data[c], dtype=dtype)
+            tmp = self._file(symbol, timeframe, c) + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(_header(dtype, len(values)))
+                f.write(values.tobytes())
+            os.replace(tmp, self._file(symbol, timeframe, c))
+        self._maps.pop((symbol, timeframe), None)
+
+    def append(self, symbol, timeframe, data):
+        '''
+        Append candles (dict/DataFrame with the COLUMNS, timestamp in ms)
+        that are newer than the last stored one. Returns the number of rows
+        added.
+        '''
+        data = _normalize(data)
+        n = self.size(symbol, timeframe)
+        if n == 0:
+            if len(data['timestamp']):
+                self._write(symbol, timeframe, data)
+            return len(data['timestamp'])
+
+        last = self.last_timestamp(symbol, timeframe)
+        new = data['timestamp'] > last
+        if not new.any():
+            return 0
+        # timestamp goes last so readers never see a row before all of its
+        # columns are on disk
+        for c in ('open', 'high', 'low', 'close', 'volume', 'timestamp'):
+            dtype = DTYPES.get(c, DEFAULT_DTYPE)
+            values = np.ascontiguousarray(data[c][new], dtype=dtype)
+            with open(self._file(symbol, timeframe, c), 'r+b') as f:
+                f.seek(HEADER_SIZE + n * dtype.itemsize)
+                f.write(values.tobytes())
+                f.truncate()
+                f.seek(0)
+                f.write(_header(dtype, n + len(values)))
+        self._maps.pop((symbol, timeframe), None)
+        return int(new.sum())
+
+    def prepend(self, symbol, timeframe, data):
+        '''Add candles older than the first stored one (rewrites the files)'''
+        data = _normalize(data)
+        first = self.first_timestamp(symbol, timeframe)
+        if first is None:
+            return self.append(symbol, timeframe, data)
+        old = data['timestamp'] < first
+        if not old.any():
+            return 0
+        stored = self.columns(symbol, timeframe)
+        merged = {c: np.concatenate((data[c][old], stored[c])) for c in COLUMNS}
+        self._write(symbol, timeframe, merged)
+        return int(old.sum())
+
+    def update(self, symbol, timeframe, fetch, start=None, end=None):
+        '''
+        Fetch only the missing ranges with fetch(start_ms, end_ms) -> candles
+        and store them. Returns the number of rows added.
+        '''
+        start, end = to_ms(start), to_ms(end)
+        first = self.first_timestamp(symbol, timeframe)
+        if first is None:
+            return self.append(symbol, timeframe, fetch(start, end))
+        added = 0
+        if start is not None and start < first:
+            added += self.prepend(symbol, timeframe, fetch(start, first - 1))
+        last = self.last_timestamp(symbol, timeframe)
+        if end is None or end > last:
+            added += self.append(symbol, timeframe, fetch(last + 1, end))
+        return added
+
+
+def _normalize(data):
+    # DataFrame (datetime index or timestamp column, any column case) or dict
+    # -> dict of arrays sorted by timestamp
+    if isinstance(data, pd.DataFrame):
+        df = data.rename(columns=lambda c: str(c).lower())
+        if 'timestamp' not in df.columns:
+            df = df.reset_index().rename(columns=lambda c: str(c).lower())
+            date_col = 'date' if 'date' in df.columns else df.columns[0]
+            df['timestamp'] = pd.DatetimeIndex(df[date_col]).asi8 // 1_000_000
+        if 'volume' not in df.columns:
+            df['volume'] = 0.0
+        data = {c: df[c].to_numpy() for c in COLUMNS}
+    data = {c: np.asarray(data[c]) for c in COLUMNS}
+    order = np.argsort(data['timestamp'], kind='stable')
+    if not np.all(order == np.arange(len(order))):
+        data = {c: v[order] for c, v in data.items()}
+    return data
+
+
+# ---------------------------------------------------------------------------
+# Fetchers: fetch(start_ms, end_ms) -> candles
+# ---------------------------------------------------------------------------
+
+def stooq_fetcher(symbol, session=None):
+    '''Daily candles from Stooq'''
+    from pandas_datareader.stooq import StooqDailyReader
+
+    def fetch(start, end):
+        start = pd.Timestamp(start, unit='ms').to_pydatetime() if start is not None else None
+        end = pd.Timestamp(end, unit='ms').to_pydatetime() if end is not None else None
+        data = StooqDailyReader(symbol, start=start, end=end, session=session).read()
+        return data.sort_index()
+    return fetch
+
+
+def ccxt_fetcher(exchange, symbol, timeframe, limit=1000):
+    '''Closed candles from a ccxt exchange, paging through fetch_ohlcv'''
+    def fetch(start, end):
+        tf_ms = exchange.parse_timeframe(timeframe) * 1000
+        # the candle still forming is never stored
+        last_closed = (int(time.time() * 1000) // tf_ms - 1) * tf_ms
+        end = min(end, last_closed) if end is not None else last_closed
+        since = start if start is not None else end - (limit - 1) * tf_ms
+        rows = []
+        while since <= end:
+            batch = exchange.fetch_ohlcv(symbol, timeframe, since=since, limit=limit)
+            batch = [r for r in batch if since <= r[0] <= end]
+            if not batch:
+                break
+            rows.extend(batch)
+            since = batch[-1][0] + tf_ms
+        arr = np.array(rows, dtype=float).reshape(-1, 6)
+        return dict(timestamp=arr[:, 0].astype(np.int64), open=arr[:, 1],
+                    high=arr[:, 2], low=arr[:, 3], close=arr[:, 4],
+                    volume=arr[:, 5])
+    return fetch
@@ -0,0 +1,117 @@
+'''
+Memoizing layer for the vectorized indicators.
+
+Results are keyed by (input arrays, indicator function, params), so the same
+SMA/MACD/ATR/... over the same feed is computed once and then shared by every
+strategy and parameter set run in the process, e.g. all the tasks of an
+optimization worker. An input array is identified by the memory it views
+(address, shape, strides, dtype) together with a weak reference to the array
+owning that memory, so a feed that was freed never matches a new one at the
+same address, and by a checksum of its first and last FINGERPRINT values, so
+a feed rewritten in place at its ends (a reused memory map, new candles
+written over old ones) does not return stale indicators. A change in the
+middle of a feed only is not detected.
+
+The cache is bounded in bytes (and optionally in entries) and evicts the
+least recently used results first. The cached arrays are read-only.
+
+    vectorized.CACHE = IndicatorCache(max_bytes=512 * 2**20)
+    ...
+    vectorized.CACHE.stats()
+'''
+import weakref
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_MAX_BYTES = 256 * 2**20
+FINGERPRINT = 64  # values checksummed at each end of an input array
+
+
+def _owner(array):
+    # the array owning the memory `array` views
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
+
+
+def fingerprint(array):
+    '''Checksum of the first and last FINGERPRINT values of `array`'''
+    if array.ndim == 0:
+        array = array.reshape(1)
+    ends = (array[:FINGERPRINT], array[-FINGERPRINT:]) if len(array) > FINGERPRINT else (array,)
+    crc = 0
+    for part in ends:
+        crc = zlib.crc32(np.ascontiguousarray(part).tobytes(), crc)
+    return crc
+
+
+def feed_key(array):
+    '''Identity of the memory viewed by `array` and of its content'''
+    ai = array.__array_interface__
+    return (ai['data'][0], array.shape, array.strides, array.dtype.str, fingerprint(array))
+
+
+class IndicatorCache(object):
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_entries=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (value, [weakref of the input owners], nbytes)
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, fn, inputs, *params):
+        '''fn(*inputs, *params), from the cache if it was computed before'''
+        inputs = [np.asarray(a) for a in inputs]
+        key = (fn.__module__, fn.__qualname__, tuple(feed_key(a) for a in inputs), params)
+        owners = [_owner(a) for a in inputs]
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, refs, _ = entry
+            if all(r() is o for r, o in zip(refs, owners)):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self._remove(key)  # same address, different feed
+
+        self.misses += 1
+        value = fn(*inputs, *params)
+        arrays = value if isinstance(value, tuple) else (value,)
+        nbytes = 0
+        for a in arrays:
+            a.flags.writeable = False
+            nbytes += a.nbytes
+        if nbytes <= self.max_bytes:
+            self._entries[key] = (value, [weakref.ref(o) for o in owners], nbytes)
+            self.nbytes += nbytes
+            self._evict()
+        return value
+
+    def _remove(self, key):
+        _, _, nbytes = self._entries.pop(key)
+        self.nbytes -= nbytes
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes or (
+                self.max_entries is not None and len(self._entries) > self.max_entries):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    entries=len(self._entries), nbytes=self.nbytes,
+                    hit_rate=self.hits / lookups if lookups else 0.0)
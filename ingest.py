@@ -0,0 +1,226 @@
+'''
+Chunked ingestion of large tick/minute files with incremental resampling.
+
+Files are read a chunk at a time and every chunk goes through a cascade of
+Resamplers (e.g. 1m -> 5m -> 1h -> 1d), each one fed by the closed bars of
+the previous level. A Resampler only keeps the bar still forming between
+chunks, so memory is bounded by the chunk size whatever the file size. The
+closed bars come out of a generator, to be written to the OHLCVStore, fed to
+backtrader (StreamData) or replayed to the live logic (live.ReplayFeed):
+
+    stream = resample_stream(read_chunks('btc_ticks.csv'), ['1m', '1h', '1d'])
+    to_store(OHLCVStore(), 'BTC/USDT', stream)
+
+    stream = resample_stream(read_chunks('btc_1m.csv'), ['5m', '1h'])
+    cerebro.adddata(StreamData(rows=candles(stream, '1h')))
+
+Timestamps are epoch milliseconds (UTC) and must be in ascending order.
+Buckets are aligned on the epoch, like the exchange candles.
+'''
+from datetime import datetime, timezone
+
+import numpy as np
+
+from lazy import lazy_import
+from live import timeframe_ms
+
+pd = lazy_import('pandas')
+
+BAR_COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+
+
+def _empty():
+    return {c: np.empty(0, dtype=np.int64 if c == 'timestamp' else float)
+            for c in BAR_COLUMNS}
+
+
+def _timestamps(values, unit):
+    if pd.api.types.is_numeric_dtype(values):
+        scale = dict(s=1000, ms=1, us=0.001, ns=0.000001)[unit]
+        return (values.to_numpy(dtype=float) * scale).astype(np.int64)
+    return pd.to_datetime(values, utc=True).to_numpy(dtype='datetime64[ms]').astype(np.int64)
+
+
+def read_chunks(path, chunksize=1_000_000, timestamp='timestamp', unit='ms',
+                **read_csv_kwargs):
+    '''
+    Yield the rows of a CSV file `chunksize` at a time as dicts of arrays:
+    ticks (timestamp, price[, volume/amount]) or bars (timestamp, open,
+    high, low, close[, volume]). `timestamp` is the name of the time column,
+    either numbers in `unit` or date strings.
+    '''
+    for df in pd.read_csv(path, chunksize=chunksize, **read_csv_kwargs):
+        lower = {str(c).lower(): c for c in df.columns}
+        chunk = {'timestamp': _timestamps(df[lower[timestamp.lower()]], unit)}
+        for name in ('price', 'open', 'high', 'low', 'close', 'volume', 'amount'):
+            if name in lower:
+                chunk[name] = df[lower[name]].to_numpy(dtype=float)
+        yield chunk
+
+
+def store_chunks(store, symbol, timeframe, chunksize=1_000_000, start=None, end=None):
+    '''Yield the candles of an OHLCVStore series `chunksize` at a time'''
+    cols = store.read(symbol, timeframe, start, end)
+    for i in range(0, len(cols['timestamp']), chunksize):
+        yield {c: v[i:i + chunksize] for c, v in cols.items()}
+
+
+def _as_bars(chunk):
+    # ticks are bars with open = high = low = close = price
+    if 'price' in chunk and 'close' not in chunk:
+        price = chunk['price']
+        volume = chunk.get('volume', chunk.get('amount', np.zeros(len(price))))
+        return dict(timestamp=chunk['timestamp'], open=price, high=price,
+                    low=price, close=price, volume=volume)
+    if 'volume' not in chunk:
+        chunk = dict(chunk, volume=np.zeros(len(chunk['timestamp'])))
+    return chunk
+
+
+class Resampler(object):
+    '''Incremental resampling of ascending bars/ticks to `timeframe` bars'''
+
+    def __init__(self, timeframe):
+        self.timeframe = timeframe
+        self.ms = timeframe_ms(timeframe)
+        self._pending = None  # the bar still forming, dict of scalars
+
+    def update(self, bars):
+        '''Add a chunk of bars/ticks and return the bars it closed'''
+        bars = _as_bars(bars)
+        ts = np.asarray(bars['timestamp'], dtype=np.int64)
+        n = len(ts)
+        if not n:
+            return _empty()
+        if n > 1 and np.any(ts[1:] < ts[:-1]):
+            raise ValueError('timestamps must be in ascending order')
+        bucket = ts - ts % self.ms
+        pending = self._pending
+        if pending is not None and bucket[0] < pending['timestamp']:
+            raise ValueError('timestamps must be in ascending order')
+
+        starts = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1])))
+        ends = np.concatenate((starts[1:], [n])) - 1
+        out = dict(
+            timestamp=bucket[starts],
+            open=np.asarray(bars['open'], dtype=float)[starts],
+            high=np.maximum.reduceat(np.asarray(bars['high'], dtype=float), starts),
+            low=np.minimum.reduceat(np.asarray(bars['low'], dtype=float), starts),
+            close=np.asarray(bars['close'], dtype=float)[ends],
+            volume=np.add.reduceat(np.asarray(bars['volume'], dtype=float), starts),
+        )
+
+        if pending is not None:
+            if pending['timestamp'] == out['timestamp'][0]:
+                # the chunk continues the forming bar
+                out['open'][0] = pending['open']
+                out['high'][0] = max(out['high'][0], pending['high'])
+                out['low'][0] = min(out['low'][0], pending['low'])
+                out['volume'][0] += pending['volume']
+            else:
+                for c in BAR_COLUMNS:
+                    out[c] = np.concatenate(([pending[c]], out[c]))
+
+        # the last bar may still get more data
+        self._pending = {c: out[c][-1] for c in BAR_COLUMNS}
+        return {c: v[:-1] for c, v in out.items()}
+
+    def flush(self):
+        '''Close and return the forming bar, at the end of the data'''
+        if self._pending is None:
+            return _empty()
+        out = {c: np.array([self._pending[c]]) for c in BAR_COLUMNS}
+        self._pending = None
+        return out
+
+
+def _concat(a, b):
+    return {c: np.concatenate((a[c], b[c])) for c in BAR_COLUMNS}
+
+
+def resample_stream(chunks, timeframes):
+    '''
+    Yield (timeframe, closed bars) for every level of the cascade as chunks
+    of ticks/bars come in. `timeframes` go from the finest to the coarsest,
+    each one a multiple of the previous.
+    '''
+    resamplers = [Resampler(tf) for tf in timeframes]
+    for chunk in chunks:
+        bars = chunk
+        for r in resamplers:
+            bars = r.update(bars)
+            if not len(bars['timestamp']):
+                break
+            yield r.timeframe, bars
+    # end of the data: close the forming bars, from the finest level up
+    carry = None
+    for r in resamplers:
+        bars = r.flush() if carry is None else _concat(r.update(carry), r.flush())
+        if len(bars['timestamp']):
+            yield r.timeframe, bars
+        carry = bars
+
+
+def candles(stream, timeframe):
+    '''[timestamp, open, high, low, close, volume] rows of one timeframe'''
+    for tf, bars in stream:
+        if tf == timeframe:
+            yield from zip(*(bars[c].tolist() for c in BAR_COLUMNS))
+
+
+def frames(stream, timeframe):
+    '''DataFrame chunks of one timeframe, indexed by datetime'''
+    for tf, bars in stream:
+        if tf == timeframe:
+            index = pd.DatetimeIndex(pd.to_datetime(bars['timestamp'], unit='ms'), name='Date')
+            yield pd.DataFrame({c: bars[c] for c in BAR_COLUMNS[1:]}, index=index)
+
+
+def to_store(store, symbol, stream):
+    '''Append every timeframe of the stream to `store`; returns the bar counts'''
+    counts = {}
+    for tf, bars in stream:
+        store.append(symbol, tf, bars)
+        counts[tf] = counts.get(tf, 0) + len(bars['timestamp'])
+    return counts
+
+
+def _stream_data():
+    import backtrader as bt
+
+    class StreamData(bt.feed.DataBase):
+        '''
+        backtrader data feed pulling [timestamp, open, high, low, close,
+        volume] rows from an iterator (e.g. candles()), one bar at a time.
+        Run cerebro with exactbars to also bound the memory of the lines.
+        '''
+        params = (('rows', None),)
+
+        def start(self):
+            super(StreamData, self).start()
+            self._rows = iter(self.p.rows)
+
+        def _load(self):
+            try:
+                timestamp, open_, high, low, close, volume = next(self._rows)[:6]
+            except StopIteration:
+                return False
+            dt = datetime.fromtimestamp(timestamp / 1000.0, timezone.utc).replace(tzinfo=None)
+            self.lines.datetime[0] = bt.date2num(dt)
+            self.lines.open[0] = open_
+            self.lines.high[0] = high
+            self.lines.low[0] = low
+            self.lines.close[0] = close
+            self.lines.volume[0] = volume
+            self.lines.openinterest[0] = 0.0
+            return True
+
+    return StreamData
+
+
+def __getattr__(name):
+    # StreamData is built on first use: resampling does not need backtrader
+    if name == 'StreamData':
+        globals()[name] = _stream_data()
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
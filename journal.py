@@ -0,0 +1,141 @@
+'''
+Structured trade journal for the models.py strategies.
+
+Instead of formatting a log line per order/trade, each event is stored as
+one fixed-size record (RECORD dtype) in a preallocated NumPy buffer. Full
+buffers are handed to a background thread that appends them in bulk to a
+binary file, and the strategy gets a fresh buffer straight away. With
+models.JOURNAL left to None the strategies skip it entirely.
+
+    m.JOURNAL = TradeJournal('trades.journal')
+    cerebro.run()
+    m.JOURNAL.close()
+    df = read_journal('trades.journal')
+'''
+import json
+import queue
+import struct
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+RECORD = np.dtype([
+    ('timestamp', '<f8'),   # backtrader date number of the bar
+    ('event', 'u1'),        # see EVENTS
+    ('side', 'i1'),         # 1 buy, -1 sell, 0 n/a
+    ('strategy', 'S24'),
+    ('size', '<f8'),
+    ('price', '<f8'),
+    ('value', '<f8'),
+    ('comm', '<f8'),
+    ('pnl', '<f8'),
+    ('pnlcomm', '<f8'),
+])
+
+ORDER_EXECUTED = 1
+ORDER_FAILED = 2
+TRADE_CLOSED = 3
+EVENTS = {ORDER_EXECUTED: 'order executed', ORDER_FAILED: 'order failed',
+          TRADE_CLOSED: 'trade closed'}
+
+MAGIC = b'TJRNL\x01'
+
+# backtrader date numbers are datetime.toordinal() plus the fraction of day
+_EPOCH_NUM = datetime(1970, 1, 1).toordinal()
+
+
+class TradeJournal(object):
+
+    def __init__(self, path, capacity=65536):
+        self.path = path
+        self.capacity = capacity
+        self._buffer = np.zeros(capacity, dtype=RECORD)
+        self._n = 0
+        self._queue = queue.Queue()
+        self._file = open(path, 'wb')
+        header = json.dumps(np.lib.format.dtype_to_descr(RECORD)).encode()
+        self._file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            records = self._queue.get()
+            if records is None:
+                break
+            self._file.write(records.tobytes())
+        self._file.flush()
+
+    def _record(self):
+        # next free record of the buffer, flushing it when full
+        if self._n == self.capacity:
+            self.flush()
+        rec = self._buffer[self._n]
+        self._n += 1
+        return rec
+
+    def order(self, strategy, order):
+        '''Record a completed or failed order of `strategy`'''
+        rec = self._record()
+        rec['timestamp'] = strategy.datas[0].datetime[0]
+        rec['strategy'] = type(strategy).__name__.encode()[:24]
+        rec['side'] = 1 if order.isbuy() else -1
+        if order.status == order.Completed:
+            ex = order.executed
+            rec['event'] = ORDER_EXECUTED
+            rec['size'] = ex.size
+            rec['price'] = ex.price
+            rec['value'] = ex.value
+            rec['comm'] = ex.comm
+        else:
+            rec['event'] = ORDER_FAILED
+            rec['size'] = order.created.size
+
+    def trade(self, strategy, trade):
+        '''Record a closed trade of `strategy`'''
+        rec = self._record()
+        rec['timestamp'] = strategy.datas[0].datetime[0]
+        rec['strategy'] = type(strategy).__name__.encode()[:24]
+        rec['event'] = TRADE_CLOSED
+        rec['price'] = trade.price
+        rec['value'] = trade.value
+        rec['comm'] = trade.commission
+        rec['pnl'] = trade.pnl
+        rec['pnlcomm'] = trade.pnlcomm
+
+    def flush(self):
+        '''Hand the buffered records to the writer thread'''
+        if self._n:
+            self._queue.put(self._buffer[:self._n])
+            self._buffer = np.zeros(self.capacity, dtype=RECORD)
+            self._n = 0
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+        self._file.close()
+
+
+def read_records(path):
+    '''The journal records as a structured array (memory-mapped)'''
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a trade journal')
+        size, = struct.unpack('<I', f.read(4))
+        dtype = np.dtype(np.lib.format.descr_to_dtype(
+            [tuple(field) for field in json.loads(f.read(size))]))
+    offset = len(MAGIC) + 4 + size
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset)
+
+
+def read_journal(path):
+    '''The journal as a DataFrame, one row per event'''
+    records = read_records(path)
+    df = pd.DataFrame({name: records[name] for name in records.dtype.names})
+    df['timestamp'] = pd.to_datetime((df['timestamp'] - _EPOCH_NUM) * 86400.0, unit='s').dt.round('ms')
+    df['event'] = df['event'].map(EVENTS)
+    df['strategy'] = df['strategy'].str.decode('utf-8')
+    return df
@@ -0,0 +1,48 @@
+'''
+Lazy imports of the heavy dependencies (ccxt, pandas, ...).
+
+    ccxt = lazy_import('ccxt')
+
+binds the name at module level like `import ccxt` would, but the module only
+runs on its first attribute access (ccxt.ExchangeError, pd.DataFrame, ...),
+so importing a module of the bot does not pay for the libraries the command
+at hand never touches. A missing module still fails at import time.
+
+LazyClient does the same for exchange clients: the client (and its HTTP
+session, markets cache...) is only built when a method is first used.
+'''
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    '''Module `name`, executed on first attribute access'''
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+class LazyClient(object):
+    '''Proxy of the client returned by factory(), called on first use'''
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
@@ -0,0 +1,458 @@
+'''
+Asyncio event-driven runner for the live MACD/RSI/ADX bot.
+
+Closed candles arrive as events from a CandleFeed (a ccxt.pro WebSocket
+stream in production, a replay of stored candles for testing). Each candle
+updates the streaming indicators and evaluates the rules of
+trade_execution.py right away (core.SignalCore); orders run in their own
+task, with the ticker fetched concurrently with the order closing the
+previous position, so the feed keeps being consumed while an order is in
+flight. The cooldown after a signal runs on candle time, not a sleep.
+
+PortfolioRunner trades many symbol/timeframe pairs from one process: every
+pair has its own LiveRunner (and position state), all of them share one
+exchange client, and each closed candle only wakes up the runner of its pair.
+'''
+import asyncio
+import heapq
+import logging
+import time
+
+from core import SignalCore
+from lazy import lazy_import
+from latency import now_ns
+from ratelimit import call
+from state import client_order_id, reconcile
+
+ccxt = lazy_import('ccxt')
+pd = lazy_import('pandas')
+
+log = logging.getLogger(__name__)
+
+
+def _candle(row, symbol=None, timeframe=None):
+    timestamp, open_, high, low, close, volume = row[:6]
+    return dict(timestamp=int(timestamp), open=open_, high=high, low=low,
+                close=close, volume=volume, symbol=symbol, timeframe=timeframe)
+
+
+def timeframe_ms(timeframe):
+    return ccxt.Exchange.parse_timeframe(timeframe) * 1000
+
+
+class FeedFinished(Exception):
+    '''Raised by watch_ohlcv when the candles of a pair end (replays)'''
+
+
+class CandleFeed(object):
+    '''Stream of closed candles, consumed with `async for candle in feed`'''
+
+    def __aiter__(self):
+        return self.candles()
+
+    async def candles(self):
+        raise NotImplementedError
+        yield
+
+    async def close(self):
+        pass
+
+
+class ReplayFeed(CandleFeed):
+    '''
+    Replays candles (dict of arrays as returned by OHLCVStore.read, or
+    [timestamp, open, high, low, close, volume] rows) as closed candle
+    events, `interval` seconds apart. An iterator of rows (e.g.
+    ingest.candles) is consumed lazily, and only once.
+    '''
+
+    def __init__(self, candles, symbol=None, timeframe=None, interval=0.0):
+        if isinstance(candles, dict):
+            candles = zip(*(candles[c].tolist() for c in
+                            ('timestamp', 'open', 'high', 'low', 'close', 'volume')))
+        self.rows = candles if iter(candles) is candles else list(candles)
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.interval = interval
+
+    def events(self):
+        # (close time, candle) of every row
+        tf = timeframe_ms(self.timeframe) if self.timeframe else 0
+        for row in self.rows:
+            yield row[0] + tf, _candle(row, self.symbol, self.timeframe)
+
+    async def candles(self):
+        for _, candle in self.events():
+            yield candle
+            # always give the other tasks (orders) a chance to run
+            await asyncio.sleep(self.interval)
+
+
+class MergedReplayFeed(CandleFeed):
+    '''Replays several ReplayFeeds on one time axis, in candle close order'''
+
+    def __init__(self, feeds, interval=0.0):
+        self.feeds = feeds
+        self.interval = interval
+
+    async def candles(self):
+        merged = heapq.merge(*(f.events() for f in self.feeds), key=lambda e: e[0])
+        for _, candle in merged:
+            yield candle
+            await asyncio.sleep(self.interval)
+
+
+class WebSocketFeed(CandleFeed):
+    '''
+    Closed candles of (symbol, timeframe) pairs from a ccxt.pro exchange.
+    ccxt.pro multiplexes all the watch_ohlcv subscriptions over the pooled
+    connection of the exchange client. When the connection drops the watcher
+    reconnects with exponential backoff (`backoff` up to `max_backoff`
+    seconds) and fetches the candles it missed meanwhile over REST. The
+    watcher of a pair stops when its exchange raises FeedFinished, the feed
+    when all of them stopped.
+    '''
+
+    def __init__(self, exchange, pairs, backoff=1.0, max_backoff=60.0):
+        self.exchange = exchange
+        self.pairs = list(pairs)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._queue = asyncio.Queue()
+
+    def _emit(self, ohlcv, forming, symbol, timeframe):
+        # queue the candles closed by the rows, returns the one still open
+        for row in ohlcv:
+            if forming is not None and row[0] < forming[0]:
+                continue
+            if forming is not None and row[0] > forming[0]:
+                # a newer candle started: the previous one is closed
+                self._queue.put_nowait(_candle(forming, symbol, timeframe))
+            forming = row
+        return forming
+
+    async def _watch(self, symbol, timeframe):
+        forming = None  # latest candle, still open
+        delay = self.backoff
+        gap = False  # the connection dropped, candles may have been missed
+        while True:
+            try:
+                if gap and forming is not None:
+                    # the candles closed while disconnected, from the one
+                    # that was forming
+                    ohlcv = await call(self.exchange.fetch_ohlcv, symbol, timeframe,
+                                       since=forming[0])
+                    forming = self._emit(ohlcv, forming, symbol, timeframe)
+                gap = False
+                ohlcv = await self.exchange.watch_ohlcv(symbol, timeframe)
+            except FeedFinished:
+                return
+            except ccxt.NetworkError as e:  # ExchangeNotAvailable is one
+                gap = True
+                log.warning('%s %s: %r, reconnecting in %.1fs', symbol, timeframe, e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+                continue
+            delay = self.backoff
+            forming = self._emit(ohlcv, forming, symbol, timeframe)
+
+    async def candles(self):
+        tasks = [asyncio.ensure_future(self._watch(*pair)) for pair in self.pairs]
+        watching = set(tasks)
+        try:
+            while True:
+                while not self._queue.empty():
+                    yield self._queue.get_nowait()
+                for t in [t for t in watching if t.done()]:
+                    watching.discard(t)
+                    t.result()  # re-raise the error of a watcher
+                if not watching:
+                    return
+                get = asyncio.ensure_future(self._queue.get())
+                done, _ = await asyncio.wait({get, *watching}, return_when=asyncio.FIRST_COMPLETED)
+                if get in done:
+                    yield get.result()
+                else:
+                    get.cancel()
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    async def close(self):
+        await self.exchange.close()
+
+
+class PollingFeed(CandleFeed):
+    '''
+    REST fallback: sleeps until the next candle close of any of the
+    timeframes, then fetches in one concurrent batch only the pairs whose
+    candle just closed.
+    '''
+
+    def __init__(self, exchange, pairs, delay=2.0):
+        self.exchange = exchange
+        self.pairs = list(pairs)
+        self.delay = delay  # seconds to let the exchange publish the candle
+        self._last = {}  # (symbol, timeframe) -> last emitted timestamp
+
+    def due(self, now_ms):
+        '''Pairs whose latest closed candle has not been emitted yet'''
+        due = []
+        for symbol, timeframe in self.pairs:
+            tf = timeframe_ms(timeframe)
+            last_closed = (now_ms // tf - 1) * tf
+            if self._last.get((symbol, timeframe), -1) < last_closed:
+                due.append((symbol, timeframe))
+        return due
+
+    async def _fetch(self, symbol, timeframe, now_ms):
+        tf = timeframe_ms(timeframe)
+        last = self._last.get((symbol, timeframe))
+        since = last + tf if last is not None else None
+        ohlcv = await call(self.exchange.fetch_ohlcv, symbol, timeframe, since=since)
+        return [_candle(row, symbol, timeframe) for row in ohlcv
+                if row[0] + tf <= now_ms and (last is None or row[0] > last)]
+
+    async def candles(self):
+        while True:
+            now_ms = int(time.time() * 1000)
+            due = self.due(now_ms)
+            if due:
+                batches = await asyncio.gather(*(self._fetch(s, tf, now_ms) for s, tf in due))
+                for (symbol, timeframe), batch in zip(due, batches):
+                    for candle in batch:
+                        self._last[(symbol, timeframe)] = candle['timestamp']
+                        yield candle
+                if not all(batches):
+                    # some candles are not published yet, retry shortly
+                    await asyncio.sleep(self.delay)
+                    continue
+            # sleep until the next candle close of any timeframe
+            next_close = min((now_ms // timeframe_ms(tf) + 1) * timeframe_ms(tf)
+                             for _, tf in self.pairs)
+            await asyncio.sleep(max(0.0, (next_close - time.time() * 1000) / 1000.0) + self.delay)
+
+
+class LiveRunner(object):
+    '''
+    Live adapter of core.SignalCore: trades `symbol` on `exchange` with the
+    rules of trade_execution.py (MACD crossover confirmed for
+    `confirmation_candles`, RSI on the right side of 50 and ADX above
+    `adx_threshold`). Each closed candle goes to the core and the order
+    intents it emits are sent to the exchange in their own task.
+    '''
+
+    def __init__(self, exchange, symbol, feed, indicators=None,
+                 trade_value=1000, adx_threshold=25, cooldown=172800,
+                 store=None, timeframe=None, metrics=None, state=None):
+        self.exchange = exchange
+        self.symbol = symbol
+        self.feed = feed
+        # the cooldown (seconds) runs on candle time, i.e. real time live
+        self.core = SignalCore(indicators, trade_value, adx_threshold, cooldown)
+        self.indicators = self.core.indicators
+        # prefetch.DataService the closed candles are appended to, when given
+        self.store = store
+        self.timeframe = timeframe
+        self.metrics = metrics  # latency.LatencyMetrics, stage timings when given
+        self.state = state  # state.StateLog, crash-safe position/order state when given
+        self.key = f'{symbol}|{timeframe}'
+        self._order_task = None
+        self._stored = None  # task appending the last candle to the store
+
+    @property
+    def position(self):
+        return self.core.position
+
+    @property
+    def amount(self):
+        return self.core.amount
+
+    async def restore(self):
+        '''
+        Reconcile the recovered state of the pair with the exchange and load
+        it in the core. Returns the discrepancies found (see state.reconcile)
+        '''
+        if self.state is None:
+            return []
+        problems = await reconcile(self.state, self.exchange, self.key, self.symbol)
+        pair = self.state.pair(self.key)
+        self.core.position = pair['position']
+        self.core.amount = pair['amount']
+        self.core.cooldown_until = pair['cooldown_until']
+        return problems
+
+    def on_candle(self, candle):
+        if self.indicators.timestamp is not None and candle['timestamp'] <= self.indicators.timestamp:
+            return None  # already seen
+        metrics = self.metrics
+        if metrics is not None:
+            received = now_ns()
+            self._record_lag(candle)
+        if self.store is not None:
+            self._stored = asyncio.ensure_future(self._store(self._stored, candle))
+        self.core.update(candle['timestamp'], candle['high'], candle['low'], candle['close'])
+        if metrics is not None:
+            updated = now_ns()
+            metrics.record('indicators', self.symbol, updated - received)
+        cooldown_until = self.core.cooldown_until
+        intents = self.core.decide(candle['timestamp'])
+        if metrics is not None:
+            metrics.record('evaluate', self.symbol, now_ns() - updated)
+        # a signal starts a cooldown even when the position is already on
+        # its side (no intents)
+        if self.state is not None and self.core.cooldown_until != cooldown_until:
+            self.state.append(dict(type='cooldown', key=self.key, until=self.core.cooldown_until))
+        if not intents:
+            return None
+        self._order_task = asyncio.ensure_future(self.trade(intents))
+        self._order_task.add_done_callback(self._order_done)
+        if metrics is not None:
+            def timed(task):
+                # failed orders are counted apart, out of the order latency
+                ok = not task.cancelled() and task.exception() is None
+                metrics.record('candle_to_order' if ok else 'candle_to_order_failed',
+                               self.symbol, now_ns() - received)
+            self._order_task.add_done_callback(timed)
+        return self._order_task
+
+    async def _store(self, previous, candle):
+        # in a thread, the series may be locked by a refresh of the data
+        # daemon; one candle at a time, in order
+        if previous is not None:
+            await previous
+        try:
+            await asyncio.to_thread(self.store.append, self.symbol, self.timeframe,
+                                    {k: [v] for k, v in candle.items()})
+        except Exception:
+            log.exception('%s: storing candle %d failed', self.symbol, candle['timestamp'])
+
+    def _order_done(self, task):
+        # surface a failed order now, not when the runner stops
+        if not task.cancelled() and task.exception() is not None:
+            log.error('%s: order failed', self.symbol, exc_info=task.exception())
+
+    def _record_lag(self, candle):
+        # time from the candle close (exchange clock) to its arrival here
+        if not self.timeframe:
+            return
+        lag_ms = self._now_ms() - (candle['timestamp'] + timeframe_ms(self.timeframe))
+        self.metrics.record('candle_lag', self.symbol, lag_ms * 1e6)
+
+    def _now_ms(self):
+        # exchange clock (simulated in a paper replay)
+        clock = getattr(self.exchange, 'milliseconds', None)
+        return clock() if clock is not None else time.time() * 1000
+
+    async def _timed(self, stage, fn, *args, **kwargs):
+        if self.metrics is None:
+            return await call(fn, *args, **kwargs)
+        start = now_ns()
+        try:
+            return await call(fn, *args, **kwargs)
+        finally:
+            self.metrics.record(stage, self.symbol, now_ns() - start)
+
+    @property
+    def busy(self):
+        return self._order_task is not None and not self._order_task.done()
+
+    async def trade(self, intents):
+        ex = self.exchange
+        # the ticker is only needed to size a new position: fetch it while
+        # the opposite position (if any) is being closed
+        ticker = None
+        if any(intent.action == 'open' for intent in intents):
+            ticker = asyncio.ensure_future(self._timed('ticker', ex.fetch_ticker, self.symbol))
+        try:
+            for intent in intents:
+                if intent.action == 'close':
+                    amount = intent.amount
+                else:
+                    amount = intent.value / (await ticker)['bid']
+                # log the order before sending it: if the bot dies before
+                # the answer, reconcile() finds it by its client order id
+                cid = client_order_id()
+                if self.state is not None:
+                    self.state.append(dict(type='submit', key=self.key, cid=cid, intent=intent._asdict(),
+                                           amount=amount, time=int(self._now_ms())))
+                params = {'clientOrderId': cid}
+                create = ex.create_market_buy_order if intent.side == 'buy' else ex.create_market_sell_order
+                try:
+                    order = await self._timed('order', create, self.symbol, amount, params=params)
+                except ccxt.ExchangeError:
+                    # refused by the exchange (a network error leaves it in doubt)
+                    if self.state is not None:
+                        self.state.append(dict(type='cancel', key=self.key, cid=cid))
+                    raise
+                if intent.side == 'buy':
+                    print('Buy order executed at', order['price'], 'on', pd.to_datetime(order['timestamp'], unit='ms'))
+                else:
+                    print('Sell order executed at', order['price'], 'on', pd.to_datetime(order['timestamp'], unit='ms'))
+                self.core.filled(intent, amount)
+                if self.state is not None:
+                    self.state.append(dict(type='fill', key=self.key, cid=cid, intent=intent._asdict(),
+                                           amount=amount, price=order['price'], id=order['id']))
+        finally:
+            # an order failed: the rest of the intents are dropped
+            for intent in list(self.core.pending):
+                self.core.cancelled(intent)
+            if ticker is not None and not ticker.done():
+                ticker.cancel()
+
+    async def run(self):
+        try:
+            async for candle in self.feed:
+                self.on_candle(candle)
+            # feed exhausted (replay): let the last order and write finish
+            if self._order_task is not None:
+                await self._order_task
+            if self._stored is not None:
+                await self._stored
+        finally:
+            await self.feed.close()
+
+
+class PortfolioRunner(object):
+    '''
+    Runs one LiveRunner per (symbol, timeframe) pair on a shared feed: each
+    closed candle is routed to the runner of its pair only.
+    '''
+
+    def __init__(self, feed, runners):
+        self.feed = feed
+        self.runners = {(r.symbol, r.timeframe): r for r in runners}
+
+    async def run(self):
+        try:
+            async for candle in self.feed:
+                runner = self.runners.get((candle['symbol'], candle['timeframe']))
+                if runner is not None:
+                    runner.on_candle(candle)
+            pending = [r._order_task for r in self.runners.values() if r.busy]
+            pending += [r._stored for r in self.runners.values() if r._stored is not None]
+            if pending:
+                await asyncio.gather(*pending)
+        finally:
+            await self.feed.close()
+
+
+async def warm_up(service, exchange, pairs, indicators, concurrency=8):
+    '''
+    Bring the stored history of every pair up to date through
+    `service` (prefetch.DataService: only the missing candles are fetched,
+    under the lock of the series shared with the data daemon), in concurrent
+    batches of REST fetches through a sync ccxt client, and feed it to the
+    indicator state of each pair, indicators[(symbol, timeframe)]
+    '''
+    from datastore import ccxt_fetcher
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def update(symbol, timeframe):
+        async with semaphore:
+            fetch = ccxt_fetcher(exchange, symbol, timeframe)
+            await asyncio.to_thread(service.refresh, symbol, timeframe, fetch=fetch)
+        indicators[(symbol, timeframe)].update_many(service.store.read(symbol, timeframe))
+
+    await asyncio.gather(*(update(symbol, timeframe) for symbol, timeframe in pairs))
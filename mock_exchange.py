@@ -0,0 +1,117 @@
+'''
+Offline mock of the ccxt endpoints the bot uses, for testing the request
+layer and the live runners without network access or API keys.
+
+MockExchange serves candles from memory (or from an OHLCVStore), fills
+market orders at the last close, adds a configurable latency to every call,
+and enforces a request weight budget like the exchange does: going over it
+raises ccxt.RateLimitExceeded. Every request is recorded in `log`.
+'''
+import asyncio
+import itertools
+import time
+from collections import deque
+
+from lazy import lazy_import
+
+ccxt = lazy_import('ccxt')
+
+
+class MockExchange(object):
+
+    def __init__(self, candles=None, latency=0.0, weight_limit=1200,
+                 weight_window=60.0, weights=None, clock=time.monotonic):
+        # candles: {symbol: [[timestamp, open, high, low, close, volume], ...]}
+        self.candles = {s: [list(r) for r in rows] for s, rows in (candles or {}).items()}
+        self.latency = latency
+        self.weight_limit = weight_limit
+        self.weight_window = weight_window
+        self.weights = dict(fetch_ohlcv=2, fetch_ticker=2, **(weights or {}))
+        self.clock = clock
+        self.log = []  # (time, method, args)
+        self.orders = []
+        self.balance = {}
+        self._used = deque()  # (time, weight) within the window
+        self._ids = itertools.count(1)
+
+    @classmethod
+    def from_store(cls, store, pairs, **kwargs):
+        '''Serve the stored candles of [(symbol, timeframe), ...]'''
+        candles = {}
+        for symbol, timeframe in pairs:
+            cols = store.read(symbol, timeframe)
+            candles[symbol] = list(zip(*(cols[c].tolist() for c in
+                                         ('timestamp', 'open', 'high', 'low', 'close', 'volume'))))
+        return cls(candles, **kwargs)
+
+    @staticmethod
+    def parse_timeframe(timeframe):
+        return ccxt.Exchange.parse_timeframe(timeframe)
+
+    async def _request(self, method, *args, weight=None):
+        now = self.clock()
+        while self._used and self._used[0][0] <= now - self.weight_window:
+            self._used.popleft()
+        weight = weight if weight is not None else self.weights.get(method, 1)
+        used = sum(w for _, w in self._used)
+        self.log.append((now, method, args))
+        if used + weight > self.weight_limit:
+            raise ccxt.RateLimitExceeded(f'mock: {method} over the request weight limit')
+        self._used.append((now, weight))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def last_price(self, symbol):
+        return self.candles[symbol][-1][4]
+
+    async def fetch_ohlcv(self, symbol, timeframe='1h', since=None, limit=None, params={}):
+        await self._request('fetch_ohlcv', symbol, timeframe, since, limit)
+        rows = self.candles.get(symbol, [])
+        if since is not None:
+            rows = [r for r in rows if r[0] >= since]
+            return rows[:limit] if limit else rows
+        return rows[-limit:] if limit else rows
+
+    async def fetch_ticker(self, symbol, params={}):
+        await self._request('fetch_ticker', symbol)
+        price = self.last_price(symbol)
+        return dict(symbol=symbol, bid=price, ask=price, last=price,
+                    timestamp=self.candles[symbol][-1][0])
+
+    async def _market_order(self, symbol, side, amount, params=None):
+        await self._request('create_order', symbol, side, amount, weight=1)
+        price = self.last_price(symbol)
+        base, quote = symbol.split('/') if '/' in symbol else (symbol, 'USD')
+        sign = 1 if side == 'buy' else -1
+        self.balance[base] = self.balance.get(base, 0.0) + sign * amount
+        self.balance[quote] = self.balance.get(quote, 0.0) - sign * amount * price
+        order = dict(id=str(next(self._ids)), symbol=symbol, side=side,
+                     type='market', amount=amount, filled=amount, price=price,
+                     average=price, cost=amount * price, status='closed',
+                     timestamp=self.candles[symbol][-1][0],
+                     clientOrderId=(params or {}).get('clientOrderId'))
+        self.orders.append(order)
+        return order
+
+    async def create_market_buy_order(self, symbol, amount, params={}):
+        return await self._market_order(symbol, 'buy', amount, params)
+
+    async def create_market_sell_order(self, symbol, amount, params={}):
+        return await self._market_order(symbol, 'sell', amount, params)
+
+    async def fetch_balance(self, params={}):
+        await self._request('fetch_balance', weight=10)
+        return dict(total=dict(self.balance), free=dict(self.balance))
+
+    async def fetch_orders(self, symbol=None, since=None, limit=None, params={}):
+        await self._request('fetch_orders', symbol, weight=10)
+        orders = [o for o in self.orders if (symbol is None or o['symbol'] == symbol)
+                  and (since is None or o['timestamp'] >= since)]
+        return orders[-limit:] if limit else orders
+
+    async def fetch_open_orders(self, symbol=None, since=None, limit=None, params={}):
+        await self._request('fetch_open_orders', symbol, weight=3)
+        return []  # market orders fill immediately
+
+    async def close(self):
+        pass
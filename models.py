@@ -1,11 +1,21 @@
-from datetime import datetime as dt, timedelta
+from datetime import datetime as dt
 import logging
-import pandas as pd
 import backtrader as bt
-import pandas_datareader.data as web
-from pandas_datareader.yahoo.headers import DEFAULT_HEADERS
-from dateutil.relativedelta import relativedelta
-import requests_cache
+
+from core import SignalCore
+from streaming import LiveIndicators
+
+# Set to False to switch off the per-order/per-trade logging of the
+# strategies, e.g. when running optimization
+LOG_TRADES = True
+
+# Set to a journal.TradeJournal to record every order/trade as a compact
+# structured record (None: no journal, no cost)
+JOURNAL = None
+
+# backtrader date number of 1970-01-01 (date numbers are datetime.toordinal()
+# plus the fraction of the day)
+EPOCH_NUM = dt(1970, 1, 1).toordinal()
 
 
 class MACross(bt.Strategy):
@@ -24,28 +34,34 @@ class MACross(bt.Strategy):
         # Order variable will contain ongoing order details/status
         self.order = None
 
-    def log(self, txt, dt=None):
-        dt = dt or self.datas[0].datetime.date(0)
-        logging.info(f'{dt.isoformat()} {txt}') # Comment this line when running optimization
+    def log(self, txt, *args, dt=None):
+        # %-style args: nothing is formatted when LOG_TRADES is off
+        if LOG_TRADES:
+            dt = dt or self.datas[0].datetime.date(0)
+            logging.info('%s ' + txt, dt.isoformat(), *args)
 
     def notify_order(self, order):
         if order.status in [order.Submitted, order.Accepted]:
             # order already submitted/accepted - no action required
             return
+
+        if JOURNAL is not None:
+            JOURNAL.order(self, order)
 		# Check if an order has been completed
 		# Attention: broker could reject order if not enough cash
         # report executed order
         if order.status in [order.Completed]:
             if order.isbuy():
-                self.log(
-                    f'BUY EXECUTED --- Price: {order.executed.price:.2f}, Cost: {order.executed.value:.2f}, Commission: {order.executed.comm:.2f}'
-                )
+                self.log('BUY EXECUTED --- Price: %.2f, Cost: %.2f, Commission: %.2f',
+                         order.executed.price, order.executed.value, order.executed.comm)
                 self.price = order.executed.price
                 self.comm = order.executed.comm
             else:
-                self.log(
-                    f'SELL EXECUTED --- Price: {order.executed.price:.2f}, Cost: {order.executed.value:.2f}, Commission: {order.executed.comm:.2f}'
-                )
+                self.log('SELL EXECUTED --- Price: %.2f, Cost: %.2f, Commission: %.2f',
+                         order.executed.price, order.executed.value, order.executed.comm)
+
+            # Keep track of the bar the order was executed on
+            self.bar_executed = len(self)
 
         # report failed order
         elif order.status in [order.Canceled, order.Margin, 
@@ -59,7 +75,10 @@ class MACross(bt.Strategy):
         if not trade.isclosed:
             return
 
-        self.log(f'OPERATION RESULT --- Gross: {trade.pnl:.2f}, Net: {trade.pnlcomm:.2f}')
+        if JOURNAL is not None:
+            JOURNAL.trade(self, trade)
+
+        self.log('OPERATION RESULT --- Gross: %.2f, Net: %.2f', trade.pnl, trade.pnlcomm)
 
     def next(self):
 		# Check for open orders
@@ -72,18 +91,18 @@ class MACross(bt.Strategy):
                 
             #If the 20 SMA is above the 50 SMA
             if self.sma_short[0] > self.sma_long[0] and self.sma_short[-1] < self.sma_long[-1]:
-                self.log(f'------------------BUY CREATE: {self.data[0]}')
+                self.log('------------------BUY CREATE: %s', self.data[0])
                 # Keep track of the created order to avoid a 2nd order
                 self.order = self.buy(exectype=bt.Order.Market,price=self.data.close[0])
             #Otherwise if the 20 SMA is below the 50 SMA   
             elif self.sma_short[0] < self.sma_long[0] and self.sma_short[-1] > self.sma_long[-1]:
-                self.log(f'------------------SELL CREATE: {self.data[0]}')
+                self.log('------------------SELL CREATE: %s', self.data[0])
                 # Keep track of the created order to avoid a 2nd order
                 self.order = self.sell(exectype=bt.Order.Market,price=self.data.close[0])
         else:
             # We are already in the market, look for a signal to CLOSE trades
             if len(self) >= (self.bar_executed + 5):
-                self.log(f'------------------CLOSE CREATE: {self.data[0]}')
+                self.log('------------------CLOSE CREATE: %s', self.data[0])
                 self.order = self.close()
 
 
@@ -136,29 +155,33 @@ class MACD(bt.Strategy):
         self.smadir = self.sma - self.sma(-self.params.dirperiod)
         
         self.order = None  # sentinel to avoid operations on pending order
+        self.pstop = None  # trailing stop price of the open position
 
-    def log(self, txt, dt=None):
-        dt = dt or self.datas[0].datetime.date(0)
-        logging.info(f'{dt.isoformat()} {txt}') # Comment this line when running optimization
+    def log(self, txt, *args, dt=None):
+        # %-style args: nothing is formatted when LOG_TRADES is off
+        if LOG_TRADES:
+            dt = dt or self.datas[0].datetime.date(0)
+            logging.info('%s ' + txt, dt.isoformat(), *args)
 
     def notify_order(self, order):
         if order.status in [order.Submitted, order.Accepted]:
             # order already submitted/accepted - no action required
             return
+
+        if JOURNAL is not None:
+            JOURNAL.order(self, order)
 		# Check if an order has been completed
 		# Attention: broker could reject order if not enough cash
         # report executed order
         if order.status in [order.Completed]:
             if order.isbuy():
-                self.log(
-                    f'BUY EXECUTED --- Price: {order.executed.price:.2f}, Cost: {order.executed.value:.2f}, Commission: {order.executed.comm:.2f}'
-                )
+                self.log('BUY EXECUTED --- Price: %.2f, Cost: %.2f, Commission: %.2f',
+                         order.executed.price, order.executed.value, order.executed.comm)
                 self.price = order.executed.price
                 self.comm = order.executed.comm
             else:
-                self.log(
-                    f'SELL EXECUTED --- Price: {order.executed.price:.2f}, Cost: {order.executed.value:.2f}, Commission: {order.executed.comm:.2f}'
-                )
+                self.log('SELL EXECUTED --- Price: %.2f, Cost: %.2f, Commission: %.2f',
+                         order.executed.price, order.executed.value, order.executed.comm)
 
         # report failed order
         elif order.status in [order.Canceled, order.Margin, 
@@ -172,7 +195,10 @@ class MACD(bt.Strategy):
         if not trade.isclosed:
             return
 
-        self.log(f'OPERATION RESULT --- Gross: {trade.pnl:.2f}, Net: {trade.pnlcomm:.2f}')
+        if JOURNAL is not None:
+            JOURNAL.trade(self, trade)
+
+        self.log('OPERATION RESULT --- Gross: %.2f, Net: %.2f', trade.pnl, trade.pnlcomm)
 
     def next(self):
 
@@ -183,18 +209,18 @@ class MACD(bt.Strategy):
             if self.mcross[0] > 0.0 and self.smadir < 0.0:
                 self.order = self.buy()
                 pdist = self.atr[0] * self.params.atrdist
-                pstop = self.data.close[0] - pdist
+                self.pstop = self.data.close[0] - pdist
 
         else:  # in the market
             pclose = self.data.close[0]
-            pstop = self.data.close[0] - pdist
+            pstop = self.pstop
 
             if pclose < pstop:
                 self.close()  # stop met - get out of the existing position
             else:
                 pdist = self.atr[0] * self.params.atrdist
                 # Update only if greater than
-                pstop = max(pstop, pclose - pdist)
+                self.pstop = max(pstop, pclose - pdist)
 
 '''
         if not self.position and self.macd1.lines.macd[0] > self.macd1.lines.signal[0]:
@@ -215,27 +241,30 @@ class EMAStrategy(bt.Strategy):
 
         self.order = None # Initiate an order to create none
 
-    def log(self, txt, dt=None):
-        dt = dt or self.datas[0].datetime.date(0)
-        logging.info(f'{dt.isoformat()} {txt}') # Comment this line when running optimization
+    def log(self, txt, *args, dt=None):
+        # %-style args: nothing is formatted when LOG_TRADES is off
+        if LOG_TRADES:
+            dt = dt or self.datas[0].datetime.date(0)
+            logging.info('%s ' + txt, dt.isoformat(), *args)
 
     def notify_order(self, order):
         if order.status in [order.Submitted, order.Accepted]:
             # order already submitted/accepted - no action required
             return
 
+        if JOURNAL is not None:
+            JOURNAL.order(self, order)
+
         # report executed order
         if order.status in [order.Completed]:
             if order.isbuy():
-                self.log(
-                    f'BUY EXECUTED --- Price: {order.executed.price:.2f}, Cost: {order.executed.value:.2f}, Commission: {order.executed.comm:.2f}'
-                )
+                self.log('BUY EXECUTED --- Price: %.2f, Cost: %.2f, Commission: %.2f',
+                         order.executed.price, order.executed.value, order.executed.comm)
                 self.price = order.executed.price
                 self.comm = order.executed.comm
             else:
-                self.log(
-                    f'SELL EXECUTED --- Price: {order.executed.price:.2f}, Cost: {order.executed.value:.2f}, Commission: {order.executed.comm:.2f}'
-                )
+                self.log('SELL EXECUTED --- Price: %.2f, Cost: %.2f, Commission: %.2f',
+                         order.executed.price, order.executed.value, order.executed.comm)
 
         # report failed order
         elif order.status in [order.Canceled, order.Margin, 
@@ -249,7 +278,10 @@ class EMAStrategy(bt.Strategy):
         if not trade.isclosed:
             return
 
-        self.log(f'OPERATION RESULT --- Gross: {trade.pnl:.2f}, Net: {trade.pnlcomm:.2f}')
+        if JOURNAL is not None:
+            JOURNAL.trade(self, trade)
+
+        self.log('OPERATION RESULT --- Gross: %.2f, Net: %.2f', trade.pnl, trade.pnlcomm)
 
     def next(self):
 
@@ -284,10 +316,11 @@ class RSI_SMA_Strategy(bt.Strategy):
         self.rsi_signal_long_exit = bt.ind.CrossUp(self.rsi, self.p.rsi_mid)
         self.rsi_signal_short = bt.ind.CrossDown(self.rsi, self.p.rsi_upper)
 
-    def log(self, txt):
-        '''Logging function'''
-        dt = self.datas[0].datetime.date(0)
-        logging.info(f'{dt.isoformat()} {txt}') # Comment this line when running optimization
+    def log(self, txt, *args):
+        '''Logging function (%-style args, formatted only when logged)'''
+        if LOG_TRADES:
+            dt = self.datas[0].datetime.date(0)
+            logging.info('%s ' + txt, dt.isoformat(), *args)
         # print(f'{dt}, {txt}')
 
     def notify_order(self, order):
@@ -295,18 +328,19 @@ class RSI_SMA_Strategy(bt.Strategy):
             # order already submitted/accepted - no action required
             return
 
+        if JOURNAL is not None:
+            JOURNAL.order(self, order)
+
         # report executed order
         if order.status in [order.Completed]:
             if order.isbuy():
-                self.log(
-                    f'BUY EXECUTED --- Price: {order.executed.price:.2f}, Cost: {order.executed.value:.2f}, Commission: {order.executed.comm:.2f}'
-                )
+                self.log('BUY EXECUTED --- Price: %.2f, Cost: %.2f, Commission: %.2f',
+                         order.executed.price, order.executed.value, order.executed.comm)
                 self.price = order.executed.price
                 self.comm = order.executed.comm
             else:
-                self.log(
-                    f'SELL EXECUTED --- Price: {order.executed.price:.2f}, Cost: {order.executed.value:.2f}, Commission: {order.executed.comm:.2f}'
-                )
+                self.log('SELL EXECUTED --- Price: %.2f, Cost: %.2f, Commission: %.2f',
+                         order.executed.price, order.executed.value, order.executed.comm)
 
         # report failed order
         elif order.status in [order.Canceled, order.Margin, 
@@ -320,7 +354,10 @@ class RSI_SMA_Strategy(bt.Strategy):
         if not trade.isclosed:
             return
 
-        self.log(f'OPERATION RESULT --- Gross: {trade.pnl:.2f}, Net: {trade.pnlcomm:.2f}')
+        if JOURNAL is not None:
+            JOURNAL.trade(self, trade)
+
+        self.log('OPERATION RESULT --- Gross: %.2f, Net: %.2f', trade.pnl, trade.pnlcomm)
 
     def next_open(self):
         if not self.position:
@@ -328,10 +365,80 @@ class RSI_SMA_Strategy(bt.Strategy):
                 # calculate the max number of shares ('all-in')
                 size = int(self.broker.getcash() / self.datas[0].open)
                 # buy condition
-                self.log(f'BUY CREATED --- Size: {size}, Cash: {self.broker.getcash():.2f}, Open: {self.data_open[0]}, Close: {self.data_close[0]}')
+                self.log('BUY CREATED --- Size: %s, Cash: %.2f, Open: %s, Close: %s',
+                         size, self.broker.getcash(), self.data_open[0], self.data_close[0])
                 self.order = self.buy(size=size)
         else:
             if self.rsi < 70 and self.sma14 < self.sma50:
                 # sell order
-                self.log(f'SELL CREATED --- Size: {self.position.size}')
-                self.order = self.sell(size=self.position.size)
\ No newline at end of file
+                self.log('SELL CREATED --- Size: %s', self.position.size)
+                self.order = self.sell(size=self.position.size)
+
+class LiveRules(bt.Strategy):
+    '''
+    The rules of the live bot (trade_execution.py) in backtrader: a
+    backtrader adapter of core.SignalCore, so backtests run exactly the
+    code that trades live. Orders are sized with the close of the signal bar.
+    '''
+    params = dict(macd_fast=12, macd_slow=26, macd_signal=9, rsi_period=14,
+                  adx_period=14, confirmation_candles=48, adx_threshold=25,
+                  trade_value=1000, cooldown=172800)
+
+    def __init__(self):
+        p = self.p
+        indicators = LiveIndicators(p.macd_fast, p.macd_slow, p.macd_signal,
+                                    p.rsi_period, p.adx_period, p.confirmation_candles)
+        self.core = SignalCore(indicators, p.trade_value, p.adx_threshold, p.cooldown)
+        self.intents = {}  # order ref -> (intent, size)
+
+    def log(self, txt, *args, dt=None):
+        # %-style args: nothing is formatted when LOG_TRADES is off
+        if LOG_TRADES:
+            dt = dt or self.datas[0].datetime.date(0)
+            logging.info('%s ' + txt, dt.isoformat(), *args)
+
+    def notify_order(self, order):
+        if order.status in [order.Submitted, order.Accepted]:
+            # order already submitted/accepted - no action required
+            return
+
+        if JOURNAL is not None:
+            JOURNAL.order(self, order)
+
+        intent, size = self.intents.pop(order.ref)
+        # report executed order
+        if order.status in [order.Completed]:
+            if order.isbuy():
+                self.log('BUY EXECUTED --- Price: %.2f, Cost: %.2f, Commission: %.2f',
+                         order.executed.price, order.executed.value, order.executed.comm)
+            else:
+                self.log('SELL EXECUTED --- Price: %.2f, Cost: %.2f, Commission: %.2f',
+                         order.executed.price, order.executed.value, order.executed.comm)
+            self.core.filled(intent, size)
+
+        # report failed order
+        elif order.status in [order.Canceled, order.Margin,
+                              order.Rejected]:
+            self.log('Order Failed')
+            self.core.cancelled(intent)
+
+    def notify_trade(self, trade):
+        if not trade.isclosed:
+            return
+
+        if JOURNAL is not None:
+            JOURNAL.trade(self, trade)
+
+        self.log('OPERATION RESULT --- Gross: %.2f, Net: %.2f', trade.pnl, trade.pnlcomm)
+
+    def next(self):
+        data = self.datas[0]
+        timestamp = int(round((data.datetime[0] - EPOCH_NUM) * 86400000))
+        close = data.close[0]
+        for intent in self.core.on_bar(timestamp, data.high[0], data.low[0], close):
+            size = intent.amount if intent.action == 'close' else intent.value / close
+            if intent.side == 'buy':
+                order = self.buy(size=size)
+            else:
+                order = self.sell(size=size)
+            self.intents[order.ref] = (intent, size)
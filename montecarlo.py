@@ -0,0 +1,212 @@
+'''
+Monte Carlo / bootstrap robustness tests of a recorded backtest.
+
+From the trades and the equity curve of a run (a recorder.Recorder) three
+kinds of scenarios are simulated:
+
+  trades     the trades resampled with replacement (bootstrapped
+             trade sequences), compounded as returns on the value at entry
+  blocks     the per-bar returns of the equity curve resampled in blocks of
+             `block` bars (moving block bootstrap: keeps the short term
+             autocorrelation and volatility clustering)
+  execution  every entry and exit filled 0..max_delay bars late, at a price
+             0..slippage_bps worse, with the commission of the run
+
+A position open at the end of the run counts as a trade marked at the last
+close. The trade based scenarios see the value at the trade exits only, so
+their drawdowns leave out the swings within trades.
+
+Each path gives a total return and a max drawdown (in %); robustness()
+returns their confidence intervals. Paths are simulated in NumPy batches
+(one array op per step over a whole batch of paths) and the batches are
+spread over a pool of processes. Every batch has its own seed spawned from
+`seed`, so the results do not depend on the number of processes:
+
+    cerebro.addanalyzer(RecorderAnalyzer, _name='recorder')
+    rec = cerebro.run()[0].analyzers.recorder.get_analysis()
+    report = robustness(rec, data['open'].to_numpy(), commission=0.001,
+                        paths=100000, seed=1)
+    report['execution']['return_pct']  # {0.05: ..., 0.5: ..., 0.95: ...}
+'''
+import multiprocessing as mp
+
+import numpy as np
+
+from recorder import returns
+
+LEVELS = (0.05, 0.5, 0.95)
+# cap on the floats of one batch (paths x path length), ~32MB
+MAX_BATCH_ELEMENTS = 4_000_000
+
+# Per worker state, set by _init_worker
+_worker = {}
+
+
+def trades(recorder):
+    '''
+    Round trips of a run as arrays: entry/exit bar, signed size, entry/exit
+    price and commission, net PnL and return on the value before the entry.
+    A position still open at the end is marked at the last close (`marked`),
+    so the returns compound to the return of the run. Needs a run whose
+    trades open and close with one fill each (all the models.py strategies).
+    '''
+    fills = recorder.fills
+    position = np.cumsum(fills['size'])
+    closes = np.flatnonzero(np.isclose(position, 0.0, atol=1e-9))
+    starts = np.concatenate(([0], closes[:-1] + 1))
+    if len(closes) and not np.all(closes - starts == 1):
+        raise ValueError('trades must open and close with one fill each')
+    entry, exit_ = fills[starts], fills[closes]
+    entry_bar, size, entry_price = entry['bar'], entry['size'], entry['price']
+    exit_bar, exit_price = exit_['bar'], exit_['price']
+    comm = entry['comm'] + exit_['comm']
+    marked = np.zeros(len(closes), dtype=bool)
+    last = closes[-1] + 1 if len(closes) else 0
+    if last < len(fills):
+        if len(fills) - last != 1:
+            raise ValueError('trades must open and close with one fill each')
+        held = fills[last]
+        # close implied by the last value: equity = cash + position * close
+        close = (recorder.equity[-1] - recorder.cash[-1]) / held['size']
+        entry_bar = np.append(entry_bar, held['bar'])
+        size = np.append(size, held['size'])
+        entry_price = np.append(entry_price, held['price'])
+        exit_bar = np.append(exit_bar, recorder.n - 1)
+        exit_price = np.append(exit_price, close)
+        comm = np.append(comm, held['comm'])
+        marked = np.append(marked, True)
+    pnl = size * (exit_price - entry_price) - comm
+    equity = np.concatenate(([recorder.start_value], recorder.equity))
+    # value at the close of the bar before the entry
+    before = equity[entry_bar]
+    return dict(entry_bar=entry_bar, exit_bar=exit_bar, size=size,
+                entry_price=entry_price, exit_price=exit_price, comm=comm,
+                marked=marked, pnl=pnl, value=before, returns=pnl / before)
+
+
+def _path_stats(growth):
+    # growth: (paths, steps) value relative to the start -> return %, max drawdown %
+    peak = np.maximum(np.maximum.accumulate(growth, axis=1), 1.0)
+    drawdown = ((peak - growth) / peak).max(axis=1) if growth.shape[1] else np.zeros(len(growth))
+    final = growth[:, -1] if growth.shape[1] else np.ones(len(growth))
+    return (final - 1.0) * 100.0, drawdown * 100.0
+
+
+def _sim_trades(rng, n, inputs):
+    r = inputs['returns']
+    idx = rng.integers(0, len(r), size=(n, len(r)))
+    return _path_stats(np.cumprod(1.0 + r[idx], axis=1))
+
+
+def _sim_blocks(rng, n, inputs):
+    r, block = inputs['bar_returns'], inputs['block']
+    blocks = -(-len(r) // block)
+    starts = rng.integers(0, len(r) - block + 1, size=(n, blocks))
+    idx = (starts[:, :, None] + np.arange(block)).reshape(n, -1)[:, :len(r)]
+    return _path_stats(np.cumprod(1.0 + r[idx], axis=1))
+
+
+def _sim_execution(rng, n, inputs):
+    opens, last = inputs['opens'], len(inputs['opens']) - 1
+    size, value = inputs['size'], inputs['value']
+    shape = (n, len(size))
+    delay = inputs['max_delay'] + 1
+    entry_bar = np.minimum(inputs['entry_bar'] + rng.integers(0, delay, shape), last)
+    exit_bar = np.minimum(inputs['exit_bar'] + rng.integers(0, delay, shape), last)
+    slip = inputs['slippage_bps'] / 1e4
+    side = np.sign(size)
+    # always against the trade: buys higher, sells lower
+    entry = opens[entry_bar] * (1.0 + side * rng.uniform(0.0, slip, shape))
+    exit_ = opens[exit_bar] * (1.0 - side * rng.uniform(0.0, slip, shape))
+    # the position open at the end stays marked at the last close
+    marked = inputs['marked']
+    exit_ = np.where(marked, inputs['mark'], exit_)
+    comm = np.abs(size) * (entry + np.where(marked, 0.0, exit_)) * inputs['commission']
+    pnl = size * (exit_ - entry) - comm
+    return _path_stats(np.cumprod(1.0 + pnl / value, axis=1))
+
+
+METHODS = {
+    'trades': _sim_trades,
+    'blocks': _sim_blocks,
+    'execution': _sim_execution,
+}
+
+
+def _init_worker(method, inputs):
+    _worker.update(method=method, inputs=inputs)
+
+
+def _run_batch(task):
+    seed, n = task
+    w = _worker
+    return METHODS[w['method']](np.random.default_rng(seed), n, w['inputs'])
+
+
+def simulate(method, inputs, paths=100000, batch=10000, processes=None, seed=None):
+    '''
+    Run `paths` scenarios of `method` (see METHODS) over `inputs` in batches
+    of at most `batch` paths on `processes` workers (all cores by default, 1
+    runs in this process). Returns dict(return_pct=array, max_drawdown_pct=array).
+    '''
+    width = max(1, inputs.get('width', 1))
+    batch = max(1, min(batch, MAX_BATCH_ELEMENTS // width))
+    sizes = [batch] * (paths // batch) + ([paths % batch] if paths % batch else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = list(zip(seeds, sizes))
+    if processes == 1 or len(tasks) == 1:
+        _init_worker(method, inputs)
+        results = [_run_batch(task) for task in tasks]
+    else:
+        with mp.Pool(processes, initializer=_init_worker, initargs=(method, inputs)) as pool:
+            results = pool.map(_run_batch, tasks)
+    return dict(return_pct=np.concatenate([r[0] for r in results]),
+                max_drawdown_pct=np.concatenate([r[1] for r in results]))
+
+
+def summary(sims, levels=LEVELS):
+    '''Quantiles at `levels`, mean and probability of a loss of the simulated paths'''
+    ret, dd = sims['return_pct'], sims['max_drawdown_pct']
+    return dict(
+        paths=len(ret),
+        return_pct={q: float(v) for q, v in zip(levels, np.quantile(ret, levels))},
+        max_drawdown_pct={q: float(v) for q, v in zip(levels, np.quantile(dd, levels))},
+        mean_return_pct=float(ret.mean()),
+        prob_loss=float((ret < 0).mean()),
+    )
+
+
+def robustness(recorder, opens=None, commission=0.0, methods=None, paths=100000,
+               block=20, max_delay=1, slippage_bps=10.0, levels=LEVELS,
+               batch=10000, processes=None, seed=None):
+    '''
+    Confidence intervals of the return and max drawdown of a recorded run
+    under the scenarios of `methods` (all of METHODS by default; 'execution'
+    needs the open price of every bar of the run in `opens`). Returns
+    {method: summary()} plus the values of the run itself under 'actual'.
+    '''
+    methods = list(methods or (METHODS if opens is not None else ('trades', 'blocks')))
+    rt = trades(recorder)
+    equity = recorder.equity
+    inputs = dict(
+        trades=dict(returns=rt['returns'], width=len(rt['returns'])),
+        blocks=dict(bar_returns=returns(equity, recorder.start_value),
+                    block=max(1, min(block, len(equity))), width=len(equity)),
+    )
+    if opens is not None:
+        inputs['execution'] = dict(
+            opens=np.ascontiguousarray(opens, dtype=float), entry_bar=rt['entry_bar'],
+            exit_bar=rt['exit_bar'], size=rt['size'], value=rt['value'],
+            marked=rt['marked'], mark=rt['exit_price'],
+            max_delay=max_delay, slippage_bps=slippage_bps, commission=commission,
+            width=len(rt['size']))
+    stats = recorder.stats()
+    report = dict(actual=dict(return_pct=stats['return_pct'],
+                              max_drawdown_pct=stats['max_drawdown_pct'],
+                              trades=len(rt['pnl'])))
+    for method in methods:
+        if inputs[method]['width'] == 0:
+            continue  # nothing to resample
+        sims = simulate(method, inputs[method], paths, batch, processes, seed)
+        report[method] = summary(sims, levels)
+    return report
@@ -0,0 +1,207 @@
+'''
+Parallel parameter sweep for the strategies in models.py.
+
+The OHLCV data is loaded once in the parent process and placed in a shared
+memory block that every worker maps, so tasks only carry the parameters to
+try. Each finished run is appended to a CSV file straight away and the
+ranked table is rewritten as results come in.
+
+Example:
+
+    grid = dict(macd1=[8, 12], macd2=[21, 26], atrdist=[2.0, 3.0])
+    optimize(m.MACD, grid, data, out='macd_sweep.csv')
+'''
+import csv
+import itertools
+import logging
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import backtrader as bt
+
+import models as m
+import vectorized
+from indicator_cache import IndicatorCache
+from recorder import Recorder, RecorderAnalyzer, drawdown, returns, sharpe
+
+COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+RANK_EVERY = 50  # rewrite the ranked file every this many results
+# recorder statistics reported for every run
+STATS = ('final_value', 'return_pct', 'max_drawdown_pct', 'sharpe', 'trades',
+         'win_rate', 'exposure')
+
+# Per worker state, set by _init_worker
+_worker = {}
+
+
+def param_grid(grid, constraint=None):
+    '''Expand dict(name=[values, ...]) into a list of parameter dicts'''
+    names = list(grid)
+    combos = [dict(zip(names, values))
+              for values in itertools.product(*(grid[n] for n in names))]
+    if constraint is not None:
+        combos = [c for c in combos if constraint(c)]
+    return combos
+
+
+def metrics(values, periods=252):
+    '''Return %, max drawdown % and annualized Sharpe of an equity curve'''
+    values = np.asarray(values, dtype=float)
+    ret = (values[-1] - values[0]) / values[0] * 100.0
+    return dict(return_pct=ret, max_drawdown_pct=drawdown(values).max() * 100.0,
+                sharpe=sharpe(returns(values), periods))
+
+
+def share_frame(data):
+    '''
+    Copy the OHLCV columns and the datetime index of `data` to one shared
+    memory block of float64 rows (COLUMNS, then the index as int64 bits).
+    Returns (SharedMemory, bars); the caller closes and unlinks it.
+    '''
+    index = pd.DatetimeIndex(data.index).asi8
+    n = len(data)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, (len(COLUMNS) + 1) * n * 8))
+    block = np.ndarray((len(COLUMNS) + 1, n), dtype=np.float64, buffer=shm.buf)
+    lower = {str(c).lower(): c for c in data.columns}
+    for i, name in enumerate(COLUMNS):
+        block[i] = data[lower[name]].to_numpy(dtype=float) if name in lower else 0.0
+    block[-1] = index.view(np.float64)
+    return shm, n
+
+
+def _init_worker(shm_name, n, strategy, cash, commission, cheat_on_open,
+                 engine, periods):
+    # Switch off the per-order logging of the strategies while optimizing;
+    # with LOG_TRADES off their log() calls do not format the messages either
+    m.LOG_TRADES = False
+    logging.disable(logging.INFO)
+    # the tasks of a worker share the indicators they have in common
+    vectorized.CACHE = IndicatorCache()
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    block = np.ndarray((len(COLUMNS) + 1, n), dtype=np.float64, buffer=shm.buf)
+    index = pd.DatetimeIndex(block[-1].view(np.int64))
+    _worker.update(
+        shm=shm,  # keep the mapping alive
+        data=pd.DataFrame({name: block[i] for i, name in enumerate(COLUMNS)},
+                          index=index, copy=False),
+        strategy=strategy, cash=cash, commission=commission,
+        cheat_on_open=cheat_on_open, engine=engine, periods=periods,
+    )
+
+
+def default_engine(strategy):
+    '''
+    'vectorized' for the strategies the vectorized engine reproduces fill
+    for fill (vectorized.STRATEGIES, checked against Cerebro by
+    test_parity.py), so sweeps run on it and share the indicator cache of
+    their worker; 'cerebro' for the others
+    '''
+    name = strategy if isinstance(strategy, str) else strategy.__name__
+    return 'vectorized' if name in vectorized.STRATEGIES else 'cerebro'
+
+
+def run_one(params, data, strategy, cash=10000, commission=0.001,
+            cheat_on_open=True, engine=None, periods=252):
+    '''Backtest one parameter set and return its metrics'''
+    engine = engine or default_engine(strategy)
+    if engine == 'vectorized':
+        result = vectorized.backtest(strategy, data, cash=cash,
+                                     commission=commission,
+                                     cheat_on_open=cheat_on_open, **params)
+        rec = Recorder.from_result(result)
+    else:
+        cerebro = bt.Cerebro(stdstats=False, cheat_on_open=cheat_on_open)
+        cerebro.addstrategy(strategy, **params)
+        cerebro.broker.set_cash(cash)
+        cerebro.broker.setcommission(commission=commission)
+        cerebro.adddata(bt.feeds.PandasData(dataname=data))
+        cerebro.addanalyzer(RecorderAnalyzer, _name='recorder')
+        rec = cerebro.run()[0].analyzers.recorder.get_analysis()
+    stats = rec.stats(periods)
+    return dict(params, **{k: stats[k] for k in STATS})
+
+
+def _run_task(params):
+    w = _worker
+    try:
+        return run_one(params, w['data'], w['strategy'], w['cash'],
+                       w['commission'], w['cheat_on_open'], w['engine'],
+                       w['periods'])
+    except Exception as e:
+        return dict(params, error=repr(e))
+
+
+def _rank_key(row):
+    sharpe = row.get('sharpe', float('nan'))
+    return -sharpe if sharpe == sharpe else float('inf')
+
+
+def _write_ranked(path, rows, fields):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(sorted(rows, key=_rank_key))
+
+
+def optimize(strategy, grid, data, out='optimization.csv', processes=None,
+             cash=10000, commission=0.001, cheat_on_open=True,
+             engine=None, periods=252, constraint=None, chunksize=1):
+    '''
+    Sweep `grid` (dict of param name -> list of values) for `strategy` over
+    `data` (DataFrame with a datetime index and OHLCV columns) using a pool
+    of `processes` workers (all cores by default). `engine` is 'cerebro' or
+    'vectorized', by default the vectorized one when it supports the
+    strategy (see default_engine()).
+
+    Results are appended to `out` as they finish and the table ranked by
+    Sharpe ratio is kept in `<out>_ranked.csv`. Returns the ranked rows.
+    '''
+    combos = param_grid(grid, constraint)
+    engine = engine or default_engine(strategy)
+    fields = list(grid) + list(STATS) + ['error']
+    ranked_path = out[:-4] + '_ranked.csv' if out.endswith('.csv') else out + '_ranked'
+
+    shm, n = share_frame(data)
+    rows = []
+    try:
+        initargs = (shm.name, n, strategy, cash, commission, cheat_on_open,
+                    engine, periods)
+        with mp.Pool(processes, initializer=_init_worker, initargs=initargs) as pool, \
+                open(out, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+            writer.writeheader()
+            for row in pool.imap_unordered(_run_task, combos, chunksize=chunksize):
+                writer.writerow(row)
+                f.flush()
+                rows.append(row)
+                if len(rows) % RANK_EVERY == 0:
+                    _write_ranked(ranked_path, rows, fields)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    _write_ranked(ranked_path, rows, fields)
+    return sorted(rows, key=_rank_key)
+
+
+if __name__ == '__main__':
+    from datastore import OHLCVStore, stooq_fetcher
+
+    store = OHLCVStore()
+    store.update("MSTR.US", '1d', stooq_fetcher("MSTR.US"))
+    data = store.frame("MSTR.US", '1d')
+
+    grid = dict(
+        macd1=[8, 12, 16],
+        macd2=[21, 26, 34],
+        macdsig=[7, 9],
+        atrdist=[2.0, 3.0, 4.0],
+        dirperiod=[5, 10, 20],
+    )
+    results = optimize(m.MACD, grid, data, out='macd_optimization.csv',
+                       constraint=lambda p: p['macd1'] < p['macd2'])
+    for row in results[:10]:
+        print(row)
@@ -0,0 +1,272 @@
+'''
+Paper-trading simulator: a local exchange replaying historical candles.
+
+PaperExchange implements the ccxt/ccxt.pro calls the bot uses (fetch_ohlcv,
+watch_ohlcv, fetch_ticker, fetch_order_book, create_market_buy_order,
+create_market_sell_order, fetch_balance) on top of MockExchange. Time is
+simulated: the replay runs `speed` times faster than real time and only the
+candles closed at the simulated time are visible. Each symbol has an
+in-memory order book around the last close (spread, depth per level) that
+market orders walk through, so large orders pay slippage; the book refills
+when the next candle closes. Fees, extra slippage and a (jittered) latency
+per request are configurable.
+
+It plugs into the live runners unchanged, for soak and latency tests:
+
+    python paper.py BTC/USDT:1h ETH/USDT:1h --speed 36000
+'''
+import asyncio
+import random
+import time
+
+import numpy as np
+
+from live import FeedFinished, timeframe_ms
+from mock_exchange import MockExchange
+
+
+class ReplayFinished(FeedFinished):
+    '''The replay reached the end of the historical candles of a symbol'''
+
+
+class PaperExchange(MockExchange):
+
+    def __init__(self, candles=None, timeframe='1h', speed=3600.0, start=None,
+                 balance=None, fee=0.001, spread_bps=2.0, depth=1.0, levels=20,
+                 level_bps=1.0, slippage_bps=0.0, latency=0.0, jitter=0.0,
+                 seed=None, clock=time.monotonic, **kwargs):
+        super(PaperExchange, self).__init__(candles, clock=clock, **kwargs)
+        symbols = list(self.candles)
+        # timeframe of the candles of every symbol
+        self.timeframes = (dict(timeframe) if isinstance(timeframe, dict)
+                           else {s: timeframe for s in symbols})
+        self._ts = {s: np.array([r[0] for r in rows], dtype=np.int64)
+                    for s, rows in self.candles.items()}
+        self.speed = speed  # simulated ms per real ms
+        self.balance = dict(balance or {'USDT': 10000.0})
+        self.fee = fee
+        self.spread_bps = spread_bps
+        self.depth = depth  # base amount per book level
+        self.levels = levels
+        self.level_bps = level_bps
+        self.slippage_bps = slippage_bps
+        self.latency = 0.0  # MockExchange's, replaced by _delay
+        self.base_latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._books = {}
+        self._cursor = {s: 0 for s in symbols}  # symbol -> next candle to deliver
+        self._delivered = {}  # symbol -> real time the last candle was delivered
+        self.order_latencies = []  # real seconds from candle delivery to fill
+
+        if start is None:
+            # first candle closed
+            start = min(self._ts[s][0] + timeframe_ms(self.timeframes[s]) for s in symbols)
+        self._start = int(start)
+        self._t0 = None  # real time the replay started
+
+    @classmethod
+    def from_store(cls, store, pairs, **kwargs):
+        '''Replay the stored candles of [(symbol, timeframe), ...]'''
+        candles = {}
+        for symbol, timeframe in pairs:
+            cols = store.read(symbol, timeframe)
+            candles[symbol] = list(zip(*(cols[c].tolist() for c in
+                                         ('timestamp', 'open', 'high', 'low', 'close', 'volume'))))
+        return cls(candles, timeframe=dict(pairs), **kwargs)
+
+    # -- simulated time -----------------------------------------------------
+
+    def milliseconds(self):
+        '''Simulated time (epoch ms)'''
+        if self._t0 is None:
+            return self._start
+        return self._start + int((self.clock() - self._t0) * 1000.0 * self.speed)
+
+    def start_replay(self):
+        if self._t0 is None:
+            self._t0 = self.clock()
+
+    def _closed(self, symbol):
+        # number of candles of `symbol` closed at the simulated time
+        tf = timeframe_ms(self.timeframes[symbol])
+        return int(np.searchsorted(self._ts[symbol], self.milliseconds() - tf, side='right'))
+
+    @property
+    def finished(self):
+        '''Every candle was delivered by watch_ohlcv'''
+        return all(self._cursor[s] >= len(ts) for s, ts in self._ts.items())
+
+    async def _delay(self):
+        latency = self.base_latency + self._random.uniform(0.0, self.jitter)
+        if latency:
+            await asyncio.sleep(latency)
+
+    async def _request(self, method, *args, weight=None):
+        await super(PaperExchange, self)._request(method, *args, weight=weight)
+        await self._delay()
+
+    # -- market data ----------------------------------------------------------
+
+    def last_price(self, symbol):
+        return self.candles[symbol][max(self._closed(symbol), 1) - 1][4]
+
+    async def fetch_ohlcv(self, symbol, timeframe='1h', since=None, limit=None, params={}):
+        await self._request('fetch_ohlcv', symbol, timeframe, since, limit)
+        rows = self.candles.get(symbol, [])[:self._closed(symbol)]
+        if since is not None:
+            rows = [r for r in rows if r[0] >= since]
+            return rows[:limit] if limit else rows
+        return rows[-limit:] if limit else rows
+
+    async def watch_ohlcv(self, symbol, timeframe='1h', since=None, limit=None, params={}):
+        '''
+        Wait (in accelerated time) for the next candle of `symbol` to close
+        and return it with the candle now forming, like ccxt.pro. Every
+        candle is delivered once, in order, even when the caller falls
+        behind the simulated time.
+        '''
+        self.start_replay()
+        ts = self._ts[symbol]
+        tf = timeframe_ms(self.timeframes[symbol])
+        k = self._cursor[symbol]
+        if k >= len(ts):
+            raise ReplayFinished(symbol)
+        wait = (ts[k] + tf - self.milliseconds()) / self.speed / 1000.0
+        await asyncio.sleep(max(0.0, wait))
+        self._cursor[symbol] = k + 1
+        closed = self.candles[symbol][k]
+        if k + 1 < len(ts):
+            forming = self.candles[symbol][k + 1]
+            opened = forming[1]
+        else:
+            forming = (closed[0] + tf,)
+            opened = closed[4]
+        self._delivered[symbol] = self.clock()
+        # only the open of the forming candle is known yet
+        return [list(closed), [forming[0], opened, opened, opened, opened, 0.0]]
+
+    def _book(self, symbol):
+        k = self._closed(symbol)
+        book = self._books.get(symbol)
+        if book is None or book['candle'] != k:
+            # a new candle closed: rebuild the book around its close
+            mid = self.last_price(symbol)
+            half = mid * self.spread_bps / 2e4
+            step = mid * self.level_bps / 1e4
+            book = dict(
+                candle=k,
+                bids=[[mid - half - i * step, self.depth] for i in range(self.levels)],
+                asks=[[mid + half + i * step, self.depth] for i in range(self.levels)],
+            )
+            self._books[symbol] = book
+        return book
+
+    async def fetch_order_book(self, symbol, limit=None, params={}):
+        await self._request('fetch_order_book', symbol, weight=5)
+        book = self._book(symbol)
+        bids = [list(level) for level in book['bids'] if level[1] > 0][:limit]
+        asks = [list(level) for level in book['asks'] if level[1] > 0][:limit]
+        return dict(symbol=symbol, bids=bids, asks=asks, timestamp=self.milliseconds())
+
+    async def fetch_ticker(self, symbol, params={}):
+        await self._request('fetch_ticker', symbol)
+        book = self._book(symbol)
+        bid = next((p for p, a in book['bids'] if a > 0), book['bids'][-1][0])
+        ask = next((p for p, a in book['asks'] if a > 0), book['asks'][-1][0])
+        return dict(symbol=symbol, bid=bid, ask=ask, last=self.last_price(symbol),
+                    timestamp=self.milliseconds())
+
+    # -- orders -----------------------------------------------------------------
+
+    async def _market_order(self, symbol, side, amount, params=None):
+        await self._request('create_order', symbol, side, amount, weight=1)
+        sign = 1 if side == 'buy' else -1
+        book = self._book(symbol)
+        levels = book['asks'] if side == 'buy' else book['bids']
+        remaining = amount
+        cost = 0.0
+        for level in levels:
+            take = min(remaining, level[1])
+            cost += take * level[0]
+            level[1] -= take
+            remaining -= take
+            if remaining <= 0:
+                break
+        if remaining > 0:
+            # the book is exhausted, the rest fills at its worst level
+            cost += remaining * levels[-1][0]
+        price = cost / amount * (1.0 + sign * self.slippage_bps / 1e4)
+        cost = price * amount
+        fee = cost * self.fee
+
+        base, quote = symbol.split('/') if '/' in symbol else (symbol, 'USD')
+        self.balance[base] = self.balance.get(base, 0.0) + sign * amount
+        self.balance[quote] = self.balance.get(quote, 0.0) - sign * cost - fee
+        if symbol in self._delivered:
+            self.order_latencies.append(self.clock() - self._delivered[symbol])
+        order = dict(id=str(next(self._ids)), symbol=symbol, side=side,
+                     type='market', amount=amount, filled=amount, remaining=0.0,
+                     price=price, average=price, cost=cost, status='closed',
+                     fee=dict(cost=fee, currency=quote, rate=self.fee),
+                     timestamp=self.milliseconds(),
+                     clientOrderId=(params or {}).get('clientOrderId'))
+        self.orders.append(order)
+        return order
+
+    def report(self):
+        '''Orders, balance and candle-to-fill latency of the replay so far'''
+        latencies = np.array(self.order_latencies)
+        return dict(
+            orders=len(self.orders),
+            fees=sum(o['fee']['cost'] for o in self.orders),
+            balance=dict(self.balance),
+            requests=len(self.log),
+            latency_p50=float(np.percentile(latencies, 50)) if len(latencies) else None,
+            latency_p99=float(np.percentile(latencies, 99)) if len(latencies) else None,
+            latency_max=float(latencies.max()) if len(latencies) else None,
+        )
+
+
+async def replay(exchange, pairs, indicators=None, trade_value=1000,
+                 adx_threshold=25, cooldown=172800, metrics=None):
+    '''
+    Run the live runners of trade_execution.py against a PaperExchange
+    until every candle of every pair was delivered and return
+    exchange.report(). The cooldown runs on candle (simulated) time. The
+    stage timings are recorded in `metrics` (latency.LatencyMetrics) if given.
+    '''
+    from live import LiveRunner, PortfolioRunner, WebSocketFeed
+
+    indicators = indicators or {}
+    runners = [LiveRunner(exchange, symbol, None, indicators.get((symbol, timeframe)),
+                          trade_value=trade_value, adx_threshold=adx_threshold,
+                          cooldown=cooldown, timeframe=timeframe,
+                          metrics=metrics)
+               for symbol, timeframe in pairs]
+    await PortfolioRunner(WebSocketFeed(exchange, pairs), runners).run()
+    return exchange.report()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from datastore import OHLCVStore
+    from latency import LatencyMetrics
+
+    parser = argparse.ArgumentParser(description='Replay stored candles through the live bot')
+    parser.add_argument('pairs', nargs='+', help='SYMBOL:TIMEFRAME, e.g. BTC/USDT:1h')
+    parser.add_argument('--speed', type=float, default=3600.0)
+    parser.add_argument('--fee', type=float, default=0.001)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--latency-out', default=None, help='JSON file for the stage timings')
+    args = parser.parse_args()
+    pairs = [tuple(p.rsplit(':', 1)) for p in args.pairs]
+    exchange = PaperExchange.from_store(OHLCVStore(), pairs, speed=args.speed,
+                                        fee=args.fee, latency=args.latency,
+                                        jitter=args.jitter)
+    metrics = LatencyMetrics() if args.latency_out else None
+    print(asyncio.run(replay(exchange, pairs, metrics=metrics)))
+    if metrics is not None:
+        metrics.dump(args.latency_out)
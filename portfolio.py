@@ -0,0 +1,263 @@
+'''
+Portfolio backtests: the models.py strategies over N symbols with one shared
+cash ledger.
+
+Every (symbol, strategy) pair is a sleeve. The bars of all the symbols are
+put on one synchronized time axis (the union of their timestamps) and the
+sleeves trade the same pool of cash:
+
+  - The entry/exit timing of each sleeve comes from the vectorized engine
+    (vectorized.signals and the strategy's trade rules, with cash that never
+    runs out), so it is computed over whole arrays per symbol.
+  - The portfolio then walks the axis only at the bars where some sleeve
+    trades, handling all the fills of a bar at once: exits first (they
+    release cash), then entries sized from the portfolio value at the open.
+  - An entry is sized to the sleeve's share of the value (its risk budget),
+    or so that a stop `atr_mult` ATRs away loses `risk` of the value. Entries
+    the cash or the gross exposure cap (`leverage` times the value) can not
+    fund are skipped, with their exit: the entries of a bar are funded in
+    sleeve order and each one only if what the ones before it left is
+    enough, so a skipped entry does not block the smaller ones after it.
+
+The value curve (cash + positions marked at the last close) is built
+vectorized from the fills like vectorized.backtest():
+
+    data = {s: store.read(s, '1d') for s in ('AAPL.US', 'MSFT.US', 'SPY.US')}
+    result = run_portfolio(data, cash=100000, commission=0.001)
+    result.stats()
+'''
+import numpy as np
+
+import vectorized
+from recorder import Recorder, trade_pnl
+
+FILL_DTYPE = np.dtype([
+    ('bar', np.int64),      # index on the time axis
+    ('sleeve', np.int64),   # index in PortfolioResult.sleeves
+    ('size', np.float64),
+    ('price', np.float64),
+    ('comm', np.float64),
+])
+
+# cash of the broker that plans the trades of a sleeve: enough to never
+# reject an order, small enough for 'all-in' sizes to stay exact
+_PLANNING_CASH = 1e15
+
+
+class PortfolioResult(object):
+    '''Outcome of a portfolio backtest'''
+
+    def __init__(self, timestamps, symbols, sleeves, fills, cash, positions,
+                 value, initial_cash, skipped):
+        self.timestamps = timestamps  # time axis (epoch ms)
+        self.symbols = symbols
+        self.sleeves = sleeves        # [(symbol, strategy name), ...]
+        self.fills = fills            # structured array with FILL_DTYPE
+        self.cash = cash              # cash per bar
+        self.positions = positions    # position per bar and sleeve
+        self.value = value            # portfolio value per bar
+        self.initial_cash = initial_cash
+        self.skipped = skipped        # entries skipped per sleeve
+
+    @property
+    def final_value(self):
+        return float(self.value[-1]) if len(self.value) else self.initial_cash
+
+    @property
+    def percentage_change(self):
+        return (self.final_value - self.initial_cash) / self.initial_cash * 100.0
+
+    def recorder(self):
+        '''recorder.Recorder of the portfolio (exposure: any sleeve invested)'''
+        rec = Recorder(0, self.initial_cash)
+        rec._equity, rec._cash = self.value, self.cash
+        rec._position = (self.positions != 0).any(axis=1).astype(float)
+        rec._fills = self.fills
+        rec.n, rec.n_fills = len(self.value), len(self.fills)
+        return rec
+
+    def sleeve_pnl(self):
+        '''Net PnL of the closed trades of every sleeve'''
+        return [trade_pnl(self.fills[self.fills['sleeve'] == k])
+                for k in range(len(self.sleeves))]
+
+    def stats(self, periods=252):
+        stats = self.recorder().stats(periods)
+        # trades are per sleeve: the position of the portfolio as a whole
+        # does not go back to 0 between them
+        pnl = np.concatenate(self.sleeve_pnl()) if self.sleeves else np.empty(0)
+        stats.update(
+            trades=len(pnl),
+            win_rate=float((pnl > 0).mean()) if len(pnl) else float('nan'),
+            avg_trade=float(pnl.mean()) if len(pnl) else float('nan'),
+            skipped=int(self.skipped.sum()),
+        )
+        return stats
+
+
+def _align(data):
+    # union time axis and per symbol: axis index of each bar and columns
+    columns = {s: vectorized._columns(d) for s, d in data.items()}
+    stamps = {s: vectorized._timestamps(d) for s, d in data.items()}
+    axis = np.unique(np.concatenate([stamps[s] for s in data])) if data else np.empty(0, np.int64)
+    where = {s: np.searchsorted(axis, stamps[s]) for s in data}
+    return axis, columns, where
+
+
+def _ffill(rows):
+    # forward fill the NaNs of every column of a (bars, symbols) matrix
+    idx = np.where(np.isnan(rows), 0, np.arange(len(rows))[:, None])
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return rows[idx, np.arange(rows.shape[1])]
+
+
+def _plan(strategy, columns, params, commission):
+    # (entry bar, exit bar or -1, direction) of the trades of one sleeve,
+    # on the bars of its symbol
+    name = strategy if isinstance(strategy, str) else strategy.__name__
+    _, params = vectorized._name_params(strategy, params)
+    sigs = vectorized.STRATEGIES[name][0](columns, cheat_on_open=True, **params)
+    broker = vectorized._Broker(columns['open'], _PLANNING_CASH, commission)
+    vectorized.STRATEGIES[name][1](sigs, broker)
+    fills = np.array(broker.fills, dtype=vectorized.FILL_DTYPE)
+    # every entry opens from flat and the fill after it closes the position
+    position = np.cumsum(fills['size'])
+    if (np.any(np.isclose(position[0::2], 0.0, atol=1e-9))
+            or not np.allclose(position[1::2], 0.0, atol=1e-9)):
+        raise ValueError(f'{name}: trades must open and close with one fill each')
+    entries, exits = fills[0::2], fills[1::2]
+    exit_bars = np.full(len(entries), -1, dtype=np.int64)
+    exit_bars[:len(exits)] = exits['bar']
+    return entries['bar'], exit_bars, np.sign(entries['size'])
+
+
+def run_portfolio(data, strategies=None, cash=100000, commission=0.001,
+                  weights=None, leverage=1.0, sizing='value', risk=0.01,
+                  atr_mult=3.0, atr_period=14, params=None):
+    '''
+    Backtest `strategies` (models.py classes or names, all of them by
+    default) on every symbol of `data` (dict symbol -> DataFrame with a
+    datetime index or dict of columns with a 'timestamp') sharing `cash`.
+
+    weights: risk budget per sleeve, {(symbol, strategy name): w} or
+             {strategy name: w} (1 for the ones not given), normalized to 1
+    sizing: 'value' (budget * portfolio value per entry) or 'atr' (size so
+            that a move of atr_mult ATRs costs `risk` of the value, capped
+            at the 'value' size)
+    params: {strategy name: dict(params)} for the strategies
+    '''
+    strategies = list(strategies or vectorized.STRATEGIES)
+    names = [s if isinstance(s, str) else s.__name__ for s in strategies]
+    params = params or {}
+    weights = weights or {}
+    axis, columns, where = _align(data)
+    symbols = list(data)
+    n, n_symbols = len(axis), len(symbols)
+
+    opens = np.full((n, n_symbols), np.nan)
+    closes = np.full((n, n_symbols), np.nan)
+    atrs = np.full((n, n_symbols), np.nan)
+    for j, s in enumerate(symbols):
+        opens[where[s], j] = columns[s]['open']
+        closes[where[s], j] = columns[s]['close']
+        if sizing == 'atr':
+            c = columns[s]
+            atrs[where[s], j] = vectorized._indicator(vectorized.atr, (c['high'], c['low'], c['close']),
+                                                      atr_period)
+    closes = _ffill(closes)
+    prev_close = np.vstack((np.full((1, n_symbols), np.nan), closes[:-1]))
+    prev_atr = np.vstack((np.full((1, n_symbols), np.nan), _ffill(atrs)[:-1]))
+    # price every position is marked at, at the open of a bar
+    mark = np.nan_to_num(np.where(np.isnan(opens), prev_close, opens))
+
+    # trades of every sleeve, on the time axis
+    sleeves, sleeve_symbol, budget = [], [], []
+    events = []  # (bar, kind (0 exit, 1 entry), sleeve, trade, direction)
+    trade = 0
+    for j, s in enumerate(symbols):
+        for strategy, name in zip(strategies, names):
+            k = len(sleeves)
+            sleeves.append((s, name))
+            sleeve_symbol.append(j)
+            budget.append(weights.get((s, name), weights.get(name, 1.0)))
+            entry, exit_, direction = _plan(strategy, columns[s], params.get(name, {}), commission)
+            ids = np.arange(trade, trade + len(entry))
+            trade += len(entry)
+            events.append(np.column_stack((where[s][entry], np.ones(len(entry)),
+                                           np.full(len(entry), k), ids, direction)))
+            held = exit_ >= 0
+            events.append(np.column_stack((where[s][exit_[held]], np.zeros(held.sum()),
+                                           np.full(held.sum(), k), ids[held], direction[held])))
+    sleeve_symbol = np.array(sleeve_symbol, dtype=np.int64)
+    budget = np.array(budget, dtype=float)
+    budget = budget / budget.sum() if budget.sum() > 0 else budget
+    events = np.vstack(events) if events else np.empty((0, 5))
+    # by bar, exits before entries, then sleeve order
+    events = events[np.lexsort((events[:, 2], events[:, 1], events[:, 0]))].astype(np.int64)
+
+    accepted = np.zeros(trade, dtype=bool)
+    sizes = np.zeros(trade)
+    pos = np.zeros(len(sleeves))
+    skipped = np.zeros(len(sleeves), dtype=np.int64)
+    free = float(cash)
+    fills = []
+    bars, starts = np.unique(events[:, 0], return_index=True)
+    for bar, batch in zip(bars, np.split(events, starts[1:])):
+        exits = batch[(batch[:, 1] == 0) & accepted[batch[:, 3]]]
+        if len(exits):
+            k = exits[:, 2]
+            size = -sizes[exits[:, 3]]
+            price = opens[bar, sleeve_symbol[k]]
+            comm = np.abs(size) * price * commission
+            free += float(np.sum(-size * price - comm))
+            pos[k] = 0.0
+            fills.append(np.column_stack((np.full(len(k), bar), k, size, price, comm)))
+
+        entries = batch[batch[:, 1] == 1]
+        if len(entries):
+            k, ids = entries[:, 2], entries[:, 3]
+            price = opens[bar, sleeve_symbol[k]]
+            marks = mark[bar, sleeve_symbol]
+            equity = free + float(pos @ marks)
+            target = budget[k] * equity
+            if sizing == 'atr':
+                atr = prev_atr[bar, sleeve_symbol[k]]
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    by_risk = risk * equity * price / (atr_mult * atr)
+                target = np.where(np.isfinite(by_risk), np.minimum(target, by_risk), target)
+            size = entries[:, 4] * target / price
+            comm = np.abs(size) * price * commission
+            # fund them in order, each from the cash and the exposure room
+            # the funded ones before it left
+            flow = -size * price - comm
+            exposure = np.abs(size) * price
+            cash_left = free
+            gross = float(np.abs(pos) @ marks)
+            ok = np.zeros(len(entries), dtype=bool)
+            for i in np.flatnonzero(size != 0):
+                if cash_left + flow[i] >= 0.0 and gross + exposure[i] <= leverage * equity:
+                    ok[i] = True
+                    cash_left += flow[i]
+                    gross += exposure[i]
+            skipped += np.bincount(k[~ok], minlength=len(sleeves))
+            k, ids, size, price, comm = k[ok], ids[ok], size[ok], price[ok], comm[ok]
+            accepted[ids] = True
+            sizes[ids] = size
+            pos[k] = size
+            free += float(np.sum(-size * price - comm))
+            fills.append(np.column_stack((np.full(len(k), bar), k, size, price, comm)))
+
+    rows = np.vstack(fills) if fills else np.empty((0, 5))
+    out = np.zeros(len(rows), dtype=FILL_DTYPE)
+    for i, field in enumerate(FILL_DTYPE.names):
+        out[field] = rows[:, i]
+
+    pos_delta = np.zeros((n, len(sleeves)))
+    cash_delta = np.zeros(n)
+    np.add.at(pos_delta, (out['bar'], out['sleeve']), out['size'])
+    np.add.at(cash_delta, out['bar'], -out['size'] * out['price'] - out['comm'])
+    positions = np.cumsum(pos_delta, axis=0)
+    cash_line = cash + np.cumsum(cash_delta)
+    value = cash_line + (positions * np.nan_to_num(closes[:, sleeve_symbol])).sum(axis=1)
+    return PortfolioResult(axis, symbols, sleeves, out, cash_line, positions, value,
+                           float(cash), skipped)
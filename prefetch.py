@@ -0,0 +1,298 @@
+'''
+Market data service: keeps the local OHLCV store warm so backtests and the
+live bot do not wait on downloads.
+
+DataService refreshes (symbol, timeframe, source) series incrementally (only
+the candles after the last stored one are fetched, see OHLCVStore.update):
+
+  - on demand: load() reads from the store and only refreshes a series when
+    it is not fresh: not refreshed since its last candle closed (plus
+    `delay`), or older than `max_age` when one is given
+  - on a schedule: run() refreshes every configured series shortly after
+    each of its candles closes, as a background daemon
+
+Concurrent requests for the same series are deduplicated: inside a process
+the callers wait for the refresh in flight (a lock per series, in-flight
+futures for the async ones) and across processes (the daemon and the
+backtests) an exclusive lock file in the series directory does the same.
+Whoever gets the lock second finds the series fresh and does not fetch.
+Every write to the store goes through that lock, the closed candles the
+live bot appends (append()) included, so two processes never write the
+same series at once.
+
+Sources: 'stooq' (daily candles), any ccxt exchange id ('binance', ...) and
+'stub', deterministic synthetic candles for offline testing. Setting the
+OHLCV_SOURCE environment variable (e.g. to 'stub') overrides the source of
+every request.
+
+    python cli.py daemon MSTR.US:1d:stooq BTC/USDT:1h:binance
+    data = DataService().load('MSTR.US', '1d', 'stooq')
+'''
+import asyncio
+import fcntl
+import logging
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+from datastore import OHLCVStore, ccxt_fetcher, stooq_fetcher, to_ms
+from live import timeframe_ms
+
+SOURCE_OVERRIDE = os.environ.get('OHLCV_SOURCE')
+MARKER = '.refreshed'  # mtime: last refresh of the series
+LOCK = '.lock'
+
+log = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------------------------
+# Offline stub source
+# ---------------------------------------------------------------------------
+
+def _uniform(x, seed):
+    # splitmix64 of the uint64 array x -> uniform [0, 1), stateless
+    z = x.astype(np.uint64) + np.uint64((seed * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+def _stub_close(idx, seed, price, volatility):
+    # log price: slow cycles with phases from the symbol plus noise per bar,
+    # a function of the bar number only, so any range can be generated alone
+    t = idx.astype(np.float64)
+    phases = _uniform(np.arange(3), seed) * 2.0 * np.pi
+    cycles = sum(np.sin(2.0 * np.pi * t / period + phase) * volatility * np.sqrt(period) / 4.0
+                 for period, phase in zip((40.0, 170.0, 730.0), phases))
+    noise = (_uniform(idx, seed + 1) - 0.5) * 2.0 * volatility
+    return price * np.exp(cycles + noise)
+
+
+def stub_fetcher(symbol, timeframe='1d', price=100.0, volatility=0.02, limit=1000,
+                 clock=time.time):
+    '''
+    Synthetic closed candles of `symbol`, the same on every call for the same
+    bar (seeded by the symbol), so a store filled from it behaves like one
+    filled from an exchange, without the network
+    '''
+    tf = timeframe_ms(timeframe)
+    seed = zlib.crc32(symbol.encode())
+
+    def fetch(start, end):
+        last_closed = int(clock() * 1000) // tf - 1
+        hi = last_closed if end is None else min(end // tf, last_closed)
+        lo = -(-start // tf) if start is not None else hi - limit + 1
+        idx = np.arange(max(lo, 0), hi + 1, dtype=np.int64)
+        close = _stub_close(idx, seed, price, volatility)
+        open_ = _stub_close(idx - 1, seed, price, volatility)
+        wick = _uniform(idx, seed + 2) * volatility / 2.0
+        return dict(timestamp=idx * tf, open=open_, close=close,
+                    high=np.maximum(open_, close) * (1.0 + wick),
+                    low=np.minimum(open_, close) * (1.0 - wick),
+                    volume=1000.0 * (0.5 + _uniform(idx, seed + 3)))
+    return fetch
+
+
+# ---------------------------------------------------------------------------
+# Service
+# ---------------------------------------------------------------------------
+
+class DataService(object):
+
+    def __init__(self, store=None, jobs=(), delay=5.0, concurrency=4,
+                 clock=time.time):
+        self.store = store or OHLCVStore()
+        # [(symbol, timeframe, source)] refreshed by run()
+        self.jobs = [tuple(job) for job in jobs]
+        self.delay = delay  # seconds after a candle closes before fetching it
+        self.concurrency = concurrency
+        self.clock = clock
+        self._locks = {}
+        self._guard = threading.Lock()
+        self._clients = {}  # ccxt exchange id -> client
+        self._inflight = {}  # (symbol, timeframe) -> future of the async refresh
+        self.stats = dict(refreshes=0, fetched=0, skipped=0, coalesced=0, errors=0)
+
+    def fetcher(self, source, symbol, timeframe):
+        source = SOURCE_OVERRIDE or source
+        if source == 'stub':
+            return stub_fetcher(symbol, timeframe, clock=self.clock)
+        if source == 'stooq':
+            return stooq_fetcher(symbol)
+        with self._guard:
+            client = self._clients.get(source)
+            if client is None:
+                import ccxt
+                client = self._clients[source] = getattr(ccxt, source)()
+        return ccxt_fetcher(client, symbol, timeframe)
+
+    # -- freshness ------------------------------------------------------------
+
+    def _marker(self, symbol, timeframe):
+        return os.path.join(self.store.path(symbol, timeframe), MARKER)
+
+    def age(self, symbol, timeframe):
+        '''Seconds since the last refresh of the series (None: never)'''
+        try:
+            return self.clock() - os.path.getmtime(self._marker(symbol, timeframe))
+        except OSError:
+            return None
+
+    def fresh(self, symbol, timeframe, max_age=None):
+        '''
+        Whether the series was refreshed after its last candle closed (and
+        `delay` passed, the time the exchange needs to serve it), or less
+        than `max_age` seconds ago when given
+        '''
+        if max_age is not None:
+            age = self.age(symbol, timeframe)
+            return age is not None and age < max_age
+        try:
+            mtime = os.path.getmtime(self._marker(symbol, timeframe))
+        except OSError:
+            return False
+        tf = timeframe_ms(timeframe) / 1000.0
+        # close of the last candle that can be fetched by now
+        closed = (self.clock() - self.delay) // tf * tf
+        return mtime >= closed + self.delay
+
+    @contextmanager
+    def _lock(self, symbol, timeframe):
+        # one refresh of a series at a time: threads of this process, then
+        # the other processes sharing the store
+        with self._guard:
+            lock = self._locks.setdefault((symbol, timeframe), threading.Lock())
+        with lock:
+            path = self.store.path(symbol, timeframe)
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, LOCK), 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    # -- refreshing -----------------------------------------------------------
+
+    def _covered(self, symbol, timeframe, start):
+        # the stored history goes back to `start`
+        if start is None:
+            return True
+        first = self.store.first_timestamp(symbol, timeframe)
+        return first is not None and first <= to_ms(start)
+
+    def refresh(self, symbol, timeframe, source='stooq', max_age=0.0, start=None,
+                fetch=None):
+        '''
+        Fetch the candles of the series newer than the stored ones (and the
+        ones from `start` to the first stored one), unless it was refreshed
+        less than `max_age` seconds ago (by anyone; None: unless it is fresh,
+        see fresh(), 0: always). `fetch(start, end)`
+        replaces the fetcher of `source` when given (e.g. ccxt_fetcher of a
+        client of the caller). Returns the number of candles added.
+        '''
+        def done():
+            return (max_age != 0 and self.fresh(symbol, timeframe, max_age)
+                    and self._covered(symbol, timeframe, start))
+
+        if done():
+            self.stats['skipped'] += 1
+            return 0
+        with self._lock(symbol, timeframe):
+            # someone else may have refreshed it while we waited
+            if done():
+                self.stats['skipped'] += 1
+                return 0
+            fetch = fetch or self.fetcher(source, symbol, timeframe)
+            added = self.store.update(symbol, timeframe, fetch, start=start)
+            marker = self._marker(symbol, timeframe)
+            with open(marker, 'a'):
+                pass
+            now = self.clock()
+            os.utime(marker, (now, now))
+        self.stats['refreshes'] += 1
+        self.stats['fetched'] += added
+        return added
+
+    def append(self, symbol, timeframe, data):
+        '''OHLCVStore.append() under the lock of the series'''
+        with self._lock(symbol, timeframe):
+            return self.store.append(symbol, timeframe, data)
+
+    async def arefresh(self, symbol, timeframe, source='stooq', max_age=0.0):
+        '''refresh() in a thread; concurrent calls for a series share one'''
+        key = (symbol, timeframe)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(future)
+        future = asyncio.ensure_future(
+            asyncio.to_thread(self.refresh, symbol, timeframe, source, max_age))
+        self._inflight[key] = future
+        try:
+            return await future
+        finally:
+            self._inflight.pop(key, None)
+
+    def load(self, symbol, timeframe, source='stooq', start=None, end=None,
+             max_age=None):
+        '''
+        DataFrame of the series from the store, refreshed first only if it
+        is not fresh (see fresh(), `max_age` seconds when given) or the store
+        does not go back to `start`
+        '''
+        if not (self.fresh(symbol, timeframe, max_age) and self._covered(symbol, timeframe, start)):
+            try:
+                self.refresh(symbol, timeframe, source, max_age, start)
+            except Exception as e:
+                # serve what is stored, if anything
+                if not self.store.size(symbol, timeframe):
+                    raise
+                log.warning('refresh of %s %s failed, serving stored data: %r',
+                            symbol, timeframe, e)
+        return self.store.frame(symbol, timeframe, start, end)
+
+    # -- daemon -----------------------------------------------------------------
+
+    def due(self, timeframe, now=None):
+        '''Time (epoch s) to fetch the next candle of `timeframe` to close'''
+        tf = timeframe_ms(timeframe) / 1000.0
+        now = self.clock() if now is None else now
+        return (now // tf + 1) * tf + self.delay
+
+    async def run(self, once=False):
+        '''
+        Refresh every job now, then after each close of its candles (plus
+        `delay`), at most `concurrency` at a time. A failed refresh is logged
+        and retried at the next close. With `once` only the first round runs.
+        '''
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def refresh(symbol, timeframe, source):
+            async with semaphore:
+                try:
+                    added = await self.arefresh(symbol, timeframe, source,
+                                                max_age=None)
+                    log.info('%s %s: %d new candles', symbol, timeframe, added)
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    log.warning('refresh of %s %s failed: %r', symbol, timeframe, e)
+
+        next_due = {job: 0.0 for job in self.jobs}
+        while next_due:
+            now = self.clock()
+            ready = [job for job, t in next_due.items() if t <= now]
+            if ready:
+                await asyncio.gather(*(refresh(*job) for job in ready))
+                if once:
+                    return
+                now = self.clock()
+                for job in ready:
+                    next_due[job] = self.due(job[1], now)
+                continue
+            await asyncio.sleep(max(0.0, min(next_due.values()) - now))
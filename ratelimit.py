@@ -0,0 +1,227 @@
+'''
+Rate-limit aware request layer in front of a ccxt client.
+
+RateLimitedExchange wraps an exchange (ccxt.pro / ccxt.async_support, or a
+sync ccxt client run in threads) and sends every REST call through one
+scheduler:
+
+  - Each endpoint spends weight from one or more token buckets (request
+    weight per minute, orders per second...), a call waits until its
+    buckets have enough tokens instead of being throttled by the exchange
+  - Waiting calls are served by priority: order traffic before data traffic
+  - Identical fetch_ticker/fetch_ohlcv calls in flight at the same time are
+    coalesced into one request (reads only, never orders)
+  - Data calls are retried with backoff on network errors and rate limit
+    answers; orders are only retried when the exchange refused them because
+    of the rate limit, never after an ambiguous network error
+
+pooled_async_session/pooled_sync_session give the clients keep-alive
+connection pools sized for the number of concurrent requests.
+'''
+import asyncio
+import heapq
+import inspect
+import itertools
+import json
+import time
+
+from lazy import lazy_import
+
+ccxt = lazy_import('ccxt')
+
+ORDER = 0  # priorities, lower is served first
+DATA = 1
+
+# Token buckets: name -> (capacity, refill per second). Defaults follow the
+# Binance spot limits (1200 request weight per minute, 10 orders per second)
+BUCKETS = {
+    'weight': (1200, 1200 / 60.0),
+    'orders': (10, 10.0),
+}
+
+# Endpoint -> (priority, {bucket: weight}, coalesce)
+ENDPOINTS = {
+    'fetch_ohlcv': (DATA, {'weight': 2}, True),
+    'fetch_ticker': (DATA, {'weight': 2}, True),
+    'fetch_tickers': (DATA, {'weight': 40}, True),
+    'fetch_order_book': (DATA, {'weight': 5}, True),
+    'fetch_balance': (DATA, {'weight': 10}, False),
+    'fetch_open_orders': (DATA, {'weight': 3}, False),
+    'fetch_orders': (DATA, {'weight': 10}, False),
+    'fetch_order': (DATA, {'weight': 2}, False),
+    'create_order': (ORDER, {'weight': 1, 'orders': 1}, False),
+    'create_market_buy_order': (ORDER, {'weight': 1, 'orders': 1}, False),
+    'create_market_sell_order': (ORDER, {'weight': 1, 'orders': 1}, False),
+    'cancel_order': (ORDER, {'weight': 1}, False),
+}
+DEFAULT_ENDPOINT = (DATA, {'weight': 1}, False)
+
+
+async def call(fn, *args, **kwargs):
+    # ccxt.pro/ccxt.async_support methods are coroutines; a sync ccxt client
+    # is run in a thread so it never blocks the event loop
+    if inspect.iscoroutinefunction(fn):
+        return await fn(*args, **kwargs)
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+class TokenBucket(object):
+    '''`capacity` tokens refilled at `rate` tokens per second'''
+
+    def __init__(self, capacity, rate, clock=time.monotonic):
+        self.capacity = capacity
+        self.rate = rate
+        self.clock = clock
+        self.tokens = float(capacity)
+        self._stamp = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def delay(self, weight):
+        '''Seconds until `weight` tokens are available (0 if they are now)'''
+        self._refill()
+        if self.tokens >= weight:
+            return 0.0
+        return (weight - self.tokens) / self.rate
+
+    def take(self, weight):
+        self._refill()
+        self.tokens -= weight
+
+
+class RateLimitedExchange(object):
+    '''
+    Drop-in wrapper of a ccxt exchange: the endpoints in ENDPOINTS go
+    through the scheduler, everything else (watch_ohlcv, markets, close...)
+    is passed to the wrapped client.
+    '''
+
+    def __init__(self, exchange, buckets=None, endpoints=None, retries=3,
+                 backoff=0.5, clock=time.monotonic):
+        self.exchange = exchange
+        self.buckets = {name: TokenBucket(capacity, rate, clock)
+                        for name, (capacity, rate) in (buckets or BUCKETS).items()}
+        self.endpoints = dict(ENDPOINTS, **(endpoints or {}))
+        self.retries = retries
+        self.backoff = backoff
+        self._queue = []  # heap of (priority, seq, weights, future)
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+        self._inflight = {}  # coalescing key -> future
+        self.stats = dict(requests=0, coalesced=0, retries=0, waited=0.0)
+
+    def __getattr__(self, name):
+        if name in self.__dict__.get('endpoints', ()):
+            async def endpoint(*args, **kwargs):
+                return await self.request(name, *args, **kwargs)
+            endpoint.__name__ = name
+            return endpoint
+        return getattr(self.exchange, name)
+
+    async def request(self, method, *args, **kwargs):
+        priority, weights, coalesce = self.endpoints.get(method, DEFAULT_ENDPOINT)
+        # only reads are coalesced: two identical orders are two orders
+        if not (coalesce and method.startswith('fetch_')):
+            return await self._send(method, priority, weights, args, kwargs)
+        # serialized, so dict/list arguments (params={...}) can be part of it
+        key = json.dumps([method, args, kwargs], sort_keys=True, default=str)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(future)
+        future = asyncio.ensure_future(self._send(method, priority, weights, args, kwargs))
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _send(self, method, priority, weights, args, kwargs):
+        fn = getattr(self.exchange, method)
+        attempt = 0
+        while True:
+            await self._slot(priority, weights)
+            self.stats['requests'] += 1
+            try:
+                return await call(fn, *args, **kwargs)
+            except (ccxt.RateLimitExceeded, ccxt.DDoSProtection):
+                # refused by the exchange: safe to retry, orders included.
+                # Drain the buckets so everything slows down
+                for name in weights:
+                    self.buckets[name].tokens = min(0.0, self.buckets[name].tokens)
+                if attempt >= self.retries:
+                    raise
+            except ccxt.NetworkError:
+                # an order may have gone through, only data calls are retried
+                if priority == ORDER or attempt >= self.retries:
+                    raise
+            attempt += 1
+            self.stats['retries'] += 1
+            await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+    async def _slot(self, priority, weights):
+        # wait for our turn in the priority queue and for the tokens
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), weights, future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        else:
+            self._wakeup.set()
+        await future
+
+    async def _dispatch(self):
+        while self._queue:
+            priority, _, weights, future = self._queue[0]
+            if future.cancelled():
+                heapq.heappop(self._queue)
+                continue
+            delay = max(self.buckets[name].delay(w) for name, w in weights.items())
+            if delay > 0:
+                # a higher priority request may arrive meanwhile
+                self._wakeup.clear()
+                start = time.monotonic()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self.stats['waited'] += time.monotonic() - start
+                continue
+            heapq.heappop(self._queue)
+            for name, w in weights.items():
+                self.buckets[name].take(w)
+            future.set_result(None)
+
+    async def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+        close = getattr(self.exchange, 'close', None)
+        if close is not None:
+            await call(close)
+
+
+def pooled_async_session(pool_size=32, keepalive_timeout=60):
+    '''
+    aiohttp session with a keep-alive connection pool, to pass as
+    config['session'] to a ccxt.pro/ccxt.async_support exchange (to be
+    created inside the running event loop and closed by the caller)
+    '''
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(limit=pool_size, keepalive_timeout=keepalive_timeout,
+                                     ttl_dns_cache=300, enable_cleanup_closed=True)
+    return aiohttp.ClientSession(connector=connector)
+
+
+def pooled_sync_session(pool_size=32):
+    '''requests session with a keep-alive pool, for exchange.session of a sync client'''
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
@@ -0,0 +1,197 @@
+'''
+Compact, array-backed recorder of backtest results.
+
+The per-bar equity, cash and position and the fills of a run are stored in
+preallocated typed NumPy arrays (no per-bar Python objects), and the
+performance statistics (returns, drawdown, Sharpe, trades, win rate,
+exposure) are computed over the whole arrays at once. Results are exported
+as one .npy file per array, which load back memory-mapped:
+
+    cerebro.addanalyzer(RecorderAnalyzer, _name='recorder')
+    rec = cerebro.run()[0].analyzers.recorder.get_analysis()
+    rec.stats()
+    rec.save('results/macd_mstr')
+    Recorder.load('results/macd_mstr').equity
+
+Recorder.from_result() wraps the Result of a vectorized backtest the same way.
+'''
+import json
+import math
+import os
+
+import numpy as np
+
+from vectorized import FILL_DTYPE
+
+ARRAYS = ('equity', 'cash', 'position')
+
+
+def returns(equity, start_value=None):
+    '''Simple returns per bar (from `start_value` to the first bar if given)'''
+    equity = np.asarray(equity, dtype=float)
+    if start_value is not None:
+        equity = np.concatenate(([start_value], equity))
+    return np.diff(equity) / equity[:-1]
+
+
+def drawdown(equity):
+    '''Drawdown from the running peak per bar, as a fraction'''
+    equity = np.asarray(equity, dtype=float)
+    peak = np.maximum.accumulate(equity)
+    return (peak - equity) / peak
+
+
+def sharpe(rets, periods=252):
+    '''Annualized Sharpe ratio of per-bar returns (risk free rate 0)'''
+    std = rets.std(ddof=1) if len(rets) > 1 else 0.0
+    return rets.mean() / std * math.sqrt(periods) if std > 0 else float('nan')
+
+
+def trade_pnl(fills):
+    '''
+    Net PnL (after commission) of every closed trade: a trade closes when the
+    position gets back to 0
+    '''
+    if not len(fills):
+        return np.empty(0)
+    position = np.cumsum(fills['size'])
+    closes = np.isclose(position, 0.0, atol=1e-9)
+    # trade of every fill: the number of trades closed before it
+    trade = np.concatenate(([0], np.cumsum(closes)[:-1]))
+    flows = -fills['size'] * fills['price'] - fills['comm']
+    n_closed = int(closes.sum())
+    return np.bincount(trade, weights=flows, minlength=n_closed + 1)[:n_closed]
+
+
+class Recorder(object):
+
+    def __init__(self, n, start_value=10000.0, fills_capacity=256):
+        self.start_value = float(start_value)
+        self.n = 0
+        self.n_fills = 0
+        self._equity = np.full(n, np.nan)
+        self._cash = np.full(n, np.nan)
+        self._position = np.zeros(n)
+        self._fills = np.zeros(fills_capacity, dtype=FILL_DTYPE)
+
+    # recorded part of the buffers (views)
+    equity = property(lambda self: self._equity[:self.n])
+    cash = property(lambda self: self._cash[:self.n])
+    position = property(lambda self: self._position[:self.n])
+    fills = property(lambda self: self._fills[:self.n_fills])
+
+    def _grow(self):
+        # only when the number of bars was not known upfront
+        size = max(2 * len(self._equity), 1)
+        for name in ('_equity', '_cash', '_position'):
+            old = getattr(self, name)
+            new = np.full(size, np.nan) if name != '_position' else np.zeros(size)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def record_bar(self, value, cash, position):
+        i = self.n
+        if i == len(self._equity):
+            self._grow()
+        self._equity[i] = value
+        self._cash[i] = cash
+        self._position[i] = position
+        self.n = i + 1
+
+    def record_fill(self, bar, size, price, comm):
+        i = self.n_fills
+        if i == len(self._fills):
+            fills = np.zeros(2 * len(self._fills), dtype=FILL_DTYPE)
+            fills[:i] = self._fills
+            self._fills = fills
+        self._fills[i] = (bar, size, price, comm)
+        self.n_fills = i + 1
+
+    @classmethod
+    def from_result(cls, result):
+        '''Recorder over the arrays of a vectorized.Result (no copy)'''
+        rec = cls(0, result.initial_cash)
+        rec._equity, rec._cash, rec._position = result.value, result.cash, result.position
+        rec._fills = np.asarray(result.fills, dtype=FILL_DTYPE)
+        rec.n, rec.n_fills = len(result.value), len(result.fills)
+        return rec
+
+    def stats(self, periods=252):
+        '''Performance statistics of the run (percentages in %)'''
+        equity = self.equity
+        rets = returns(equity, self.start_value)
+        pnl = trade_pnl(self.fills)
+        final = float(equity[-1]) if len(equity) else self.start_value
+        return dict(
+            bars=self.n,
+            final_value=final,
+            return_pct=(final - self.start_value) / self.start_value * 100.0,
+            max_drawdown_pct=float(drawdown(np.concatenate(([self.start_value], equity))).max()) * 100.0,
+            sharpe=sharpe(rets, periods),
+            fills=self.n_fills,
+            trades=len(pnl),
+            win_rate=float((pnl > 0).mean()) if len(pnl) else float('nan'),
+            avg_trade=float(pnl.mean()) if len(pnl) else float('nan'),
+            exposure=float((self.position != 0).mean()) if self.n else 0.0,
+            commission=float(self.fills['comm'].sum()),
+        )
+
+    def save(self, path):
+        '''Write one .npy per array (and meta.json) under the directory `path`'''
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAYS + ('fills',):
+            data = getattr(self, name)
+            out = np.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode='w+',
+                                            dtype=data.dtype, shape=data.shape)
+            out[...] = data
+            out.flush()
+            del out
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(dict(start_value=self.start_value, bars=self.n, fills=self.n_fills), f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        '''Recorder over the memory-mapped arrays saved in `path`'''
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        rec = cls(0, meta['start_value'])
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+                  for name in ARRAYS + ('fills',)}
+        rec._equity, rec._cash, rec._position = (arrays[n] for n in ARRAYS)
+        rec._fills = arrays['fills']
+        rec.n, rec.n_fills = meta['bars'], meta['fills']
+        return rec
+
+
+def _analyzer():
+    import backtrader as bt
+
+    class RecorderAnalyzer(bt.Analyzer):
+        '''Records a Cerebro run in a Recorder (get_analysis() returns it)'''
+
+        def start(self):
+            self.recorder = Recorder(max(self.data.buflen(), 1), self.strategy.broker.getvalue())
+
+        def notify_order(self, order):
+            if order.status == order.Completed:
+                self.recorder.record_fill(len(self.strategy) - 1, order.executed.size,
+                                          order.executed.price, order.executed.comm)
+
+        def next(self):
+            broker = self.strategy.broker
+            self.recorder.record_bar(broker.getvalue(), broker.getcash(),
+                                     self.strategy.position.size)
+
+        def get_analysis(self):
+            return self.recorder
+
+    return RecorderAnalyzer
+
+
+def __getattr__(name):
+    # RecorderAnalyzer is built on first use: the arrays and statistics do
+    # not need backtrader
+    if name == 'RecorderAnalyzer':
+        globals()[name] = _analyzer()
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,212 @@
+'''
+Crash-safe state of the live bot: positions, orders in flight and cooldowns.
+
+Every change is appended to a write-ahead log (one JSON record per line,
+prefixed with its CRC32) and fsync'ed before the bot acts on it: an order is
+logged as 'submit' (with its client order id) before it is sent, and as
+'fill' once the exchange confirmed it. A snapshot of the whole state is
+written atomically every `snapshot_every` records (and on close), after which
+the log starts over, so recovery reads one small JSON file plus a short log.
+A torn record at the end of the log (crash mid-write) is dropped.
+
+Orders logged as submitted but never confirmed are in doubt: reconcile()
+looks them up on the exchange by client order id and logs what happened to
+them, then compares the positions with the exchange balance.
+
+    state = StateLog('state')
+    state.recover()
+    runner = LiveRunner(..., state=state)
+    await runner.restore()
+'''
+import json
+import os
+import uuid
+import zlib
+
+from ratelimit import call
+
+WAL = 'wal.log'
+SNAPSHOT = 'snapshot.json'
+
+
+def client_order_id(prefix='bot'):
+    # unique, and short enough for the exchanges (binance: 36 characters)
+    return f'{prefix}{uuid.uuid4().hex[:24]}'
+
+
+def _empty_pair():
+    return dict(position=None, amount=None, cooldown_until=None, orders={})
+
+
+def apply(state, record):
+    '''Apply one log record to `state` (dict of pair key -> pair state)'''
+    pair = state.setdefault(record['key'], _empty_pair())
+    kind = record['type']
+    if kind == 'cooldown':
+        pair['cooldown_until'] = record['until']
+    elif kind == 'submit':
+        pair['orders'][record['cid']] = dict(intent=record['intent'], amount=record['amount'],
+                                             time=record.get('time'))
+    elif kind == 'fill':
+        order = pair['orders'].pop(record['cid'], None)
+        intent = order['intent'] if order else record['intent']
+        if intent['action'] == 'close':
+            pair['position'] = None
+            pair['amount'] = None
+        else:
+            pair['position'] = 'long' if intent['side'] == 'buy' else 'short'
+            pair['amount'] = record['amount']
+    elif kind == 'cancel':
+        pair['orders'].pop(record['cid'], None)
+    else:
+        raise ValueError(f'unknown state record {kind!r}')
+
+
+class StateLog(object):
+
+    def __init__(self, root='state', fsync=True, snapshot_every=1000):
+        self.root = root
+        self.fsync = fsync
+        self.snapshot_every = snapshot_every
+        self.state = {}
+        self.seq = 0  # sequence number of the last record applied
+        self._since_snapshot = 0
+        self._wal = None
+
+    @property
+    def wal_path(self):
+        return os.path.join(self.root, WAL)
+
+    @property
+    def snapshot_path(self):
+        return os.path.join(self.root, SNAPSHOT)
+
+    def pair(self, key):
+        return self.state.setdefault(key, _empty_pair())
+
+    def recover(self):
+        '''Load the snapshot, replay the log after it and open the log for appending'''
+        os.makedirs(self.root, exist_ok=True)
+        self.state, self.seq = {}, 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as f:
+                snap = json.load(f)
+            self.state, self.seq = snap['state'], snap['seq']
+
+        valid = 0  # bytes of the log up to the last good record
+        replayed = 0
+        if os.path.exists(self.wal_path):
+            with open(self.wal_path, 'rb') as f:
+                for line in f:
+                    record = self._decode(line)
+                    if record is None:
+                        break  # torn or corrupt tail
+                    valid += len(line)
+                    if record['seq'] > self.seq:
+                        apply(self.state, record)
+                        self.seq = record['seq']
+                        replayed += 1
+        self._wal = open(self.wal_path, 'ab')
+        self._wal.truncate(valid)
+        self._since_snapshot = replayed
+        return self.state
+
+    @staticmethod
+    def _decode(line):
+        if not line.endswith(b'\n') or len(line) < 10:
+            return None
+        crc, payload = line[:8], line[9:-1]
+        try:
+            if int(crc, 16) != zlib.crc32(payload):
+                return None
+            return json.loads(payload)
+        except ValueError:
+            return None
+
+    def append(self, record):
+        '''Apply `record` and make it durable before returning its sequence number'''
+        if self._wal is None:
+            self.recover()
+        record = dict(record, seq=self.seq + 1)
+        apply(self.state, record)
+        self.seq = record['seq']
+        payload = json.dumps(record, separators=(',', ':')).encode()
+        self._wal.write(b'%08x %s\n' % (zlib.crc32(payload), payload))
+        self._wal.flush()
+        if self.fsync:
+            os.fsync(self._wal.fileno())
+        self._since_snapshot += 1
+        if self._since_snapshot >= self.snapshot_every:
+            self.snapshot()
+        return self.seq
+
+    def snapshot(self):
+        '''Write the whole state atomically and start a new log'''
+        tmp = self.snapshot_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(dict(seq=self.seq, state=self.state), f)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        if self.fsync and hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(self.root, os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        # the records up to self.seq are in the snapshot now
+        if self._wal is not None:
+            self._wal.truncate(0)
+            self._wal.seek(0)
+            if self.fsync:
+                os.fsync(self._wal.fileno())
+        self._since_snapshot = 0
+
+    def close(self):
+        if self._wal is not None:
+            self.snapshot()
+            self._wal.close()
+            self._wal = None
+
+
+async def _lookup(exchange, symbol, cid, since=None):
+    # the order placed with client order id `cid`, or None
+    orders = await call(exchange.fetch_orders, symbol, since)
+    for order in orders:
+        info = order.get('info') or {}
+        if cid in (order.get('clientOrderId'), info.get('clientOrderId')):
+            return order
+    return None
+
+
+async def reconcile(state, exchange, key, symbol):
+    '''
+    Resolve the in-doubt orders of pair `key` against the exchange (logged as
+    fill or cancel) and compare the position with the exchange balance of
+    the base currency. Returns the list of discrepancies found (the bot does
+    not trade them away).
+    '''
+    pair = state.pair(key)
+    for cid, order in list(pair['orders'].items()):
+        since = order['time'] - 60000 if order.get('time') else None
+        found = await _lookup(exchange, symbol, cid, since)
+        if found is not None and (found.get('filled') or 0) > 0:
+            state.append(dict(type='fill', key=key, cid=cid, intent=order['intent'],
+                              amount=found['filled'], price=found.get('average') or found.get('price'),
+                              id=found.get('id')))
+        else:
+            state.append(dict(type='cancel', key=key, cid=cid))
+
+    problems = []
+    base = symbol.split('/')[0]
+    balance = await call(exchange.fetch_balance)
+    held = (balance.get('total') or {}).get(base)
+    if held is not None:
+        expected = pair['amount'] or 0.0
+        if pair['position'] == 'short':
+            expected = -expected
+        if abs(held - expected) > 1e-9 * max(1.0, abs(expected)):
+            problems.append(f'{symbol}: state {pair["position"]} {expected:g} {base}, '
+                            f'exchange balance {held:g} {base}')
+    return problems
@@ -0,0 +1,267 @@
+'''
+Streaming (incremental) versions of the talib indicators used by the live
+bot in trade_execution.py.
+
+Each indicator is updated with one closed candle at a time in O(1) and gives
+the same values as talib run over the whole history (same seeding, Wilder
+smoothing for RSI/ADX). LiveIndicators bundles MACD/signal/RSI/ADX with ring
+buffers of their recent values and the MACD confirmation window, so the cost
+of a tick does not depend on how much history has been seen.
+'''
+import math
+from collections import deque
+
+import numpy as np
+
+NAN = float('nan')
+
+
+class RingBuffer(object):
+    '''
+    Fixed size buffer of the latest values. Index it like the end of an
+    array: buf[-1] is the newest value, buf[-2] the one before...
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self._data = np.full(size, np.nan)
+        self._pos = 0  # next slot to write
+        self.count = 0  # values appended so far
+
+    def append(self, value):
+        self._data[self._pos] = value
+        self._pos = (self._pos + 1) % self.size
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < 0:
+            raise IndexError('RingBuffer index out of range')
+        return self._data[(self._pos + i) % self.size]
+
+    def last(self, n):
+        '''The latest n values as an array, oldest first'''
+        n = min(n, len(self))
+        idx = (self._pos - n + np.arange(n)) % self.size
+        return self._data[idx]
+
+
+class EMA(object):
+    '''talib.EMA: seeded with the SMA of the first `period` values'''
+
+    def __init__(self, period):
+        self.period = period
+        self.alpha = 2.0 / (period + 1)
+        self.value = NAN
+        self._seed = []
+
+    def seed(self, values):
+        # start from the SMA of `values` (used by MACD to align the seeds)
+        self.value = sum(values) / len(values)
+        self._seed = None
+        return self.value
+
+    def update(self, x):
+        if self._seed is not None:
+            self._seed.append(x)
+            if len(self._seed) == self.period:
+                return self.seed(self._seed)
+            return NAN
+        self.value += self.alpha * (x - self.value)
+        return self.value
+
+
+class MACD(object):
+    '''
+    talib.MACD: like talib, the fast EMA is seeded on the `fast` values that
+    end where the slow EMA gets its first value, so both start together.
+    '''
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.fast = EMA(fast)
+        self.slow = EMA(slow)
+        self.signal = EMA(signal)
+        self._warmup = deque(maxlen=fast)
+        self.macd = self.macd_signal = self.hist = NAN
+
+    def update(self, x):
+        if self._warmup is not None:
+            self._warmup.append(x)
+            slow = self.slow.update(x)
+            if math.isnan(slow):
+                return self.macd, self.macd_signal, self.hist
+            fast = self.fast.seed(self._warmup)
+            self._warmup = None
+        else:
+            fast = self.fast.update(x)
+            slow = self.slow.update(x)
+        macd = fast - slow
+        signal = self.signal.update(macd)
+        # like talib, nothing is output until the signal line has a value
+        if not math.isnan(signal):
+            self.macd, self.macd_signal, self.hist = macd, signal, macd - signal
+        return self.macd, self.macd_signal, self.hist
+
+
+class RSI(object):
+    '''talib.RSI (Wilder smoothing, seeded with the mean of the first gains)'''
+
+    def __init__(self, period=14):
+        self.period = period
+        self.value = NAN
+        self._prev = None
+        self._count = 0
+        self._gain = self._loss = 0.0
+
+    def update(self, x):
+        prev, self._prev = self._prev, x
+        if prev is None:
+            return NAN
+        diff = x - prev
+        gain = diff if diff > 0 else 0.0
+        loss = -diff if diff < 0 else 0.0
+        p = self.period
+        if self._count < p:
+            self._count += 1
+            self._gain += gain
+            self._loss += loss
+            if self._count < p:
+                return NAN
+            self._gain /= p
+            self._loss /= p
+        else:
+            self._gain = (self._gain * (p - 1) + gain) / p
+            self._loss = (self._loss * (p - 1) + loss) / p
+        total = self._gain + self._loss
+        self.value = 100.0 * self._gain / total if total != 0 else 0.0
+        return self.value
+
+
+def _is_zero(x):
+    return -1e-14 < x < 1e-14
+
+
+class ADX(object):
+    '''talib.ADX (Wilder smoothed +DM/-DM/TR, ADX seeded with the mean DX)'''
+
+    def __init__(self, period=14):
+        self.period = period
+        self.value = NAN
+        self._prev = None
+        self._count = 0  # candles after the first one
+        self._plus_dm = self._minus_dm = self._tr = 0.0
+        self._sum_dx = 0.0
+
+    def _dx(self):
+        if _is_zero(self._tr):
+            return None
+        minus_di = 100.0 * self._minus_dm / self._tr
+        plus_di = 100.0 * self._plus_dm / self._tr
+        total = minus_di + plus_di
+        if _is_zero(total):
+            return None
+        return 100.0 * abs(minus_di - plus_di) / total
+
+    def update(self, high, low, close):
+        prev, self._prev = self._prev, (high, low, close)
+        if prev is None:
+            return NAN
+        prev_high, prev_low, prev_close = prev
+        diff_p = high - prev_high
+        diff_m = prev_low - low
+        plus_dm = minus_dm = 0.0
+        if diff_m > 0 and diff_p < diff_m:
+            minus_dm = diff_m
+        elif diff_p > 0 and diff_p > diff_m:
+            plus_dm = diff_p
+        tr = max(high - low, abs(high - prev_close), abs(low - prev_close))
+
+        p = self.period
+        self._count += 1
+        if self._count < p:
+            # sums of the first period - 1 values
+            self._plus_dm += plus_dm
+            self._minus_dm += minus_dm
+            self._tr += tr
+            return NAN
+
+        self._plus_dm += plus_dm - self._plus_dm / p
+        self._minus_dm += minus_dm - self._minus_dm / p
+        self._tr += tr - self._tr / p
+        dx = self._dx()
+        if self._count < 2 * p:
+            if dx is not None:
+                self._sum_dx += dx
+            if self._count < 2 * p - 1:
+                return NAN
+            self.value = self._sum_dx / p
+        elif dx is not None:
+            self.value = (self.value * (p - 1) + dx) / p
+        return self.value
+
+
+class LiveIndicators(object):
+    '''
+    Indicator state of the live bot: MACD/signal, RSI and ADX updated on each
+    closed candle, the latest `history` values of each in ring buffers and
+    the number of consecutive candles the MACD has been above/below its
+    signal line (the confirmation window). Confirmation is delayed: a
+    crossover is confirmed on the candle where the MACD has stayed on its new
+    side of the signal line for `confirmation_candles` candles, counting the
+    crossover candle.
+    '''
+
+    def __init__(self, macd_fast=12, macd_slow=26, macd_signal=9,
+                 rsi_period=14, adx_period=14, confirmation_candles=48,
+                 history=None):
+        history = history or max(confirmation_candles, 2)
+        self.confirmation_candles = confirmation_candles
+        self._macd = MACD(macd_fast, macd_slow, macd_signal)
+        self._rsi = RSI(rsi_period)
+        self._adx = ADX(adx_period)
+        self.macd = RingBuffer(history)
+        self.signal = RingBuffer(history)
+        self.rsi = RingBuffer(history)
+        self.adx = RingBuffer(history)
+        self.above = 0  # consecutive candles with macd > signal
+        self.below = 0  # consecutive candles with macd < signal
+        # whether the current run above/below began with a crossover (the
+        # candle before it on the other side, not equal or undefined)
+        self.crossed = False
+        self.timestamp = None  # open time (ms) of the last candle
+
+    def update(self, timestamp, high, low, close):
+        macd, signal, _ = self._macd.update(close)
+        self.macd.append(macd)
+        self.signal.append(signal)
+        self.rsi.append(self._rsi.update(close))
+        self.adx.append(self._adx.update(high, low, close))
+        above, below = self.above, self.below
+        self.above = above + 1 if macd > signal else 0
+        self.below = below + 1 if macd < signal else 0
+        if self.above == 1 or self.below == 1:
+            self.crossed = bool(below if self.above else above)
+        self.timestamp = timestamp
+
+    def update_many(self, candles):
+        '''Feed a dict of timestamp/high/low/close arrays, oldest first'''
+        for row in zip(candles['timestamp'].tolist(), candles['high'].tolist(),
+                       candles['low'].tolist(), candles['close'].tolist()):
+            self.update(*row)
+
+    def bullish_cross(self):
+        return len(self.macd) >= 2 and self.macd[-2] < self.signal[-2] and self.macd[-1] > self.signal[-1]
+
+    def bearish_cross(self):
+        return len(self.macd) >= 2 and self.macd[-2] > self.signal[-2] and self.macd[-1] < self.signal[-1]
+
+    def bullish_confirmed(self):
+        # the candle where, after a bullish crossover n - 1 candles ago,
+        # np.all(macd[-n:] > signal[-n:]) first holds, n = confirmation_candles
+        return self.crossed and self.above == self.confirmation_candles
+
+    def bearish_confirmed(self):
+        # np.all(macd[-n:] < signal[-n:]), first candle after a bearish crossover
+        return self.crossed and self.below == self.confirmation_candles
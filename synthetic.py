@@ -0,0 +1,26 @@
+'''
+Deterministic synthetic OHLCV data, for benchmarks and offline testing.
+
+The close follows a geometric random walk; open, high and low are drawn
+around it so that low <= open, close <= high. The same (n, seed) always
+gives the same series, without any network access.
+'''
+import numpy as np
+import pandas as pd
+
+
+def synthetic_ohlcv(n, seed=42, start='2000-01-01', freq='1min', price=100.0,
+                    volatility=0.002):
+    '''DataFrame of n bars indexed by datetime, ready for bt.feeds.PandasData'''
+    rng = np.random.default_rng(seed)
+    close = price * np.exp(np.cumsum(rng.normal(0.0, volatility, n)))
+    open_ = np.empty(n)
+    open_[0] = price
+    open_[1:] = close[:-1] * (1.0 + rng.normal(0.0, volatility / 4, n - 1))
+    spread = np.abs(rng.normal(0.0, volatility, n))
+    high = np.maximum(open_, close) * (1.0 + spread)
+    low = np.minimum(open_, close) * (1.0 - spread)
+    volume = rng.integers(100, 10000, n).astype(float)
+    index = pd.date_range(start, periods=n, freq=freq, name='Date')
+    return pd.DataFrame(dict(open=open_, high=high, low=low, close=close,
+                             volume=volume), index=index)
@@ -0,0 +1,74 @@
+'''
+Checks of the batch backtests offline, on the 'stub' source and a store in
+a temporary directory: the workers refresh the series through the data
+service, waiting on its lock, and write a row per symbol and strategy.
+
+    python -m pytest -q test_batch.py
+'''
+import csv
+import fcntl
+import os
+import threading
+import time
+
+import pytest
+
+import models as m
+import prefetch
+from batch import run_batch
+from datastore import OHLCVStore
+
+SYMBOLS = ['AAA.US', 'BBB.US']
+
+
+@pytest.fixture(autouse=True)
+def no_override(monkeypatch):
+    monkeypatch.setattr(prefetch, 'SOURCE_OVERRIDE', None)
+
+
+def test_batch_refreshes_through_the_service(tmp_path):
+    store = OHLCVStore(str(tmp_path / 'store'))
+    out = str(tmp_path / 'batch.csv')
+    rows = run_batch(SYMBOLS, [m.MACross, m.EMAStrategy], out=out, store=store,
+                     update=True, source='stub', processes=2)
+    assert sorted((r['symbol'], r['strategy']) for r in rows) == [
+        (s, n) for s in SYMBOLS for n in ('EMAStrategy', 'MACross')]
+    assert not any(r.get('error') for r in rows)
+    with open(out) as f:
+        assert len(list(csv.DictReader(f))) == 4
+    for symbol in SYMBOLS:
+        assert store.size(symbol, '1d') == 1000
+        # refreshed by the service: its marker and lock file are there
+        path = store.path(symbol, '1d')
+        assert os.path.exists(os.path.join(path, prefetch.MARKER))
+        assert os.path.exists(os.path.join(path, prefetch.LOCK))
+
+    # fresh now: a second run does not fetch again
+    before = os.path.getmtime(os.path.join(store.path(SYMBOLS[0], '1d'), prefetch.MARKER))
+    run_batch(SYMBOLS[:1], [m.MACross], out=out, store=store, update=True,
+              source='stub', processes=1)
+    after = os.path.getmtime(os.path.join(store.path(SYMBOLS[0], '1d'), prefetch.MARKER))
+    assert after == before
+
+
+def test_batch_waits_for_the_series_lock(tmp_path):
+    # another process (e.g. the data daemon) is writing the series
+    store = OHLCVStore(str(tmp_path / 'store'))
+    path = store.path(SYMBOLS[0], '1d')
+    os.makedirs(path)
+    lock = open(os.path.join(path, prefetch.LOCK), 'a')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    done = []
+    batch = threading.Thread(target=lambda: done.append(run_batch(
+        SYMBOLS[:1], [m.MACross], out=str(tmp_path / 'batch.csv'), store=store,
+        update=True, source='stub', processes=1)))
+    batch.start()
+    try:
+        time.sleep(1.0)
+        assert not done and store.size(SYMBOLS[0], '1d') == 0
+    finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+    batch.join(60)
+    assert done and not done[0][0].get('error')
+    assert store.size(SYMBOLS[0], '1d') == 1000
@@ -0,0 +1,106 @@
+'''
+Checks of the local OHLCV store: append/read round trips, incremental
+updates fetching only the missing candles, and recovery from an append
+interrupted before the timestamp column was written.
+
+    python -m pytest -q test_datastore.py
+'''
+import numpy as np
+import pytest
+
+from datastore import COLUMNS, HEADER_SIZE, OHLCVStore, _header
+from synthetic import synthetic_ohlcv
+
+HOUR = 3600000
+
+
+def _candles(n, start=0, seed=1):
+    df = synthetic_ohlcv(n + start, seed=seed, freq='1h').iloc[start:]
+    ts = np.asarray(df.index, dtype='datetime64[ms]').astype(np.int64)
+    return dict(timestamp=ts, **{c: df[c].to_numpy() for c in COLUMNS[1:]})
+
+
+@pytest.fixture
+def store(tmp_path):
+    return OHLCVStore(str(tmp_path))
+
+
+def test_append_read_round_trip(store):
+    candles = _candles(500)
+    assert store.append('BTC/USDT', '1h', candles) == 500
+    cols = store.read('BTC/USDT', '1h')
+    for c in COLUMNS:
+        np.testing.assert_array_equal(cols[c], candles[c])
+    # slices by time (inclusive) and the last n
+    ts = candles['timestamp']
+    part = store.read('BTC/USDT', '1h', start=int(ts[100]), end=int(ts[199]))
+    np.testing.assert_array_equal(part['close'], candles['close'][100:200])
+    np.testing.assert_array_equal(store.read('BTC/USDT', '1h', last=10)['open'], candles['open'][-10:])
+    # DataFrame in, DataFrame out; only the candles after the last one added
+    frame = store.frame('BTC/USDT', '1h')
+    assert len(frame) == 500 and list(frame.columns) == list(COLUMNS[1:])
+    assert store.append('BTC/USDT', '1h', synthetic_ohlcv(510, seed=1, freq='1h')) == 10
+    np.testing.assert_allclose(store.read('BTC/USDT', '1h', last=10)['close'],
+                               _candles(510)['close'][-10:])
+    assert (store.first_timestamp('BTC/USDT', '1h'), store.last_timestamp('BTC/USDT', '1h')) == (
+        int(ts[0]), int(ts[0]) + 509 * HOUR)
+
+
+def test_update_fetches_only_the_new_candles(store):
+    everything = _candles(300)
+    calls = []
+    available = [200]  # candles the source has so far
+
+    def fetch(start, end):
+        calls.append((start, end))
+        ts = everything['timestamp'][:available[0]]
+        keep = (ts >= (start if start is not None else ts[100])) & (ts <= (end if end is not None else ts[-1]))
+        return {c: everything[c][:available[0]][keep] for c in COLUMNS}
+
+    # empty store: the source's default range
+    assert store.update('ETH/USDT', '1h', fetch) == 100
+    last = int(everything['timestamp'][199])
+    assert calls == [(None, None)]
+    # nothing new
+    assert store.update('ETH/USDT', '1h', fetch) == 0
+    assert calls[-1] == (last + 1, None)
+    # 50 new candles: only those are fetched and appended
+    available[0] = 250
+    assert store.update('ETH/USDT', '1h', fetch) == 50
+    assert calls[-1] == (last + 1, None)
+    # older history from `start`: only the range before the first stored one
+    first = int(everything['timestamp'][100])
+    assert store.update('ETH/USDT', '1h', fetch, start=int(everything['timestamp'][50])) == 50
+    assert calls[-2] == (int(everything['timestamp'][50]), first - 1)
+    cols = store.read('ETH/USDT', '1h')
+    for c in COLUMNS:
+        np.testing.assert_array_equal(cols[c], everything[c][50:250])
+
+
+def test_recovers_from_an_interrupted_append(store):
+    candles = _candles(120)
+    store.append('SOL/USDT', '1h', {c: v[:100] for c, v in candles.items()})
+    # an append that died after the price columns, before the timestamps
+    # (written last): those columns hold 10 rows more than the timestamps
+    for c in COLUMNS[1:]:
+        dtype = np.dtype('<f8')
+        with open(store._file('SOL/USDT', '1h', c), 'r+b') as f:
+            f.seek(HEADER_SIZE + 100 * dtype.itemsize)
+            f.write(np.full(10, -1.0).tobytes())
+            f.seek(0)
+            f.write(_header(dtype, 110))
+    assert len(np.load(store._file('SOL/USDT', '1h', 'close'), mmap_mode='r')) == 110
+
+    # readers only see the 100 complete rows
+    reopened = OHLCVStore(store.root)
+    assert reopened.size('SOL/USDT', '1h') == 100
+    cols = reopened.read('SOL/USDT', '1h')
+    for c in COLUMNS:
+        np.testing.assert_array_equal(cols[c], candles[c][:100])
+
+    # the next append overwrites the torn rows
+    assert reopened.append('SOL/USDT', '1h', candles) == 20
+    for c in COLUMNS:
+        stored = np.load(reopened._file('SOL/USDT', '1h', c), mmap_mode='r')
+        np.testing.assert_array_equal(stored, candles[c])
+    assert not (reopened.read('SOL/USDT', '1h')['close'] == -1.0).any()
@@ -0,0 +1,70 @@
+'''
+Checks of the indicator cache: hits for the same feed and params, least
+recently used eviction, the size bounds and feeds rewritten in place.
+
+    python -m pytest -q test_indicator_cache.py
+'''
+import numpy as np
+import pytest
+
+import vectorized
+from indicator_cache import IndicatorCache
+
+
+@pytest.fixture
+def close():
+    return np.cumsum(np.random.default_rng(3).normal(size=5000)) + 1000.0
+
+
+def test_same_feed_and_params_hit(close):
+    cache = IndicatorCache()
+    first = cache.get(vectorized.sma, (close,), 20)
+    again = cache.get(vectorized.sma, (close,), 20)
+    assert again is first
+    np.testing.assert_array_equal(first, vectorized.sma(close, 20))
+    # other params, other function, other feed: misses
+    cache.get(vectorized.sma, (close,), 50)
+    cache.get(vectorized.ema, (close,), 20)
+    cache.get(vectorized.sma, (close.copy(),), 20)
+    assert (cache.hits, cache.misses) == (1, 4)
+    with pytest.raises(ValueError):
+        first[0] = 0.0  # cached arrays are read-only
+
+
+def test_least_recently_used_is_evicted_first(close):
+    cache = IndicatorCache(max_entries=2)
+    a = cache.get(vectorized.sma, (close,), 10)
+    cache.get(vectorized.sma, (close,), 20)
+    assert cache.get(vectorized.sma, (close,), 10) is a  # 10 is now the most recent
+    cache.get(vectorized.sma, (close,), 30)  # evicts 20
+    assert cache.evictions == 1 and len(cache) == 2
+    assert cache.get(vectorized.sma, (close,), 10) is a
+    hits = cache.hits
+    cache.get(vectorized.sma, (close,), 20)
+    assert cache.hits == hits  # recomputed
+
+
+def test_size_bound(close):
+    size = close.nbytes  # one SMA result
+    cache = IndicatorCache(max_bytes=3 * size)
+    for period in range(2, 12):
+        cache.get(vectorized.sma, (close,), period)
+        assert cache.nbytes <= 3 * size
+    assert len(cache) == 3 and cache.evictions == 7
+    # MACD returns two arrays, counted together: one SMA stays next to them
+    cache.get(vectorized.macd, (close,), 12, 26, 9)
+    assert cache.nbytes == 3 * size and len(cache) == 2
+    # a result larger than the bound is returned but not kept
+    small = IndicatorCache(max_bytes=size - 1)
+    assert len(small.get(vectorized.sma, (close,), 5)) == len(close)
+    assert len(small) == 0 and small.nbytes == 0
+
+
+def test_feed_rewritten_at_its_end_misses(close):
+    cache = IndicatorCache()
+    feed = close.copy()
+    before = cache.get(vectorized.sma, (feed,), 20)
+    feed[-1] += 10.0  # e.g. a new candle written over a reused memory map
+    after = cache.get(vectorized.sma, (feed,), 20)
+    assert after is not before
+    assert after[-1] == pytest.approx(before[-1] + 0.5)
@@ -0,0 +1,71 @@
+'''
+Checks of the latency histograms: quantiles against np.quantile within the
+bucket precision, merging, and the Prometheus export.
+
+    python -m pytest -q test_latency.py
+'''
+import numpy as np
+import pytest
+
+from latency import QUANTILES, SUB_BITS, Histogram, LatencyMetrics
+
+# relative width of a bucket: 2 ** (SUB_BITS - 1) of them per power of two
+PRECISION = 1.0 / (1 << (SUB_BITS - 1))
+
+
+@pytest.fixture
+def samples():
+    # ns, from ~10 us to ~1 s, heavy tailed like network round trips
+    return np.random.default_rng(1).lognormal(np.log(2e6), 1.5, 100000).astype(np.int64)
+
+
+def test_quantiles_match_numpy(samples):
+    h = Histogram()
+    for v in samples.tolist():
+        h.record(v)
+    for q in QUANTILES + (0.1, 0.25, 0.75):
+        assert h.quantile(q) == pytest.approx(np.quantile(samples, q), rel=PRECISION)
+    assert (h.count, h.min, h.max, h.total) == (len(samples), samples.min(), samples.max(), samples.sum())
+    assert h.quantile(1.0) == samples.max()
+    # exact below 2 ** SUB_BITS ns
+    small = Histogram()
+    for v in range(100):
+        small.record(v)
+    assert small.quantile(0.5) == 49 and small.min == 0
+
+
+def test_merge_is_the_histogram_of_all_samples(samples):
+    a, b, whole = Histogram(), Histogram(), Histogram()
+    for i, v in enumerate(samples[:20000].tolist()):
+        (a if i % 3 else b).record(v)
+        whole.record(v)
+    a.merge(b)
+    assert a.counts == whole.counts
+    assert (a.count, a.min, a.max, a.total) == (whole.count, whole.min, whole.max, whole.total)
+
+
+def test_prometheus_export():
+    metrics = LatencyMetrics()
+    for ns in (1000000, 2000000, 50000000):
+        metrics.record('order', 'BTC/USDT', ns)
+    metrics.record('order', 'ETH/USDT', 3000000)
+    lines = metrics.prometheus().splitlines()
+    types = [line for line in lines if line.startswith('# TYPE')]
+    assert types == ['# TYPE bot_stage_latency_seconds summary',
+                     '# TYPE bot_stage_latency_max_seconds gauge']
+    # every sample belongs to the family declared last before it
+    family = None
+    samples = {}
+    for line in lines:
+        if line.startswith('# TYPE'):
+            family = line.split()[2]
+            continue
+        name, value = line.rsplit(' ', 1)
+        assert name.split('{')[0] in (family, family + '_sum', family + '_count')
+        samples[name] = float(value)
+    labels = 'stage="order",symbol="BTC/USDT"'
+    assert samples[f'bot_stage_latency_max_seconds{{{labels}}}'] == 0.05
+    assert samples[f'bot_stage_latency_seconds_count{{{labels}}}'] == 3
+    assert samples[f'bot_stage_latency_seconds_sum{{{labels}}}'] == pytest.approx(0.053)
+    assert samples[f'bot_stage_latency_seconds{{{labels},quantile="0.5"}}'] == pytest.approx(
+        0.002, rel=PRECISION)
@@ -0,0 +1,134 @@
+'''
+Checks of the live path offline, on synthetic.synthetic_ohlcv candles: the
+paper exchange replay through the live runners, the routing of the candles of
+many pairs to their own runner and position, and the state of a runner
+recovered after a crash.
+
+    python -m pytest -q test_live.py
+'''
+import asyncio
+
+import numpy as np
+import pytest
+
+from synthetic import synthetic_ohlcv
+
+
+def _rows(n, seed):
+    df = synthetic_ohlcv(n, seed=seed, freq='1h')
+    ts = np.asarray(df.index, dtype='datetime64[ms]').astype(np.int64)
+    return [list(r) for r in zip(ts.tolist(), *(df[c].tolist() for c in
+                                                  ('open', 'high', 'low', 'close', 'volume')))]
+
+
+@pytest.mark.parametrize('speed', [3.6e6, 3.6e7])
+def test_paper_replay_feeds_every_candle(speed):
+    from paper import PaperExchange, replay
+    from streaming import LiveIndicators
+
+    candles = {'BTC/USDT': _rows(600, 1), 'ETH/USDT': _rows(300, 2)}
+    pairs = [('BTC/USDT', '1h'), ('ETH/USDT', '1h')]
+    indicators = {pair: LiveIndicators() for pair in pairs}
+    exchange = PaperExchange(candles, timeframe='1h', speed=speed)
+    asyncio.run(replay(exchange, pairs, indicators=indicators))
+    # every stored candle once, the shorter series does not end the other
+    assert indicators[('BTC/USDT', '1h')].macd.count == 600
+    assert indicators[('ETH/USDT', '1h')].macd.count == 300
+    assert indicators[('BTC/USDT', '1h')].timestamp == candles['BTC/USDT'][-1][0]
+    assert exchange.finished
+
+
+def _portfolio(exchange, pairs, feed=None):
+    from live import LiveRunner, PortfolioRunner, WebSocketFeed
+
+    runners = [LiveRunner(exchange, symbol, None, timeframe=timeframe) for symbol, timeframe in pairs]
+    received = {pair: [] for pair in pairs}
+    for runner in runners:
+        def on_candle(candle, runner=runner, on_candle=runner.on_candle):
+            received[(runner.symbol, runner.timeframe)].append(candle)
+            return on_candle(candle)
+        runner.on_candle = on_candle
+    return PortfolioRunner(feed or WebSocketFeed(exchange, pairs), runners), received
+
+
+def test_candles_go_to_the_runner_of_their_pair():
+    from live import MergedReplayFeed, ReplayFeed
+    from mock_exchange import MockExchange
+
+    # two symbols, and a second timeframe of one of them
+    candles = {('BTC/USDT', '1h'): _rows(200, 1), ('ETH/USDT', '1h'): _rows(150, 2),
+               ('BTC/USDT', '4h'): _rows(50, 3)}
+    feed = MergedReplayFeed([ReplayFeed(rows, symbol, timeframe)
+                             for (symbol, timeframe), rows in candles.items()])
+    portfolio, received = _portfolio(MockExchange(), list(candles), feed)
+    asyncio.run(portfolio.run())
+    for pair, rows in candles.items():
+        assert [(c['symbol'], c['timeframe']) for c in received[pair]] == [pair] * len(rows)
+        assert [c['timestamp'] for c in received[pair]] == [r[0] for r in rows]
+        assert portfolio.runners[pair].indicators.macd.count == len(rows)
+
+
+def test_every_pair_has_its_own_position():
+    from live import MergedReplayFeed, ReplayFeed
+    from mock_exchange import MockExchange
+
+    candles = {'BTC/USDT': _rows(20, 1), 'ETH/USDT': _rows(20, 2)}
+    pairs = [('BTC/USDT', '1h'), ('ETH/USDT', '1h')]
+    exchange = MockExchange(candles)
+    feed = MergedReplayFeed([ReplayFeed(candles[s], s, tf) for s, tf in pairs])
+    portfolio, _ = _portfolio(exchange, pairs, feed)
+    btc, eth = portfolio.runners[pairs[0]], portfolio.runners[pairs[1]]
+    btc.core.signal = lambda: 'long'
+    eth.core.signal = lambda: 'short'
+    asyncio.run(portfolio.run())
+    # one order each (the cooldown holds the rest), on its own symbol
+    assert [(o['symbol'], o['side']) for o in exchange.orders] == [('BTC/USDT', 'buy'), ('ETH/USDT', 'sell')]
+    assert (btc.position, eth.position) == ('long', 'short')
+    assert btc.amount == pytest.approx(1000 / candles['BTC/USDT'][-1][4])
+    assert eth.amount == pytest.approx(1000 / candles['ETH/USDT'][-1][4])
+    assert exchange.balance['BTC'] == pytest.approx(btc.amount)
+    assert exchange.balance['ETH'] == pytest.approx(-eth.amount)
+
+
+def test_pair_feed_ending_does_not_stop_the_others():
+    from paper import PaperExchange
+
+    candles = {'BTC/USDT': _rows(200, 1), 'ETH/USDT': _rows(20, 2)}
+    pairs = [('BTC/USDT', '1h'), ('ETH/USDT', '1h')]
+    exchange = PaperExchange(candles, timeframe='1h', speed=3.6e7)
+    portfolio, received = _portfolio(exchange, pairs)
+    asyncio.run(portfolio.run())
+    assert [c['timestamp'] for c in received[pairs[1]]] == [r[0] for r in candles['ETH/USDT']]
+    # the BTC candles after the last ETH one still arrive
+    assert [c['timestamp'] for c in received[pairs[0]]] == [r[0] for r in candles['BTC/USDT']]
+    assert exchange.finished
+
+
+def test_cooldown_without_orders_survives_restart(tmp_path):
+    from live import LiveRunner
+    from mock_exchange import MockExchange
+    from state import StateLog
+
+    exchange = MockExchange({'BTC/USDT': _rows(10, 3)})
+    state = StateLog(str(tmp_path), fsync=False)
+    state.recover()
+    runner = LiveRunner(exchange, 'BTC/USDT', None, timeframe='1h', state=state)
+    # already long when a long signal comes: a cooldown but no order
+    runner.core.position, runner.core.amount = 'long', 0.5
+    state.append(dict(type='submit', key=runner.key, cid='a', amount=0.5,
+                      intent=dict(side='buy', action='open', amount=None, value=1000, timestamp=0)))
+    state.append(dict(type='fill', key=runner.key, cid='a', amount=0.5, price=2000.0, id='1',
+                      intent=dict(side='buy', action='open', amount=None, value=1000, timestamp=0)))
+    runner.core.signal = lambda: 'long'
+    row = exchange.candles['BTC/USDT'][-1]
+    assert runner.on_candle(dict(zip(('timestamp', 'open', 'high', 'low', 'close', 'volume'), row))) is None
+    assert runner.core.cooldown_until is not None
+
+    # crash: recover from the log only
+    recovered = StateLog(str(tmp_path), fsync=False)
+    recovered.recover()
+    exchange.balance = {'BTC': 0.5}
+    restarted = LiveRunner(exchange, 'BTC/USDT', None, timeframe='1h', state=recovered)
+    assert asyncio.run(restarted.restore()) == []
+    assert restarted.core.cooldown_until == runner.core.cooldown_until
+    assert restarted.position == 'long'
@@ -0,0 +1,79 @@
+'''
+Checks of the Monte Carlo robustness tests on synthetic.synthetic_ohlcv
+data: the round trips of a recorded run, the execution scenario without
+delay or slippage reproducing the run, and results that do not depend on
+the number of processes.
+
+    python -m pytest -q test_montecarlo.py
+'''
+import numpy as np
+import pytest
+
+import vectorized
+from montecarlo import robustness, trades
+from recorder import Recorder
+from synthetic import synthetic_ohlcv
+
+
+@pytest.fixture(scope='module')
+def data():
+    return synthetic_ohlcv(2000, seed=9)
+
+
+@pytest.fixture(scope='module')
+def recorded(data):
+    import backtrader as bt
+
+    import models as m
+    from recorder import RecorderAnalyzer
+
+    m.LOG_TRADES, log = False, m.LOG_TRADES
+    try:
+        cerebro = bt.Cerebro(stdstats=False, cheat_on_open=True)
+        cerebro.addstrategy(m.MACD)
+        cerebro.broker.set_cash(10000)
+        cerebro.broker.setcommission(commission=0.001)
+        cerebro.adddata(bt.feeds.PandasData(dataname=data))
+        cerebro.addanalyzer(RecorderAnalyzer, _name='recorder')
+        return cerebro.run()[0].analyzers.recorder.get_analysis()
+    finally:
+        m.LOG_TRADES = log
+
+
+def test_trades_compound_to_the_run(recorded):
+    rt = trades(recorded)
+    assert len(rt['pnl']) > 3
+    growth = np.prod(1.0 + rt['returns'])
+    assert (growth - 1.0) * 100.0 == pytest.approx(recorded.stats()['return_pct'], rel=1e-9)
+
+
+@pytest.mark.parametrize('source', ['cerebro', 'vectorized'])
+def test_exact_execution_reproduces_the_run(data, recorded, source):
+    rec = recorded if source == 'cerebro' else Recorder.from_result(
+        vectorized.backtest('MACD', data, commission=0.001))
+    report = robustness(rec, data['open'].to_numpy(), commission=0.001,
+                        methods=['execution'], paths=200, max_delay=0,
+                        slippage_bps=0.0, processes=1, seed=1)
+    actual = report['actual']['return_pct']
+    for value in report['execution']['return_pct'].values():
+        assert value == pytest.approx(actual, rel=1e-9)
+    assert report['execution']['prob_loss'] == float(actual < 0)
+
+
+def test_results_do_not_depend_on_processes(data, recorded):
+    kwargs = dict(opens=data['open'].to_numpy(), commission=0.001, paths=3000,
+                  batch=500, seed=4)
+    one = robustness(recorded, processes=1, **kwargs)
+    two = robustness(recorded, processes=2, **kwargs)
+    assert set(one) == {'actual', 'trades', 'blocks', 'execution'}
+    assert one == two
+    assert one['execution']['paths'] == 3000
+
+
+def test_trades_need_one_fill_per_entry_and_exit():
+    fills = np.array([(1, 1.0, 10.0, 0.0), (2, 1.0, 11.0, 0.0), (3, -2.0, 12.0, 0.0)],
+                     dtype=vectorized.FILL_DTYPE)
+    rec = Recorder(5, 1000.0)
+    rec._fills, rec.n_fills = fills, len(fills)
+    with pytest.raises(ValueError, match='one fill each'):
+        trades(rec)
@@ -0,0 +1,62 @@
+'''
+Checks of the parameter sweep on synthetic.synthetic_ohlcv data: the runs
+of a sweep do not log or format trade messages, and every parameter set
+gives a result row.
+
+    python -m pytest -q test_optimization.py
+'''
+import logging
+
+import pytest
+
+import models as m
+import optimization
+from synthetic import synthetic_ohlcv
+
+
+@pytest.fixture(scope='module')
+def data():
+    return synthetic_ohlcv(1500, seed=11)
+
+
+@pytest.fixture
+def quiet(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError('logged during a sweep: %r' % (args,))
+
+    monkeypatch.setattr(m, 'LOG_TRADES', False)
+    monkeypatch.setattr(logging, 'info', fail)
+
+
+@pytest.mark.parametrize('strategy, params', [
+    (m.MACross, dict(pfast=10, pslow=30)),
+    (m.MACD, dict(macd1=12, macd2=26)),
+    (m.EMAStrategy, dict(ema_period=20, sma_period=50)),
+    (m.RSI_SMA_Strategy, dict()),
+])
+def test_run_does_not_log(data, quiet, strategy, params):
+    row = optimization.run_one(params, data, strategy, engine='cerebro')
+    assert row['trades'] > 0
+
+
+def test_optimize_returns_every_combination(data, tmp_path):
+    grid = dict(pfast=[5, 10], pslow=[30, 50])
+    out = str(tmp_path / 'sweep.csv')
+    rows = optimization.optimize(m.MACross, grid, data, out=out, processes=2)
+    assert sorted((r['pfast'], r['pslow']) for r in rows) == [(5, 30), (5, 50), (10, 30), (10, 50)]
+    assert not any(r.get('error') for r in rows)
+    assert (tmp_path / 'sweep_ranked.csv').exists()
+
+
+def test_default_engine_gives_the_cerebro_results(data, tmp_path):
+    # the sweep defaults to the vectorized engine where it matches Cerebro
+    assert optimization.default_engine(m.MACD) == 'vectorized'
+    assert optimization.default_engine(m.LiveRules) == 'cerebro'
+    grid = dict(macd1=[8, 12], macd2=[26])
+    fast = optimization.optimize(m.MACD, grid, data, out=str(tmp_path / 'a.csv'), processes=2)
+    slow = optimization.optimize(m.MACD, grid, data, out=str(tmp_path / 'b.csv'), processes=2,
+                                 engine='cerebro')
+    for a, b in zip(fast, slow):
+        assert a['macd1'] == b['macd1'] and a['trades'] == b['trades']
+        for key in ('final_value', 'return_pct', 'max_drawdown_pct', 'sharpe'):
+            assert a[key] == pytest.approx(b[key], rel=1e-6)
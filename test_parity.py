@@ -0,0 +1,198 @@
+'''
+Parity and recovery checks of the fast paths against their references, on
+synthetic.synthetic_ohlcv data (no network):
+
+  - vectorized backtests against Cerebro (same fills, same final value),
+    for the models.py strategies and for core.SignalCore
+  - streaming indicators against talib over the whole history, and the
+    crossover confirmation against the talib window
+  - chunked resampling (ingest) against pandas resample
+  - the state log recovering from a torn tail
+  - Monte Carlo results not depending on the number of processes
+
+    python -m pytest -q test_parity.py
+'''
+import numpy as np
+import pytest
+
+import vectorized
+from synthetic import synthetic_ohlcv
+
+
+@pytest.fixture(scope='module')
+def data():
+    return synthetic_ohlcv(3000, seed=7)
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    import models as m
+
+    m.LOG_TRADES, log = False, m.LOG_TRADES
+    yield
+    m.LOG_TRADES = log
+
+
+def _candles(df):
+    return dict(timestamp=np.asarray(df.index, dtype='datetime64[ms]').astype(np.int64),
+                **{c: df[c].to_numpy() for c in ('open', 'high', 'low', 'close', 'volume')})
+
+
+# ---------------------------------------------------------------------------
+# Backtest engines
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize('name', sorted(vectorized.STRATEGIES))
+def test_vectorized_matches_cerebro(data, name):
+    import models as m
+
+    result = vectorized.compare_with_cerebro(getattr(m, name), data)
+    assert len(result['cerebro_fills'])
+    assert result['fills_match']
+    assert result['value_match']
+
+
+def test_replay_core_matches_live_rules(data):
+    import backtrader as bt
+
+    import models as m
+    from core import SignalCore
+    from recorder import RecorderAnalyzer
+    from streaming import LiveIndicators
+
+    cerebro = bt.Cerebro(stdstats=False, cheat_on_open=True)
+    cerebro.addstrategy(m.LiveRules, confirmation_candles=12, cooldown=3600)
+    cerebro.broker.set_cash(10000)
+    cerebro.broker.setcommission(commission=0.001)
+    cerebro.adddata(bt.feeds.PandasData(dataname=data))
+    cerebro.addanalyzer(RecorderAnalyzer, _name='recorder')
+    bt_fills = cerebro.run()[0].analyzers.recorder.get_analysis().fills
+
+    core = SignalCore(LiveIndicators(confirmation_candles=12), cooldown=3600)
+    result = vectorized.replay_core(core, data, cash=10000, commission=0.001)
+    assert len(bt_fills) > 2
+    np.testing.assert_array_equal(result.fills['bar'], bt_fills['bar'])
+    for c in ('size', 'price', 'comm'):
+        np.testing.assert_allclose(result.fills[c], bt_fills[c], rtol=1e-6)
+    assert np.isclose(result.final_value, cerebro.broker.getvalue(), rtol=1e-6)
+
+
+# ---------------------------------------------------------------------------
+# Streaming indicators
+# ---------------------------------------------------------------------------
+
+def test_streaming_matches_talib(data):
+    import talib
+
+    from streaming import LiveIndicators
+
+    n = len(data)
+    ind = LiveIndicators(history=n)
+    ind.update_many(_candles(data))
+    high, low, close = (data[c].to_numpy() for c in ('high', 'low', 'close'))
+    macd, signal, _ = talib.MACD(close, 12, 26, 9)
+    np.testing.assert_allclose(ind.macd.last(n), macd, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(ind.signal.last(n), signal, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(ind.rsi.last(n), talib.RSI(close, 14), rtol=1e-9)
+    np.testing.assert_allclose(ind.adx.last(n), talib.ADX(high, low, close, 14), rtol=1e-9)
+
+
+def test_confirmed_cross_gives_signal(data):
+    import talib
+
+    from core import SignalCore
+    from streaming import LiveIndicators
+
+    n = 24
+    macd, signal, _ = talib.MACD(data['close'].to_numpy(), 12, 26, 9)
+    core = SignalCore(LiveIndicators(confirmation_candles=n), adx_threshold=0)
+    ind = core.indicators
+    candles = _candles(data)
+    confirmed = 0
+    for i, row in enumerate(zip(*(candles[c].tolist() for c in ('timestamp', 'high', 'low', 'close')))):
+        core.update(*row)
+        # delayed confirmation: a crossover n - 1 candles ago and the MACD on
+        # its new side of the signal line for the n candles since, with talib
+        run, before = slice(i - n + 1, i + 1), i - n
+        expected_bull = before >= 0 and macd[before] < signal[before] and bool(np.all(macd[run] > signal[run]))
+        expected_bear = before >= 0 and macd[before] > signal[before] and bool(np.all(macd[run] < signal[run]))
+        assert ind.bullish_confirmed() == expected_bull
+        assert ind.bearish_confirmed() == expected_bear
+        if expected_bull:
+            confirmed += 1
+            assert core.signal() == ('long' if ind.rsi[-1] > 50 else None)
+        if expected_bear:
+            confirmed += 1
+            assert core.signal() == ('short' if ind.rsi[-1] < 50 else None)
+    assert confirmed
+
+
+# ---------------------------------------------------------------------------
+# Chunked resampling
+# ---------------------------------------------------------------------------
+
+def test_resample_matches_pandas(data):
+    from ingest import BAR_COLUMNS, resample_stream
+
+    candles = _candles(data)
+    chunks = ({c: v[i:i + 777] for c, v in candles.items()} for i in range(0, len(data), 777))
+    out = {}
+    for tf, bars in resample_stream(chunks, ['5m', '1h']):
+        for c in BAR_COLUMNS:
+            out.setdefault(tf, {}).setdefault(c, []).append(bars[c])
+    agg = dict(open='first', high='max', low='min', close='last', volume='sum')
+    for tf, rule in (('5m', '5min'), ('1h', '1h')):
+        expected = data.resample(rule).agg(agg).dropna()
+        got = {c: np.concatenate(v) for c, v in out[tf].items()}
+        np.testing.assert_array_equal(got['timestamp'], _candles(expected)['timestamp'])
+        for c in BAR_COLUMNS[1:]:
+            np.testing.assert_allclose(got[c], expected[c].to_numpy(), rtol=1e-12)
+
+
+# ---------------------------------------------------------------------------
+# State log
+# ---------------------------------------------------------------------------
+
+def test_state_recovers_from_torn_tail(tmp_path):
+    from state import StateLog
+
+    intent = dict(side='buy', action='open', amount=None, value=1000, timestamp=0)
+    log = StateLog(str(tmp_path), fsync=False)
+    log.recover()
+    log.append(dict(type='cooldown', key='BTC/USDT|1h', until=1000))
+    log.append(dict(type='submit', key='BTC/USDT|1h', cid='a', intent=intent, amount=0.5))
+    log.append(dict(type='fill', key='BTC/USDT|1h', cid='a', intent=intent, amount=0.5,
+                    price=2000.0, id='1'))
+    expected, seq = log.pair('BTC/USDT|1h'), log.seq
+    log._wal.close()
+    # crash in the middle of writing the next record
+    with open(log.wal_path, 'ab') as f:
+        f.write(b'0badc0de {"type":"submit","key":"BTC/US')
+
+    recovered = StateLog(str(tmp_path), fsync=False)
+    recovered.recover()
+    assert recovered.pair('BTC/USDT|1h') == expected
+    assert recovered.seq == seq
+    # the torn record is gone: new records follow the last good one
+    recovered.append(dict(type='cooldown', key='BTC/USDT|1h', until=2000))
+    again = StateLog(str(tmp_path), fsync=False)
+    again.recover()
+    assert again.seq == seq + 1
+    assert again.pair('BTC/USDT|1h')['cooldown_until'] == 2000
+
+
+# ---------------------------------------------------------------------------
+# Monte Carlo
+# ---------------------------------------------------------------------------
+
+def test_montecarlo_independent_of_processes(data):
+    from montecarlo import robustness
+    from recorder import Recorder
+
+    rec = Recorder.from_result(vectorized.backtest('MACD', data, commission=0.001))
+    kwargs = dict(opens=data['open'].to_numpy(), commission=0.001, paths=5000,
+                  batch=1000, seed=3)
+    one = robustness(rec, processes=1, **kwargs)
+    two = robustness(rec, processes=2, **kwargs)
+    assert set(one) == {'actual', 'trades', 'blocks', 'execution'}
+    assert one == two
@@ -0,0 +1,93 @@
+'''
+Checks of the portfolio backtest: entries sized to the risk budget of their
+sleeve, entries the cash can not fund skipped without blocking the ones
+after them, the combined value curve and the trade plans of the sleeves.
+
+    python -m pytest -q test_portfolio.py
+'''
+import numpy as np
+import pytest
+
+import portfolio
+import vectorized
+from portfolio import run_portfolio
+from synthetic import synthetic_ohlcv
+
+DAY = 86400000
+
+
+def _flat(prices):
+    # bars opening and closing at `prices`
+    prices = np.asarray(prices, dtype=float)
+    return dict(timestamp=np.arange(len(prices)) * DAY, open=prices, high=prices,
+                low=prices, close=prices, volume=np.ones(len(prices)))
+
+
+@pytest.fixture
+def planned(monkeypatch):
+    # the sleeves trade the (entry bars, exit bars, directions) given, in
+    # sleeve order, instead of their strategy's
+    def plan(plans):
+        plans = iter(plans)
+        monkeypatch.setattr(portfolio, '_plan', lambda *args: tuple(
+            np.asarray(a, dtype=np.int64) for a in next(plans)))
+    return plan
+
+
+def test_entries_take_the_budget_of_their_sleeve():
+    data = {s: synthetic_ohlcv(1000, seed=i) for i, s in enumerate(('AAA', 'BBB'))}
+    weights = {'MACross': 3.0, 'EMAStrategy': 1.0}
+    result = run_portfolio(data, ['MACross', 'EMAStrategy'], cash=100000,
+                           commission=0.0, weights=weights)
+    first = result.fills[0]
+    symbol, name = result.sleeves[first['sleeve']]
+    # nothing invested yet: its share of the starting cash, 3/8 or 1/8
+    assert abs(first['size'] * first['price']) == pytest.approx(100000 * weights[name] / 8.0)
+    # every sleeve gets the fills of its own symbol and strategy
+    for k, (symbol, name) in enumerate(result.sleeves):
+        assert (result.fills['sleeve'] == k).any()
+
+
+def test_unfundable_entry_does_not_block_the_next(planned):
+    # sleeves A (budget 0.6), B (0.3) and C (0.1), no commission. B buys at
+    # 100 on bar 1 and its price doubles: on bar 2 A wants 0.6 * 130000,
+    # more than the 70000 cash left, C only 13000
+    data = {'A': _flat([100] * 5), 'B': _flat([100, 100, 200, 200, 200]),
+            'C': _flat([100] * 5)}
+    planned([([2], [-1], [1]), ([1], [3], [1]), ([2], [4], [1])])
+    result = run_portfolio(data, ['MACross'], cash=100000, commission=0.0,
+                           weights={('A', 'MACross'): 6, ('B', 'MACross'): 3,
+                                    ('C', 'MACross'): 1})
+    assert result.skipped.tolist() == [1, 0, 0]
+    fills = [(int(f['bar']), int(f['sleeve']), float(f['size'])) for f in result.fills]
+    assert fills == [(1, 1, 300.0), (2, 2, 130.0), (3, 1, -300.0), (4, 2, -130.0)]
+    # cash + positions at the closes of the bars
+    np.testing.assert_allclose(result.value, [100000, 100000, 130000, 130000, 130000])
+    np.testing.assert_allclose(result.cash, [100000, 70000, 57000, 117000, 130000])
+    assert result.stats()['trades'] == 2
+
+
+def test_combined_value_is_the_sum_of_the_sleeves(planned):
+    # two sleeves on different symbols that never compete for the cash:
+    # the portfolio value is the cash plus both positions at their closes
+    data = {'A': _flat([100, 100, 110, 120, 90, 90]), 'B': _flat([50, 50, 50, 40, 40, 60])}
+    planned([([1], [4], [1]), ([2], [-1], [-1])])
+    result = run_portfolio(data, ['MACross'], cash=10000, commission=0.001, leverage=2.0)
+    assert result.skipped.tolist() == [0, 0]
+    a, b = result.positions[:, 0], result.positions[:, 1]
+    assert a[1] > 0 and b[2] < 0
+    closes = np.column_stack([data['A']['close'], data['B']['close']])
+    np.testing.assert_allclose(result.value, result.cash + a * closes[:, 0] + b * closes[:, 1])
+    pnl = result.sleeve_pnl()
+    assert len(pnl[0]) == 1 and len(pnl[1]) == 0
+    assert pnl[0][0] == pytest.approx(a[1] * (90 - 100) - abs(a[1]) * (100 + 90) * 0.001)
+
+
+def test_plan_needs_alternating_entries_and_exits(monkeypatch):
+    def trades(signals, broker):
+        broker.execute(1, 1.0)
+        broker.execute(2, 1.0)  # adds to the position instead of closing it
+
+    monkeypatch.setitem(vectorized.STRATEGIES, 'Pyramid', (lambda data, **kwargs: {}, trades))
+    with pytest.raises(ValueError, match='one fill each'):
+        run_portfolio({'A': _flat([100] * 5)}, ['Pyramid'])
@@ -0,0 +1,154 @@
+'''
+Checks of the market data service offline, on the 'stub' source and a
+store in a temporary directory, with a clock set by the tests: stub
+determinism, freshness after each candle close, deduplication of
+concurrent refreshes (async callers, the lock of the series) and serving
+stored data when a refresh fails.
+
+    python -m pytest -q test_prefetch.py
+'''
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import prefetch
+from datastore import OHLCVStore
+from prefetch import DataService, stub_fetcher
+
+HOUR = 3600.0
+T0 = 1700002800.0  # a candle close of '1h'
+
+
+class Clock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def no_override(monkeypatch):
+    monkeypatch.setattr(prefetch, 'SOURCE_OVERRIDE', None)
+
+
+@pytest.fixture
+def clock():
+    return Clock(T0 + 600.0)
+
+
+@pytest.fixture
+def service(tmp_path, clock):
+    return DataService(OHLCVStore(str(tmp_path)), delay=5.0, clock=clock)
+
+
+def _counting(service, calls, gate=None):
+    # the stub fetcher of the service, counting (and optionally holding) calls
+    def fetcher(source, symbol, timeframe):
+        fetch = stub_fetcher(symbol, timeframe, clock=service.clock)
+
+        def counted(start, end):
+            calls.append((start, end))
+            if gate is not None:
+                gate.wait(5)
+            return fetch(start, end)
+        return counted
+    return fetcher
+
+
+def test_stub_is_deterministic(clock):
+    a = stub_fetcher('BTC/USDT', '1h', clock=clock)(None, None)
+    b = stub_fetcher('BTC/USDT', '1h', clock=clock)(None, None)
+    for c in a:
+        np.testing.assert_array_equal(a[c], b[c])
+    # the last closed candle only, and any range gives the same bars
+    assert a['timestamp'][-1] == (T0 - HOUR) * 1000
+    part = stub_fetcher('BTC/USDT', '1h', clock=clock)(int(a['timestamp'][10]), int(a['timestamp'][20]))
+    np.testing.assert_array_equal(part['close'], a['close'][10:21])
+    other = stub_fetcher('ETH/USDT', '1h', clock=clock)(None, None)
+    assert not np.array_equal(other['close'], a['close'])
+
+
+def test_load_skips_fresh_series(service, clock):
+    calls = []
+    service.fetcher = _counting(service, calls)
+    first = service.load('BTC/USDT', '1h', 'stub')
+    assert len(calls) == 1 and len(first)
+
+    # same candle: served from the store
+    clock.now += 1200.0
+    assert service.fresh('BTC/USDT', '1h')
+    assert len(service.load('BTC/USDT', '1h', 'stub')) == len(first)
+    assert len(calls) == 1
+
+    # the next candle closed, but not `delay` ago yet: still fresh
+    clock.now = T0 + HOUR + 1.0
+    assert service.fresh('BTC/USDT', '1h')
+    # once it can be fetched the series is stale, only the new candle comes
+    clock.now = T0 + HOUR + 6.0
+    assert not service.fresh('BTC/USDT', '1h')
+    assert len(service.load('BTC/USDT', '1h', 'stub')) == len(first) + 1
+    assert len(calls) == 2
+    assert service.stats['refreshes'] == 2
+
+
+def test_arefresh_coalesces_concurrent_calls(service):
+    calls, gate = [], threading.Event()
+    service.fetcher = _counting(service, calls, gate)
+
+    async def main():
+        tasks = [asyncio.ensure_future(service.arefresh('BTC/USDT', '1h', 'stub'))
+                 for _ in range(3)]
+        await asyncio.sleep(0.05)
+        gate.set()
+        return await asyncio.gather(*tasks)
+
+    added = asyncio.run(main())
+    assert len(calls) == 1
+    assert added[0] > 0 and len(set(added)) == 1
+    assert service.stats['coalesced'] == 2
+
+
+def test_refresh_rechecks_under_the_lock(service, tmp_path, clock):
+    # a second service on the same store stands for another process: it
+    # waits on the lock file and then finds the series fresh
+    calls, gate = [], threading.Event()
+    service.fetcher = _counting(service, calls, gate)
+    other = DataService(OHLCVStore(str(tmp_path)), delay=5.0, clock=clock)
+    other.fetcher = _counting(other, calls)
+
+    first = threading.Thread(target=service.refresh, args=('BTC/USDT', '1h', 'stub', None))
+    first.start()
+    while not calls:
+        time.sleep(0.01)
+    second = threading.Thread(target=other.refresh, args=('BTC/USDT', '1h', 'stub', None))
+    second.start()
+    time.sleep(0.1)
+    gate.set()
+    first.join(5)
+    second.join(5)
+    assert len(calls) == 1
+    assert other.stats['skipped'] == 1 and other.stats['refreshes'] == 0
+
+
+def test_load_serves_stored_data_when_refresh_fails(service, clock, caplog):
+    stored = service.load('BTC/USDT', '1h', 'stub')
+
+    def broken(source, symbol, timeframe):
+        def fetch(start, end):
+            raise IOError('exchange down')
+        return fetch
+
+    service.fetcher = broken
+    clock.now += HOUR
+    assert not service.fresh('BTC/USDT', '1h')
+    served = service.load('BTC/USDT', '1h', 'stub')
+    assert served.equals(stored)
+    assert 'serving stored data' in caplog.text
+    # nothing stored to serve: the error is raised
+    with pytest.raises(IOError):
+        service.load('ETH/USDT', '1h', 'stub')
@@ -0,0 +1,121 @@
+'''
+Checks of the rate-limit aware request layer against mock_exchange: orders
+served before data, identical reads coalesced, calls waiting for their
+token buckets and retries with backoff.
+
+    python -m pytest -q test_ratelimit.py
+'''
+import asyncio
+import time
+
+import ccxt
+import pytest
+
+from mock_exchange import MockExchange
+from ratelimit import RateLimitedExchange
+
+CANDLES = {s: [[i * 3600000, 100.0, 101.0, 99.0, 100.0 + i, 10.0] for i in range(50)]
+           for s in ('BTC/USDT', 'ETH/USDT', 'SOL/USDT', 'XRP/USDT', 'ADA/USDT')}
+
+
+def _methods(mock):
+    return [method for _, method, _ in mock.log]
+
+
+def test_orders_go_before_data():
+    mock = MockExchange(CANDLES)
+    exchange = RateLimitedExchange(mock, buckets={'weight': (10, 200.0), 'orders': (10, 10.0)})
+    # no tokens left: every call queues
+    exchange.buckets['weight'].tokens = 0.0
+
+    async def main():
+        data = [asyncio.ensure_future(exchange.fetch_ohlcv(s, '1h')) for s in CANDLES]
+        await asyncio.sleep(0)
+        order = asyncio.ensure_future(exchange.create_market_buy_order('BTC/USDT', 0.1))
+        await asyncio.gather(order, *data)
+
+    asyncio.run(main())
+    assert _methods(mock) == ['create_order'] + ['fetch_ohlcv'] * len(CANDLES)
+
+
+def test_identical_reads_are_coalesced():
+    mock = MockExchange(CANDLES, latency=0.02)
+    exchange = RateLimitedExchange(mock)
+
+    async def main():
+        reads = await asyncio.gather(*(exchange.fetch_ohlcv('BTC/USDT', '1h', since=0)
+                                       for _ in range(3)))
+        other = await exchange.fetch_ohlcv('ETH/USDT', '1h', since=0)
+        orders = await asyncio.gather(*(exchange.create_market_buy_order('BTC/USDT', 0.1)
+                                        for _ in range(2)))
+        return reads, other, orders
+
+    reads, other, orders = asyncio.run(main())
+    assert reads[0] == reads[1] == reads[2] == CANDLES['BTC/USDT']
+    assert other == CANDLES['ETH/USDT']
+    assert exchange.stats['coalesced'] == 2
+    # two identical orders are two orders
+    assert _methods(mock) == ['fetch_ohlcv', 'fetch_ohlcv', 'create_order', 'create_order']
+    assert orders[0]['id'] != orders[1]['id']
+
+
+def test_calls_wait_for_their_bucket():
+    mock = MockExchange(CANDLES)
+    # 4 weight at 40 per second: two tickers now, then one every 50 ms
+    exchange = RateLimitedExchange(mock, buckets={'weight': (4, 40.0)})
+
+    async def main():
+        await asyncio.gather(*(exchange.fetch_ticker(s) for s in CANDLES))
+
+    asyncio.run(main())
+    sent = [t for t, _, _ in mock.log]
+    assert _methods(mock) == ['fetch_ticker'] * len(CANDLES)
+    assert sent[1] - sent[0] < 0.02
+    # 10 weight: 4 at once, the other 6 refilled at 40/s
+    assert sent[-1] - sent[0] >= 0.14
+    assert all(b - a >= 0.045 for a, b in zip(sent[1:], sent[2:]))
+    assert exchange.stats['waited'] > 0
+
+
+def test_rate_limit_errors_are_retried_with_backoff():
+    # the mock refuses the second call until its window passed
+    mock = MockExchange(CANDLES, weight_limit=2, weight_window=0.05)
+    exchange = RateLimitedExchange(mock, backoff=0.06)
+
+    async def main():
+        await exchange.fetch_ohlcv('BTC/USDT', '1h')
+        start = time.monotonic()
+        order = await exchange.create_market_buy_order('BTC/USDT', 0.1)
+        return order, time.monotonic() - start
+
+    order, elapsed = asyncio.run(main())
+    # refused once (logged by the mock), then sent again after the backoff
+    assert _methods(mock) == ['fetch_ohlcv', 'create_order', 'create_order']
+    assert order['filled'] == 0.1 and len(mock.orders) == 1
+    assert exchange.stats['retries'] == 1
+    assert elapsed >= 0.06
+
+
+def test_network_errors_retry_data_but_not_orders():
+    mock = MockExchange(CANDLES)
+    exchange = RateLimitedExchange(mock, retries=2, backoff=0.0)
+    failures = {'fetch_ohlcv': 1, 'create_order': 1}
+
+    async def request(method, *args, weight=None):
+        mock.log.append((time.monotonic(), method, args))
+        if failures.get(method):
+            failures[method] -= 1
+            raise ccxt.NetworkError('mock: connection reset')
+
+    mock._request = request
+
+    async def main():
+        rows = await exchange.fetch_ohlcv('BTC/USDT', '1h')
+        with pytest.raises(ccxt.NetworkError):
+            await exchange.create_market_buy_order('BTC/USDT', 0.1)
+        return rows
+
+    assert asyncio.run(main()) == CANDLES['BTC/USDT']
+    # the order may have gone through: not sent twice
+    assert _methods(mock) == ['fetch_ohlcv', 'fetch_ohlcv', 'create_order']
+    assert exchange.stats['retries'] == 1
@@ -0,0 +1,79 @@
+'''
+Checks of the array-backed recorder on a Cerebro run over
+synthetic.synthetic_ohlcv data: the trade PnL computed from the fills against
+backtrader's own, the save/load round trip, and buffers growing when the
+number of bars and fills is not known upfront.
+
+    python -m pytest -q test_recorder.py
+'''
+import numpy as np
+import pytest
+
+from recorder import ARRAYS, Recorder, trade_pnl
+from synthetic import synthetic_ohlcv
+
+
+@pytest.fixture(scope='module')
+def run():
+    import backtrader as bt
+
+    import models as m
+    from recorder import RecorderAnalyzer
+
+    class TradePnL(bt.Analyzer):
+        def start(self):
+            self.pnl = []
+
+        def notify_trade(self, trade):
+            if trade.isclosed:
+                self.pnl.append(trade.pnlcomm)
+
+        def get_analysis(self):
+            return self.pnl
+
+    m.LOG_TRADES, log = False, m.LOG_TRADES
+    try:
+        cerebro = bt.Cerebro(stdstats=False, cheat_on_open=True)
+        cerebro.addstrategy(m.MACD)
+        cerebro.broker.set_cash(10000)
+        cerebro.broker.setcommission(commission=0.001)
+        cerebro.adddata(bt.feeds.PandasData(dataname=synthetic_ohlcv(2000, seed=5)))
+        cerebro.addanalyzer(RecorderAnalyzer, _name='recorder')
+        cerebro.addanalyzer(TradePnL, _name='pnl')
+        strat = cerebro.run()[0]
+    finally:
+        m.LOG_TRADES = log
+    return (strat.analyzers.recorder.get_analysis(), strat.analyzers.pnl.get_analysis(),
+            cerebro.broker.getvalue())
+
+
+def test_trade_pnl_matches_backtrader(run):
+    rec, pnlcomm, final_value = run
+    assert len(pnlcomm) > 3
+    np.testing.assert_allclose(trade_pnl(rec.fills), pnlcomm, rtol=1e-9)
+    stats = rec.stats()
+    assert stats['trades'] == len(pnlcomm)
+    assert stats['win_rate'] == pytest.approx(np.mean(np.array(pnlcomm) > 0))
+    assert stats['final_value'] == pytest.approx(final_value)
+
+
+def test_save_load_round_trip(run, tmp_path):
+    rec = run[0]
+    rec.save(str(tmp_path / 'macd'))
+    loaded = Recorder.load(str(tmp_path / 'macd'))
+    assert (loaded.start_value, loaded.n, loaded.n_fills) == (rec.start_value, rec.n, rec.n_fills)
+    for name in ARRAYS + ('fills',):
+        assert isinstance(getattr(loaded, name), np.memmap)
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(rec, name))
+    assert loaded.stats() == pytest.approx(rec.stats(), nan_ok=True)
+
+
+def test_buffers_grow_when_the_size_is_unknown():
+    rec = Recorder(0, 1000.0, fills_capacity=1)
+    for i in range(5):
+        rec.record_bar(1000.0 + i, 500.0, float(i % 2))
+        rec.record_fill(i, 1.0 if i % 2 == 0 else -1.0, 10.0 + i, 0.01)
+    np.testing.assert_array_equal(rec.equity, [1000, 1001, 1002, 1003, 1004])
+    np.testing.assert_array_equal(rec.fills['bar'], np.arange(5))
+    # two round trips closed, the last buy still open
+    np.testing.assert_allclose(trade_pnl(rec.fills), [1.0 - 0.02, 1.0 - 0.02])
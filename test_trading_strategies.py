@@ -1,13 +1,13 @@
-from datetime import datetime as dt, timedelta
+from datetime import datetime as dt
 import logging
-import pandas as pd
+import os
 import backtrader as bt
-import pandas_datareader.data as web
-from pandas_datareader.stooq import StooqDailyReader
-from pandas_datareader.yahoo.headers import DEFAULT_HEADERS
-from dateutil.relativedelta import relativedelta
-import requests_cache
 import models as m
+from prefetch import DataService
+import batch
+from journal import TradeJournal, read_journal
+from recorder import RecorderAnalyzer
+from montecarlo import robustness
 
 if __name__ == '__main__':
 
@@ -28,6 +28,7 @@ if __name__ == '__main__':
     cerebro.addobserver(bt.observers.Value)
     cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
     cerebro.addanalyzer(bt.analyzers.TimeReturn, _name='time_return')
+    cerebro.addanalyzer(RecorderAnalyzer, _name='recorder')
 
     # Create logging instance
     logger = logging.getLogger()
@@ -35,12 +36,18 @@ if __name__ == '__main__':
     logging_handler = logging.FileHandler("backtrader.log")
     logger.addHandler(logging_handler)
     formatted_date = dt.today().strftime("%Y_%m_%d_T%H_%M_%S")
+    # Record the orders/trades in a structured journal instead of the log
+    m.LOG_TRADES = False
+    m.JOURNAL = TradeJournal(f"trades_{formatted_date}.journal")
     # cerebro.addwriter(bt.WriterFile, out = f"CSV/backtested_trades_{formatted_date}.csv", csv=True)
 
-    # start & end date
-    end_date = dt.today()
-    #start_date = end_date - timedelta(days = 365 )
-    start_date = end_date - relativedelta (years =1) 
+    # # start & end date
+    # from datetime import timedelta
+    # import pandas_datareader.data as web
+    # from pandas_datareader.yahoo.headers import DEFAULT_HEADERS
+    # import requests_cache
+    # end_date = dt.today()
+    # start_date = end_date - timedelta(days = 365 )
 
     # # configure session timeout
     # expire_after = timedelta(days=31)
@@ -48,16 +55,20 @@ if __name__ == '__main__':
     # session.headers = DEFAULT_HEADERS
 
     # data = web.DataReader('^SPX', 'stooq', start = start_date, end = end_date)
-    data=StooqDailyReader("MSTR.US").read()
-    data = data.sort_values(by='Date', ascending=True).reset_index()
+    # Read from the local OHLCV store, downloading only the missing days (none
+    # when the data daemon keeps it fresh, see prefetch.py)
+    data = DataService().load("MSTR.US", '1d', 'stooq')
     # create a data feed from the Pandas DataFrame
-    data_feed = bt.feeds.PandasData(dataname=data, datetime='Date')     
+    data_feed = bt.feeds.PandasData(dataname=data)
     
     # Load data
     cerebro.adddata(data_feed)
 
     # Run the backtest
-    cerebro.run()
+    strat = cerebro.run()[0]
+    m.JOURNAL.close()
+    print(read_journal(m.JOURNAL.path).to_string())
+    m.JOURNAL = None
     # cerebro.plot()
     # Print the final portfolio value
     final_amount = cerebro.broker.getvalue() 
@@ -65,11 +76,17 @@ if __name__ == '__main__':
     percentage_change = (final_amount - initial_amount)/initial_amount * 100.0
     print(f'Percentage Gain / (Loss): {percentage_change}%')
 
-    # Print the final portfolio value for each strategy
-    # Add data strategy to the instance
-    # strategies = [MACross,MACD,EMAStrategy,RSI_SMA_Strategy] 
-    # for strategy in strategies:
-    #     cerebro.addstrategy(strategy)
-    #     final_amount = cerebro.broker.getvalue() 
-    #     percentage_change = (final_amount - initial_amount)/initial_amount * 100.0 
-    #     print(f"{strategy.__class__.__name__}: {cerebro.broker.getvalue():,.2f} / {percentage_change:,.2f}")
\ No newline at end of file
+    # Confidence intervals of the return and max drawdown over resampled
+    # trade sequences, block-resampled returns and late/slipped fills: a few
+    # thousand paths by default, MC_PATHS=100000 for tighter intervals
+    report = robustness(strat.analyzers.recorder.get_analysis(), data['open'].to_numpy(),
+                        commission=0.001, paths=int(os.environ.get('MC_PATHS', 5000)), seed=1)
+    for method, result in report.items():
+        print(method, result)
+
+    # Print the final portfolio value for each strategy, backtested on the
+    # same data (see batch.py to run many symbols in parallel)
+    strategies = [m.MACross, m.MACD, m.EMAStrategy, m.RSI_SMA_Strategy]
+    for strategy in strategies:
+        row = batch.run_strategy(data, strategy, cash=initial_amount, commission=0.001)
+        print(f"{row['strategy']}: {row['final_value']:,.2f} / {row['pct_change']:,.2f}%")
@@ -0,0 +1,42 @@
+'''
+Checks of the walk-forward analysis on synthetic.synthetic_ohlcv data:
+contiguous test windows and parameter sets that fail being reported
+rather than silently scored.
+
+    python -m pytest -q test_walkforward.py
+'''
+import pytest
+
+import models as m
+from synthetic import synthetic_ohlcv
+from walkforward import walk_forward, windows
+
+
+@pytest.fixture(scope='module')
+def data():
+    return synthetic_ohlcv(1200, seed=5)
+
+
+def test_windows_are_contiguous():
+    ranges = windows(1000, train=300, test=100)
+    assert ranges[0] == (0, 300, 400)
+    assert all(a[2] == b[1] for a, b in zip(ranges, ranges[1:]))
+    assert windows(1000, 300, 100, anchored=True)[-1][0] == 0
+    with pytest.raises(ValueError):
+        windows(1000, 300, 100, step=50)
+
+
+def test_failed_parameter_sets_are_reported(data, caplog):
+    grid = dict(pfast=[0, 5, 10], pslow=[30])
+    wf = walk_forward(m.MACross, grid, data, train=400, test=200, processes=2)
+    assert [f['pfast'] for f in wf['failures']] == [0]
+    assert 'error' in wf['failures'][0]
+    assert 'failed' in caplog.text
+    assert all(row['params']['pfast'] != 0 for row in wf['windows'])
+    assert len(wf['equity']) == 800
+
+
+def test_every_parameter_set_failing_raises(data):
+    with pytest.raises(RuntimeError, match='every parameter set failed'):
+        walk_forward(m.MACross, dict(pfast=[0], pslow=[30]), data, train=400,
+                     test=200, processes=1)
@@ -1,14 +1,18 @@
-import pandas as pd
-import numpy as np
-import talib
-import time
-import ccxt
+import asyncio
+from datastore import OHLCVStore
+from prefetch import DataService
+from lazy import LazyClient
+from streaming import LiveIndicators
+from latency import LatencyMetrics
+from live import LiveRunner, PortfolioRunner, WebSocketFeed, warm_up
+from state import StateLog
+from ratelimit import RateLimitedExchange, pooled_async_session, pooled_sync_session
 
 # Set up API credentials for your preferred exchange
-exchange = ccxt.binance({
+credentials = {
     'apiKey': 'YOUR_API_KEY',
     'secret': 'YOUR_SECRET_KEY'
-})
+}
 
 # Define the parameters for MACD, RSI, and ADX indicators
 macd_fast = 12
@@ -18,88 +22,83 @@ rsi_period = 14
 adx_period = 14
 adx_threshold = 25
 
-# Define the symbol you want to trade and the timeframe for the candlestick data
-symbol = 'BTC/USDT'
-timeframe = '1h'
+# Define the symbols you want to trade and the timeframe for the candlestick data
+# of each, all traded from this process
+pairs = [
+    ('BTC/USDT', '1h'),
+]
 
-# Define the trade value in USDT
+# Define the trade value in USDT (per symbol)
 trade_value = 1000
 
 # Define the number of candles to use for confirmation
 confirmation_candles = 48 # 2 days for 1h timeframe
 
-# Set up an initial value for position
-position = None
-
-# Set up an infinite loop to keep the bot running
-while True:
-
-    # Fetch the candlestick data from the exchange
-    ohlcv = exchange.fetch_ohlcv(symbol, timeframe)
-    df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-    df.set_index('timestamp', inplace=True)
-    
-    # Calculate the MACD, RSI, and ADX indicators
-    macd, signal, hist = talib.MACD(df['close'], fastperiod=macd_fast, slowperiod=macd_slow, signalperiod=macd_signal)
-    rsi = talib.RSI(df['close'], timeperiod=rsi_period)
-    adx = talib.ADX(df['high'], df['low'], df['close'], timeperiod=adx_period)
-    
-    # Check if there is a bullish MACD crossover
-    if macd[-2] < signal[-2] and macd[-1] > signal[-1]:
-        
-        # Confirm the signal by checking if the MACD stays above the signal line for confirmation_candles
-        if np.all(macd[-confirmation_candles:] > signal[-confirmation_candles:]):
-            
-            # Confirm the signal by checking if the RSI is above 50 and the ADX is above the threshold
-            if rsi[-1] > 50 and adx[-1] > adx_threshold:
-
-                # Close a short position, if any
-                if position == 'short':
-                    order = exchange.create_market_buy_order(symbol, amount_short)
-                    print('Buy order executed at', order['price'], 'on', pd.to_datetime(order['timestamp'], unit='ms'))
-                    position = None
-                
-                # Enter a long position, if no position is open
-                if not position:
-                    # Calculate the amount to buy based on the trade value and the current price
-                    price = exchange.fetch_ticker(symbol)['bid']
-                    amount_long = trade_value / price
-
-                    order = exchange.create_market_buy_order(symbol, amount_long)
-                    print('Buy order executed at', order['price'], 'on', pd.to_datetime(order['timestamp'], unit='ms'))
-                    position = 'long'
-                
-                # Wait for 2 days before placing another order
-                time.sleep(172800) # 2 days = 2 * 24 * 60 * 60 seconds
-    
-    # Check if there is a bearish MACD crossover
-    elif macd[-2] > signal[-2] and macd[-1] < signal[-1]:
-        
-        # Confirm the signal by checking if the MACD stays below the signal line for confirmation_candles
-        if np.all(macd[-confirmation_candles:] < signal[-confirmation_candles:]):
-            
-            # Confirm the signal by checking if the RSI is below 50 and the ADX is above the threshold
-            if rsi[-1] < 50 and adx[-1] > adx_threshold:
-
-                # Close a short position, if any
-                if position == 'long':
-                    order = exchange.create_market_buy_order(symbol, amount_long)
-                    print('Buy order executed at', order['price'], 'on', pd.to_datetime(order['timestamp'], unit='ms'))
-                    position = None
-
-                # Enter a long position, if no position is open
-                if not position:
-
-                    # Calculate the amount to buy based on the trade value and the current price
-                    price = exchange.fetch_ticker(symbol)['bid']
-                    amount_short = trade_value / price
-
-                    # Enter a short position
-                    order = exchange.create_market_sell_order(symbol, amount_short)
-                    print('Sell order executed at', order['price'], 'on', pd.to_datetime)
-                    position = 'short'
-
-                # Wait for 2 days before placing another order
-                time.sleep(172800) # 2 days = 2 * 24 * 60 * 60 seconds
-                
+# Wait for 2 days before placing another order
+cooldown = 172800 # 2 days = 2 * 24 * 60 * 60 seconds
+
+# Latency of every stage of the candle-to-order path, dumped to this file
+# every minute and served on http://127.0.0.1:9108/metrics
+latency_file = 'latency.json'
+metrics_port = 9108
+
+# Write-ahead log and snapshots of the positions/orders/cooldowns
+state_dir = 'state'
+
+
+def rest_client():
+    import ccxt
+    rest = ccxt.binance(credentials)
+    rest.session = pooled_sync_session()
+    return rest
+
+
+def stream_client(session):
+    import ccxt.pro as ccxtpro
+    return ccxtpro.binance(dict(credentials, session=session, enableRateLimit=False))
+
+
+async def main():
+    # Closed candles are kept in the local OHLCV store, only the missing ones
+    # are fetched (REST, in concurrent batches) to warm up the indicator state
+    # of every pair at startup. The store is written through the data service,
+    # which locks each series against the data daemon (cli.py daemon)
+    service = DataService(OHLCVStore())
+    indicators = {pair: LiveIndicators(macd_fast, macd_slow, macd_signal, rsi_period, adx_period, confirmation_candles)
+                  for pair in pairs}
+    # The exchange clients are only built when first used
+    rest = LazyClient(rest_client)
+    await warm_up(service, rest, pairs, indicators)
+
+    # From then on closed candles arrive as events from the WebSocket stream,
+    # all pairs share one exchange client and have their own position state.
+    # REST calls go through the rate-limit aware request layer (orders first)
+    # over a keep-alive connection pool
+    session = pooled_async_session()
+    metrics = LatencyMetrics()
+    state = StateLog(state_dir)
+    state.recover()
+    exchange = RateLimitedExchange(LazyClient(lambda: stream_client(session)))
+    runners = [LiveRunner(exchange, symbol, None, indicators[(symbol, timeframe)],
+                          trade_value=trade_value, adx_threshold=adx_threshold, cooldown=cooldown,
+                          store=service, timeframe=timeframe, metrics=metrics, state=state)
+               for symbol, timeframe in pairs]
+    # Positions, orders in flight and cooldowns survive a crash/restart: the
+    # state is recovered from its log and reconciled with the exchange
+    for problems in await asyncio.gather(*(runner.restore() for runner in runners)):
+        for problem in problems:
+            print('State mismatch:', problem)
+    reporting = [asyncio.ensure_future(metrics.dump_every(latency_file, 60)),
+                 asyncio.ensure_future(metrics.serve(port=metrics_port))]
+    try:
+        await PortfolioRunner(WebSocketFeed(exchange, pairs), runners).run()
+    finally:
+        for task in reporting:
+            task.cancel()
+        metrics.dump(latency_file)
+        state.close()
+        await session.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
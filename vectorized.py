@@ -0,0 +1,532 @@
+'''
+Vectorized NumPy implementation of the strategies in models.py.
+
+Indicators and entry/exit signals are computed over whole arrays at once and
+the fills are resolved trade by trade (not bar by bar), following the same
+rules backtrader's Cerebro and BackBroker apply to the models.py strategies:
+
+  - An order created on bar i is filled at the open of bar i + 1
+  - Market orders size 1 unless the strategy sizes them itself
+  - A buy is rejected (Margin) if cash would go below 0 after cost and
+    commission
+  - The portfolio value is cash + position * close
+
+RSI_SMA_Strategy trades in next_open, so it only places orders when Cerebro
+runs with cheat_on_open=True (as in test_trading_strategies.py). There the
+indicators still hold the previous bar values, which gives the same
+"decide on bar i, fill at the open of bar i + 1" timing as the others.
+'''
+import numpy as np
+
+# Set to an indicator_cache.IndicatorCache to share the indicators computed
+# by the strategies between runs over the same data (None: no caching)
+CACHE = None
+
+
+# ---------------------------------------------------------------------------
+# Indicators (same seeding and warm up as the backtrader versions, NaN until
+# the minimum period is reached)
+# ---------------------------------------------------------------------------
+
+def sma(x, period):
+    x = np.asarray(x, dtype=float)
+    out = np.full(x.shape, np.nan)
+    if period > len(x):
+        return out
+    csum = np.cumsum(np.insert(x, 0, 0.0))
+    out[period - 1:] = (csum[period:] - csum[:-period]) / period
+    return out
+
+
+def _recurrence(x, a, y0):
+    '''
+    y[t] = a * y[t - 1] + x[t] with y[-1] = y0, without a Python loop per
+    element: the series is cut in blocks short enough for a ** -block not to
+    overflow, each block is solved with a cumsum and the carry between blocks
+    is the same recurrence one level up (with coefficient a ** block).
+    '''
+    n = len(x)
+    if n == 0:
+        return x.copy()
+    if a < 1e-50:
+        # older values vanish below float precision after one step
+        return x + a * np.concatenate(([y0], x[:-1]))
+    if a == 1.0:
+        return y0 + np.cumsum(x)
+    block = int(min(n, max(2, 100.0 * np.log(10.0) / -np.log(a))))
+    m = -(-n // block)
+    xb = np.zeros(m * block)
+    xb[:n] = x
+    xb = xb.reshape(m, block)
+    powers = a ** np.arange(block)
+    local = np.cumsum(xb / powers, axis=1) * powers
+    # value carried into each block from the previous ones
+    carry = np.empty(m)
+    carry[0] = y0
+    if m > 1:
+        carry[1:] = _recurrence(local[:-1, -1], a ** block, y0)
+    out = local + carry[:, None] * (a * powers)
+    return out.ravel()[:n]
+
+
+def _smoothing(x, period, alpha):
+    # Exponential smoothing seeded with the SMA of the first `period` valid
+    # values, like bt.indicators.ExponentialSmoothing
+    x = np.asarray(x, dtype=float)
+    out = np.full(x.shape, np.nan)
+    valid = np.flatnonzero(~np.isnan(x))
+    if len(valid) < period:
+        return out
+    start = valid[0] + period - 1
+    out[start] = x[start - period + 1:start + 1].mean()
+    out[start + 1:] = _recurrence(x[start + 1:] * alpha, 1.0 - alpha, out[start])
+    return out
+
+
+def ema(x, period):
+    return _smoothing(x, period, 2.0 / (1.0 + period))
+
+
+def smma(x, period):
+    # Wilder's smoothed moving average
+    return _smoothing(x, period, 1.0 / period)
+
+
+def macd(close, period_me1=12, period_me2=26, period_signal=9):
+    macd_line = ema(close, period_me1) - ema(close, period_me2)
+    return macd_line, ema(macd_line, period_signal)
+
+
+def true_range(high, low, close):
+    high = np.asarray(high, dtype=float)
+    low = np.asarray(low, dtype=float)
+    close = np.asarray(close, dtype=float)
+    prev_close = np.concatenate(([np.nan], close[:-1]))
+    return np.maximum(high, prev_close) - np.minimum(low, prev_close)
+
+
+def atr(high, low, close, period=14):
+    return smma(true_range(high, low, close), period)
+
+
+def rsi(close, period=14):
+    close = np.asarray(close, dtype=float)
+    diff = np.concatenate(([np.nan], np.diff(close)))
+    up = np.where(np.isnan(diff), np.nan, np.maximum(diff, 0.0))
+    down = np.where(np.isnan(diff), np.nan, np.maximum(-diff, 0.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = smma(up, period) / smma(down, period)
+    return 100.0 - 100.0 / (1.0 + rs)
+
+
+def crossover(a, b):
+    '''
+    1.0 if a crosses b upwards, -1.0 if a crosses b downwards, 0.0 otherwise.
+    Uses the last non zero difference, like bt.indicators.CrossOver
+    '''
+    diff = np.asarray(a, dtype=float) - np.asarray(b, dtype=float)
+    # forward fill zero differences with the last non zero one
+    idx = np.where(diff != 0.0, np.arange(len(diff)), 0)
+    np.maximum.accumulate(idx, out=idx)
+    nzd = diff[idx]
+    before = np.concatenate(([np.nan], nzd[:-1]))
+    up = (before < 0.0) & (diff > 0.0)
+    down = (before > 0.0) & (diff < 0.0)
+    return up.astype(float) - down.astype(float)
+
+
+# ---------------------------------------------------------------------------
+# Trade resolution helpers
+# ---------------------------------------------------------------------------
+
+def _next_true(mask, start):
+    # Index of the first True in mask[start:], or -1
+    if start >= len(mask):
+        return -1
+    pos = np.argmax(mask[start:])
+    if not mask[start + pos]:
+        return -1
+    return start + pos
+
+
+def _trailing_stop_exit(close, stopline, entry):
+    '''
+    First bar after entry whose close falls below the trailing stop, where
+    the stop is the running max of stopline since the entry bar. The search
+    runs in growing chunks so a trade only costs as many bars as it lasts.
+    '''
+    n = len(close)
+    pstop = -np.inf
+    start = entry + 1
+    chunk = 64
+    while start < n:
+        end = min(n, start + chunk)
+        # stop in force on each bar of the chunk (set by the previous bars)
+        stops = np.maximum.accumulate(stopline[start - 1:end - 1])
+        stops = np.maximum(stops, pstop)
+        hit = np.flatnonzero(close[start:end] < stops)
+        if len(hit):
+            return start + hit[0]
+        pstop = stops[-1]
+        start = end
+        chunk *= 2
+    return -1
+
+
+FILL_DTYPE = np.dtype([
+    ('bar', np.int64),      # index of the bar the order was executed on
+    ('size', np.float64),   # signed size (> 0 buy, < 0 sell)
+    ('price', np.float64),
+    ('comm', np.float64),
+])
+
+
+class Result(object):
+    '''Outcome of a vectorized backtest'''
+
+    def __init__(self, fills, cash, position, value, initial_cash):
+        self.fills = fills          # structured array with FILL_DTYPE
+        self.cash = cash            # cash per bar
+        self.position = position    # position size per bar
+        self.value = value          # portfolio value per bar
+        self.initial_cash = initial_cash
+
+    @property
+    def final_value(self):
+        return float(self.value[-1]) if len(self.value) else self.initial_cash
+
+    @property
+    def percentage_change(self):
+        return (self.final_value - self.initial_cash) / self.initial_cash * 100.0
+
+
+class _Broker(object):
+    # Cash bookkeeping while resolving trades, mirrors BackBroker for a
+    # stocklike percentage commission with shortcash=True
+
+    def __init__(self, opens, cash, commission):
+        self.opens = opens
+        self.cash = cash
+        self.commission = commission
+        self.fills = []
+
+    def execute(self, bar, size, opening=True):
+        price = self.opens[bar]
+        comm = abs(size) * price * self.commission
+        cash = self.cash - size * price - comm
+        if opening and cash < 0.0:
+            return False  # Margin
+        self.cash = cash
+        self.fills.append((bar, size, price, comm))
+        return True
+
+
+def _result(broker, close, cash):
+    fills = np.array(broker.fills, dtype=FILL_DTYPE)
+    n = len(close)
+    pos_delta = np.zeros(n)
+    cash_delta = np.zeros(n)
+    np.add.at(pos_delta, fills['bar'], fills['size'])
+    np.add.at(cash_delta, fills['bar'],
+              -fills['size'] * fills['price'] - fills['comm'])
+    position = np.cumsum(pos_delta)
+    cash_line = cash + np.cumsum(cash_delta)
+    return Result(fills, cash_line, position, cash_line + position * close, cash)
+
+
+def _toggle(broker, entry, exit_, size=1.0):
+    # Long only strategies: enter on `entry` when flat, leave on `exit_`.
+    # Decisions on bar i are filled on bar i + 1
+    n = len(entry)
+    i = 0
+    while True:
+        e = _next_true(entry[:n - 1], i)
+        if e < 0:
+            return
+        if not broker.execute(e + 1, size):
+            i = e + 1
+            continue
+        x = _next_true(exit_[:n - 1], e + 1)
+        if x < 0:
+            return
+        broker.execute(x + 1, -size, opening=False)
+        i = x + 1
+
+
+# ---------------------------------------------------------------------------
+# Strategies
+# ---------------------------------------------------------------------------
+
+def _indicator(fn, inputs, *params):
+    if CACHE is None:
+        return fn(*inputs, *params)
+    return CACHE.get(fn, inputs, *params)
+
+
+def _columns(data):
+    # Accepts a DataFrame/dict with open/high/low/close columns in any case
+    out = {}
+    keys = {str(k).lower(): k for k in data.keys()}
+    for name in ('open', 'high', 'low', 'close'):
+        out[name] = np.ascontiguousarray(data[keys[name]], dtype=float)
+    return out
+
+
+def macross_signals(data, pfast=1, pslow=5, **kwargs):
+    close = data['close']
+    sma_short = _indicator(sma, (close,), pfast)
+    sma_long = _indicator(sma, (close,), pslow)
+    prev_short = np.concatenate(([np.nan], sma_short[:-1]))
+    prev_long = np.concatenate(([np.nan], sma_long[:-1]))
+    buy = (sma_short > sma_long) & (prev_short < prev_long)
+    sell = (sma_short < sma_long) & (prev_short > prev_long)
+    return dict(buy=buy, signal=buy | sell)
+
+
+def macross_trades(signals, broker):
+    buy, signal = signals['buy'], signals['signal']
+    n = len(signal)
+    i = 0
+    while True:
+        e = _next_true(signal[:n - 1], i)
+        if e < 0:
+            return
+        size = 1.0 if buy[e] else -1.0
+        if not broker.execute(e + 1, size):
+            i = e + 1
+            continue
+        # close once 5 bars have passed since the execution bar
+        x = e + 1 + 5
+        if x >= n - 1:
+            return
+        broker.execute(x + 1, -size, opening=False)
+        i = x + 1
+
+
+def macd_signals(data, macd1=12, macd2=26, macdsig=9, atrperiod=14,
+                 atrdist=3.0, smaperiod=30, dirperiod=10, **kwargs):
+    close = data['close']
+    macd_line, signal = _indicator(macd, (close,), macd1, macd2, macdsig)
+    mcross = _indicator(crossover, (macd_line, signal))
+    sma_line = _indicator(sma, (close,), smaperiod)
+    smadir = sma_line - np.concatenate((np.full(dirperiod, np.nan),
+                                        sma_line[:-dirperiod]))
+    entry = (mcross > 0.0) & (smadir < 0.0)
+    stopline = close - _indicator(atr, (data['high'], data['low'], close), atrperiod) * atrdist
+    return dict(entry=entry, close=close, stopline=stopline)
+
+
+def macd_trades(signals, broker):
+    entry, close, stopline = signals['entry'], signals['close'], signals['stopline']
+    n = len(close)
+    i = 0
+    while True:
+        e = _next_true(entry[:n - 1], i)
+        if e < 0:
+            return
+        if not broker.execute(e + 1, 1.0):
+            i = e + 1
+            continue
+        x = _trailing_stop_exit(close[:n - 1], stopline, e)
+        if x < 0:
+            return
+        broker.execute(x + 1, -1.0, opening=False)
+        i = x + 1
+
+
+def ema_signals(data, ema_period=50, sma_period=200, **kwargs):
+    close = data['close']
+    ema_line = _indicator(ema, (close,), ema_period)
+    sma_line = _indicator(sma, (close,), sma_period)
+    return dict(entry=ema_line > sma_line, exit=ema_line < sma_line)
+
+
+def ema_trades(signals, broker):
+    _toggle(broker, signals['entry'], signals['exit'])
+
+
+def rsi_sma_signals(data, rsi_periods=21, sma_periods=14, sma_periods2=50,
+                    cheat_on_open=True, **kwargs):
+    close = data['close']
+    if not cheat_on_open:
+        # next_open is never called
+        never = np.zeros(len(close), dtype=bool)
+        return dict(entry=never, exit=never)
+    rsi_line = _indicator(rsi, (close,), rsi_periods)
+    sma14 = _indicator(sma, (close,), sma_periods)
+    sma50 = _indicator(sma, (close,), sma_periods2)
+    return dict(entry=(rsi_line > 30) & (sma14 > sma50),
+                exit=(rsi_line < 70) & (sma14 < sma50))
+
+
+def rsi_sma_trades(signals, broker):
+    entry, exit_ = signals['entry'], signals['exit']
+    opens = broker.opens
+    n = len(entry)
+    i = 0
+    while True:
+        # 'all-in' size at the open of the fill bar; while flat the cash does
+        # not change, so every candidate bar can be checked at once
+        candidates = np.flatnonzero(entry[i:n - 1]) + i
+        if not len(candidates):
+            return
+        fill_open = opens[candidates + 1]
+        size = np.floor(broker.cash / fill_open)
+        cost = size * fill_open * (1.0 + broker.commission)
+        ok = np.flatnonzero((size > 0) & (cost <= broker.cash))
+        if not len(ok):
+            return
+        e = candidates[ok[0]]
+        size = size[ok[0]]
+        broker.execute(e + 1, size)
+        x = _next_true(exit_[:n - 1], e + 1)
+        if x < 0:
+            return
+        broker.execute(x + 1, -size, opening=False)
+        i = x + 1
+
+
+# name -> (signals(data, **params), trades(signals, broker))
+STRATEGIES = {
+    'MACross': (macross_signals, macross_trades),
+    'MACD': (macd_signals, macd_trades),
+    'EMAStrategy': (ema_signals, ema_trades),
+    'RSI_SMA_Strategy': (rsi_sma_signals, rsi_sma_trades),
+}
+
+
+def _name_params(strategy, params):
+    # strategy class or class name -> (name, params with the class defaults)
+    if isinstance(strategy, str):
+        return strategy, params
+    return strategy.__name__, dict(strategy.params._getitems(), **params)
+
+
+def signals(strategy, data, cheat_on_open=True, **params):
+    '''
+    Indicators/entry/exit arrays of `strategy` over the whole of `data`,
+    computed once so run_signals() can resolve the trades of any range of
+    bars from views of them. Returns (columns, signals).
+    '''
+    name, params = _name_params(strategy, params)
+    columns = _columns(data)
+    return columns, STRATEGIES[name][0](columns, cheat_on_open=cheat_on_open, **params)
+
+
+def run_signals(strategy, columns, signals, cash=10000, commission=0.0,
+                start=0, end=None):
+    '''
+    Resolve the trades of precomputed `signals` (see signals()) over the bars
+    [start, end) only, starting flat with `cash`. The arrays are sliced, not
+    copied, and the indicators keep the warm up of the bars before `start`.
+    '''
+    name = strategy if isinstance(strategy, str) else strategy.__name__
+    window = slice(start, end)
+    broker = _Broker(columns['open'][window], float(cash), commission)
+    STRATEGIES[name][1]({k: v[window] for k, v in signals.items()}, broker)
+    return _result(broker, columns['close'][window], float(cash))
+
+
+def backtest(strategy, data, cash=10000, commission=0.0, cheat_on_open=True,
+             **params):
+    '''
+    Run one of the models.py strategies (class or class name) over `data`, a
+    DataFrame or dict with open/high/low/close columns. Strategy params
+    default to the ones of the models.py class.
+    '''
+    columns, sigs = signals(strategy, data, cheat_on_open=cheat_on_open, **params)
+    return run_signals(strategy, columns, sigs, cash=cash, commission=commission)
+
+
+def _timestamps(data):
+    # open time (epoch ms) of every bar: 'timestamp' column or datetime index
+    keys = {str(k).lower(): k for k in data.keys()}
+    if 'timestamp' in keys:
+        return np.asarray(data[keys['timestamp']], dtype=np.int64)
+    return np.asarray(data.index, dtype='datetime64[ms]').astype(np.int64)
+
+
+def replay_core(core, data, cash=10000, commission=0.0):
+    '''
+    Replay adapter of an event-driven core.SignalCore: feeds the bars of
+    `data` (DataFrame with a datetime index, or dict of arrays with a
+    'timestamp' column) to the core one at a time and fills its order intents
+    with the rules of this module (at the open of the next bar, cash checked
+    like BackBroker), sized with the close of the signal bar.
+
+    The rules of the core are sequential (confirmation counts, cooldown,
+    position), so this loops over the bars; the fills and the value curve
+    are then built vectorized like backtest(). Matches models.LiveRules run
+    by Cerebro.
+    '''
+    columns = _columns(data)
+    timestamps = _timestamps(data).tolist()
+    high, low, close = (columns[c].tolist() for c in ('high', 'low', 'close'))
+    broker = _Broker(columns['open'], float(cash), commission)
+    pending = []
+    for i, (timestamp, h, l, c) in enumerate(zip(timestamps, high, low, close)):
+        for intent, size in pending:
+            signed = size if intent.side == 'buy' else -size
+            if broker.execute(i, signed, opening=intent.action == 'open'):
+                core.filled(intent, size)
+            else:
+                core.cancelled(intent)
+        pending = [(intent, intent.amount if intent.action == 'close' else intent.value / c)
+                   for intent in core.on_bar(timestamp, h, l, c)]
+    for intent, _ in pending:
+        core.cancelled(intent)  # no bar left to fill them
+    return _result(broker, columns['close'], float(cash))
+
+
+def compare_with_cerebro(strategy, data, cash=10000, commission=0.001,
+                         cheat_on_open=True, rtol=1e-6, **params):
+    '''
+    Run `strategy` both through Cerebro and vectorized with the setup of
+    test_trading_strategies.py and check that the fills and the final
+    portfolio value match. `data` must be a DataFrame with a datetime index
+    (or a 'Date' column) that bt.feeds.PandasData accepts.
+    '''
+    import backtrader as bt
+
+    class Fills(bt.Analyzer):
+        def start(self):
+            self.fills = []
+
+        def notify_order(self, order):
+            if order.status == order.Completed:
+                self.fills.append((len(self.strategy) - 1, order.executed.size,
+                                   order.executed.price, order.executed.comm))
+
+        def get_analysis(self):
+            return self.fills
+
+    cerebro = bt.Cerebro(stdstats=False, cheat_on_open=cheat_on_open)
+    cerebro.addstrategy(strategy, **params)
+    cerebro.broker.set_cash(cash)
+    cerebro.broker.setcommission(commission=commission)
+    cerebro.addanalyzer(Fills, _name='fills')
+    if 'Date' in data.columns:
+        cerebro.adddata(bt.feeds.PandasData(dataname=data, datetime='Date'))
+    else:
+        cerebro.adddata(bt.feeds.PandasData(dataname=data))
+    strat = cerebro.run()[0]
+    bt_fills = np.array(strat.analyzers.fills.get_analysis(), dtype=FILL_DTYPE)
+    bt_value = cerebro.broker.getvalue()
+
+    result = backtest(strategy, data, cash=cash, commission=commission,
+                      cheat_on_open=cheat_on_open, **params)
+    fills_match = (
+        len(bt_fills) == len(result.fills)
+        and np.array_equal(bt_fills['bar'], result.fills['bar'])
+        and np.allclose(bt_fills['size'], result.fills['size'], rtol=rtol)
+        and np.allclose(bt_fills['price'], result.fills['price'], rtol=rtol)
+        and np.allclose(bt_fills['comm'], result.fills['comm'], rtol=rtol)
+    )
+    return dict(
+        fills_match=bool(fills_match),
+        value_match=bool(np.isclose(bt_value, result.final_value, rtol=rtol)),
+        cerebro_fills=bt_fills,
+        vectorized_fills=result.fills,
+        cerebro_value=bt_value,
+        vectorized_value=result.final_value,
+    )
@@ -0,0 +1,214 @@
+'''
+Walk-forward analysis of the strategies in models.py.
+
+The data is cut in rolling windows: the parameters are optimized on the
+training bars of window N and then traded, unchanged, on the test bars that
+follow it. The test periods are contiguous, so chaining them gives an out of
+sample equity curve over the whole span.
+
+The indicators of every parameter set are computed once over the full series
+(vectorized.signals) and each window only resolves the trades over views of
+those arrays, so the warm up of a window comes from the bars before it and
+nothing is copied per window. The data sits in one shared memory block and
+the parameter sets (training) and the windows (testing) are spread over a
+pool of processes.
+
+    wf = walk_forward(m.MACD, dict(macd1=[8, 12], macd2=[21, 26]), data,
+                      train=500, test=100)
+    wf['equity'].plot()
+'''
+import csv
+import logging
+import multiprocessing as mp
+from collections import defaultdict
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import models as m
+import vectorized
+from indicator_cache import IndicatorCache
+from optimization import COLUMNS, metrics, param_grid, share_frame
+
+log = logging.getLogger(__name__)
+
+# Per worker state, set by _init_worker
+_worker = {}
+
+
+def windows(n, train, test, step=None, anchored=False):
+    '''
+    (train_start, test_start, test_end) bar ranges over n bars: `train` bars
+    to optimize on followed by `test` bars to trade, moved by `step` (=
+    `test`) bars at a time. With `anchored` the training always starts at 0.
+    '''
+    step = step or test
+    if step < test:
+        raise ValueError('step must be >= test, the test windows would overlap')
+    out = []
+    start = 0
+    while start + train + test <= n:
+        out.append((0 if anchored else start, start + train, start + train + test))
+        start += step
+    return out
+
+
+def _score(values, objective, periods):
+    score = metrics(values, periods)[objective]
+    return score if score == score else -np.inf
+
+
+def _init_worker(shm_name, n, strategy, cash, commission, cheat_on_open,
+                 periods, objective, ranges):
+    m.LOG_TRADES = False
+    logging.disable(logging.INFO)
+    # the tasks of a worker share the indicators they have in common
+    vectorized.CACHE = IndicatorCache()
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    block = np.ndarray((len(COLUMNS) + 1, n), dtype=np.float64, buffer=shm.buf)
+    _worker.update(
+        shm=shm,  # keep the mapping alive
+        data={name: block[i] for i, name in enumerate(COLUMNS)},
+        strategy=strategy, cash=cash, commission=commission,
+        cheat_on_open=cheat_on_open, periods=periods, objective=objective,
+        ranges=ranges,
+    )
+
+
+def _train_task(task):
+    # score of one parameter set on the training bars of every window
+    # (-inf everywhere and the error when it fails)
+    i, params = task
+    w = _worker
+    try:
+        columns, sigs = vectorized.signals(w['strategy'], w['data'],
+                                           w['cheat_on_open'], **params)
+        scores = []
+        for train_start, test_start, _ in w['ranges']:
+            result = vectorized.run_signals(w['strategy'], columns, sigs, w['cash'],
+                                            w['commission'], train_start, test_start)
+            values = np.concatenate(([w['cash']], result.value))
+            scores.append(_score(values, w['objective'], w['periods']))
+    except Exception as e:
+        return i, [-np.inf] * len(w['ranges']), repr(e)
+    return i, scores, None
+
+
+def _test_task(task):
+    # value curve of one parameter set on the test bars of its windows
+    params, window_ids = task
+    w = _worker
+    columns, sigs = vectorized.signals(w['strategy'], w['data'],
+                                       w['cheat_on_open'], **params)
+    out = []
+    for k in window_ids:
+        _, test_start, test_end = w['ranges'][k]
+        result = vectorized.run_signals(w['strategy'], columns, sigs, w['cash'],
+                                        w['commission'], test_start, test_end)
+        out.append((k, result.value, len(result.fills)))
+    return out
+
+
+def walk_forward(strategy, grid, data, train, test, step=None, anchored=False,
+                 objective='sharpe', processes=None, cash=10000,
+                 commission=0.001, cheat_on_open=True, periods=252,
+                 constraint=None, out=None):
+    '''
+    Walk-forward optimization of `strategy` over `data` (DataFrame with a
+    datetime index and OHLCV columns) with the vectorized engine.
+
+    For every window the parameter set of `grid` with the best `objective`
+    (a metrics() key) on the training bars is traded on the test bars. Each
+    test window starts flat with `cash` and the combined out of sample
+    equity compounds the window returns. The per window rows are written to
+    `out` (CSV) if given.
+
+    A parameter set that fails (e.g. invalid periods) is logged, left out of
+    the choice and reported in `failures`; if all of them fail a
+    RuntimeError is raised.
+
+    Returns dict(windows=[rows], equity=Series, metrics=dict,
+    failures=[dict(params, error=...)]).
+    '''
+    combos = param_grid(grid, constraint)
+    n = len(data)
+    ranges = windows(n, train, test, step, anchored)
+    if not ranges or not combos:
+        raise ValueError('no windows/parameters to walk forward')
+    index = pd.DatetimeIndex(data.index)
+
+    shm, _ = share_frame(data)
+    try:
+        initargs = (shm.name, n, strategy, cash, commission, cheat_on_open,
+                    periods, objective, ranges)
+        with mp.Pool(processes, initializer=_init_worker, initargs=initargs) as pool:
+            scores = np.empty((len(combos), len(ranges)))
+            failures = []
+            for i, row, error in pool.imap_unordered(_train_task, enumerate(combos)):
+                scores[i] = row
+                if error is not None:
+                    log.warning('%s %s failed: %s', getattr(strategy, '__name__', strategy),
+                                combos[i], error)
+                    failures.append(dict(combos[i], error=error))
+            if len(failures) == len(combos):
+                raise RuntimeError(f'every parameter set failed, e.g. {failures[0]}')
+            best = scores.argmax(axis=0)
+
+            # one test task per distinct winning parameter set
+            by_params = defaultdict(list)
+            for k, i in enumerate(best):
+                by_params[int(i)].append(k)
+            tests = {}
+            tasks = [(combos[i], ks) for i, ks in by_params.items()]
+            for results in pool.imap_unordered(_test_task, tasks):
+                for k, values, fills in results:
+                    tests[k] = (values, fills)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    rows = []
+    curves = []
+    equity = float(cash)
+    for k, (train_start, test_start, test_end) in enumerate(ranges):
+        values, fills = tests[k]
+        test_metrics = metrics(np.concatenate(([cash], values)), periods)
+        curves.append(values * (equity / cash))
+        equity = float(curves[-1][-1])
+        rows.append(dict(
+            window=k,
+            train_start=index[train_start], test_start=index[test_start],
+            test_end=index[test_end - 1],
+            params=combos[best[k]], train_score=float(scores[best[k], k]),
+            fills=fills, **{'test_' + key: v for key, v in test_metrics.items()},
+        ))
+
+    curve = np.concatenate(curves)
+    equity_curve = pd.Series(curve, index=index[ranges[0][1]:ranges[-1][2]],
+                             name='equity')
+    if out:
+        with open(out, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    return dict(windows=rows, equity=equity_curve,
+                metrics=metrics(np.concatenate(([cash], curve)), periods),
+                failures=failures)
+
+
+if __name__ == '__main__':
+    from datastore import OHLCVStore, stooq_fetcher
+
+    store = OHLCVStore()
+    store.update("MSTR.US", '1d', stooq_fetcher("MSTR.US"))
+    data = store.frame("MSTR.US", '1d')
+
+    grid = dict(macd1=[8, 12, 16], macd2=[21, 26, 34], atrdist=[2.0, 3.0, 4.0])
+    wf = walk_forward(m.MACD, grid, data, train=504, test=126,
+                      out='macd_walk_forward.csv',
+                      constraint=lambda p: p['macd1'] < p['macd2'])
+    for row in wf['windows']:
+        print(row['test_start'].date(), row['params'], f"{row['test_return_pct']:.2f}%")
+    print('out of sample:', wf['metrics'])